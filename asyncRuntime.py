@@ -0,0 +1,136 @@
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+
+runtime_info = logging.getLogger("info." + __name__)
+runtime_warn = logging.getLogger("warn." + __name__)
+
+
+class BotProxy:
+    """
+    Stands in for the Bot inside handlers run by AsyncRuntime. send_message() hands the send to the event loop and
+    returns straight away. Sends to one chat keep their order, sends to different chats run concurrently
+    """
+
+    def __init__(self, runtime, bot):
+        self._runtime = runtime
+        self._bot = bot
+
+    def send_message(self, chat_id, text, **kwargs):
+        self._runtime.loop.call_soon_threadsafe(self._runtime.queue_send, self._bot, chat_id, text, kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._bot, name)
+
+
+def unwrap_bot(bot):
+    """Returns the Bot behind a BotProxy, or bot itself if it isn't one"""
+    return bot._bot if isinstance(bot, BotProxy) else bot
+
+
+class AsyncRuntime:
+    """
+    Runs bot handlers as coroutines on an asyncio loop in its own thread.
+    Blocking SQLite work runs on a bounded thread pool, slow admin commands (like /update) get a pool of their own so
+    they can never take every database worker, and Telegram sends run on a third pool
+    """
+
+    def __init__(self, db_workers=4, send_workers=8, slow_workers=1):
+        self.loop = asyncio.new_event_loop()
+        self._db_pool = ThreadPoolExecutor(max_workers=db_workers)
+        self._slow_pool = ThreadPoolExecutor(max_workers=slow_workers)
+        self._send_pool = ThreadPoolExecutor(max_workers=send_workers)
+        # chat_id -> the last send queued for that chat, so the next one can wait its turn
+        self._chat_tails = {}
+        # Handlers the dispatcher didn't wait for, so stop() can let them finish
+        self._running = set()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run_loop, name="async-runtime", daemon=True)
+        self._thread.start()
+        runtime_info.info("Async runtime started")
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self):
+        """Finishes running handlers and queued sends, then stops the loop and the thread pools"""
+        if self._thread:
+            wait_futures(list(self._running))
+            asyncio.run_coroutine_threadsafe(self._drain(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self._thread = None
+        for pool in (self._db_pool, self._slow_pool, self._send_pool):
+            pool.shutdown(wait=True)
+        runtime_info.info("Async runtime stopped")
+
+    async def _drain(self):
+        tails = list(self._chat_tails.values())
+        if tails:
+            await asyncio.wait(tails)
+
+    async def run_blocking(self, func, *args, slow=False, **kwargs):
+        """Runs a blocking function on the database pool (or the slow pool) and returns its result"""
+        pool = self._slow_pool if slow else self._db_pool
+        return await self.loop.run_in_executor(pool, functools.partial(func, *args, **kwargs))
+
+    def queue_send(self, bot, chat_id, text, kwargs):
+        """Schedules a send behind any earlier sends to the same chat. Must be called on the loop thread"""
+        previous = self._chat_tails.get(chat_id)
+        task = self.loop.create_task(self._send_after(previous, bot, chat_id, text, kwargs))
+        self._chat_tails[chat_id] = task
+        task.add_done_callback(functools.partial(self._forget_tail, chat_id))
+
+    def _forget_tail(self, chat_id, task):
+        if self._chat_tails.get(chat_id) is task:
+            del self._chat_tails[chat_id]
+
+    async def _send_after(self, previous, bot, chat_id, text, kwargs):
+        if previous:
+            await asyncio.wait([previous])
+        try:
+            await self.loop.run_in_executor(
+                self._send_pool, functools.partial(bot.send_message, chat_id=chat_id, text=text, **kwargs))
+        except Exception as e:
+            runtime_warn.error("Failed to send message to chat {}: {}".format(chat_id, e))
+
+    def offload(self, handler, slow=False):
+        """
+        Turns a regular (bot, update, ...) handler into a coroutine function that runs it on a worker thread with a
+        BotProxy in place of the bot
+        """
+        async def coroutine(bot, update, *args, **kwargs):
+            return await self.run_blocking(handler, BotProxy(self, bot), update, *args, slow=slow, **kwargs)
+        coroutine.__name__ = handler.__name__
+        return coroutine
+
+    def callback(self, coroutine_function, wait=False, next_state=None):
+        """
+        Wraps a coroutine function so the dispatcher can call it like a regular handler
+        :param coroutine_function: async function taking (bot, update, ...)
+        :param wait: ConversationHandler callbacks have to return the next state, so the dispatcher waits for them.
+        Plain commands return straight away and finish on the loop
+        :param next_state: for conversation callbacks whose next state is known without running them, a function
+        taking the same (update, ...) arguments and returning it. The dispatcher gets that state straight away and
+        the handler finishes on the loop, like a plain command
+        """
+        @functools.wraps(coroutine_function)
+        def handler(bot, update, *args, **kwargs):
+            future = asyncio.run_coroutine_threadsafe(coroutine_function(bot, update, *args, **kwargs), self.loop)
+            if wait and next_state is None:
+                return future.result()
+            self._running.add(future)
+            future.add_done_callback(self._finished)
+            if next_state is not None:
+                return next_state(update, *args, **kwargs)
+        return handler
+
+    def _finished(self, future):
+        self._running.discard(future)
+        if future.exception():
+            runtime_warn.error("Handler failed: {}".format(future.exception()))
@@ -0,0 +1,554 @@
+#! python3
+"""
+Rough timings for the bot's slow paths, run against throwaway databases so drinks.db is never touched.
+Usage: python3 benchmark.py builder [rows]
+       python3 benchmark.py parser [cells]
+       python3 benchmark.py asyncload [requests]
+       python3 benchmark.py engines [operations]
+       python3 benchmark.py search [drinks]
+       python3 benchmark.py suite [small|large] [save]
+       python3 benchmark.py botload [users] [polling|webhook] [limited]
+The suite runs every command path against databases from generateDb and compares them with benchmark_baseline.json,
+"save" writes the results there as the new baseline.
+"""
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, selectinload
+
+import catalog
+import dbEngine
+import drinksSqlDb
+import generateDb
+import ingParser
+import outbound
+from sqlMetrics import QueryCounter
+
+# Ingredient cells per second the parser should manage without its cache, on the Pi as well as a desktop
+PARSE_TARGET = 50000
+
+BASELINE_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), "benchmark_baseline.json")
+# (drinks, distinct ingredients, users) generated for each suite scale
+SUITE_SCALES = {"small": (1000, 300, 2000), "large": (10000, 2000, 100000)}
+# A path is reported as a regression when its p50 is this many times the baseline's, or it runs more queries
+REGRESSION_RATIO = 1.5
+
+
+class RowFrame:
+    """Stands in for the pygsheets dataframe. itertuples() yields rows laid out like the AllDrinks worksheet:
+    drink name, page, ten ingredient cells and a garnish"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def itertuples(self):
+        return iter(self.rows)
+
+
+def make_sheet_rows(count, seed=1):
+    """
+    Builds fake AllDrinks rows with a realistic amount of ingredient reuse
+    :param count: number of drinks
+    :param seed: random seed, so runs are repeatable
+    :return: RowFrame
+    """
+    rand = random.Random(seed)
+    spirits = ["GIN", "RUM", "BOURBON", "RYE", "TEQUILA", "MEZCAL", "BRANDY", "VODKA", "COGNAC", "PISCO"]
+    brands = ["HOUSE", "OLD", "NEW", "RESERVE", "BLANCO", "NAVY", "GOLD", "LONDON DRY", "SMALL BATCH", "VS"]
+    modifiers = ["LEMON JUICE", "LIME JUICE", "SIMPLE SYRUP", "HONEY SYRUP", "SWEET VERMOUTH", "DRY VERMOUTH",
+                 "CAMPARI", "MARASCHINO LIQUEUR", "GREEN CHARTREUSE", "ORGEAT", "GRAPEFRUIT JUICE", "CREME DE CACAO"]
+    amounts = ["2", "1.5", "1", ".75", ".5", ".25"]
+    garnishes = ["1 LEMON TWIST", "1 LIME WHEEL", "1 BRANDIED CHERRY", "1 ORANGE TWIST", "1 MINT SPRIG", ""]
+    first_words = ["Old", "Last", "Golden", "Smoky", "Paper", "Naked", "Hanky", "Corpse", "Jungle", "Bitter"]
+    last_words = ["Fashioned", "Word", "Dawn", "Sling", "Plane", "Reviver", "Bird", "Panky", "Fizz", "Daisy"]
+
+    rows = []
+    for number in range(count):
+        cells = ["{} {} {}".format(rand.choice(amounts), rand.choice(brands), rand.choice(spirits))]
+        for modifier in rand.sample(modifiers, rand.randint(1, 4)):
+            cells.append("{} {}".format(rand.choice(amounts), modifier))
+        if rand.random() < 0.5:
+            cells.append("{} DASHES ANGOSTURA BITTERS".format(rand.randint(1, 3)))
+        cells += [""] * (10 - len(cells))
+        name = "{} {} {}".format(rand.choice(first_words), rand.choice(last_words), number)
+        rows.append(tuple([name, str(number // 4)] + cells + [rand.choice(garnishes)]))
+    return RowFrame(rows)
+
+
+def fresh_database():
+    """Creates an empty drinks database in a temp file and points drinksSqlDb at it. Returns the file path"""
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    drinksSqlDb.use_database(path).dispose()
+    drinksSqlDb.Base.metadata.create_all(drinksSqlDb.build_engine)
+    return path
+
+
+def bench_builder(rows=500):
+    """Compares rows/sec for the per-row DB_Builder.sql_from_itertuples() and the bulk build"""
+    frame = make_sheet_rows(rows)
+    builder = drinksSqlDb.DB_Builder()
+    original = drinksSqlDb.engine.url.database
+    try:
+        for label, build in (("per row", builder.sql_from_itertuples), ("bulk", builder.sql_bulk_from_itertuples)):
+            path = fresh_database()
+            start = time.perf_counter()
+            build(frame)
+            elapsed = time.perf_counter() - start
+            print("{:>8}: {} rows in {:.2f}s, {:.0f} rows/sec".format(label, rows, elapsed, rows / elapsed))
+            drinksSqlDb.engine.dispose()
+            drinksSqlDb.build_engine.dispose()
+            os.remove(path)
+    finally:
+        drinksSqlDb.use_database(original).dispose()
+
+
+def bench_parser(cells=100000):
+    """Times ingParser on ingredient cells, one at a time without the cache and as a cached column"""
+    sheet_cells = [cell for row in make_sheet_rows(500).rows for cell in row[2:12] if cell]
+    sheet_cells += ["1 1/2 RYE WHISKEY", "3/4 OZ. LEMON JUICE", "1-2 DASHES PEYCHAUD'S BITTERS", "1 EGG WHITE"]
+    column = [sheet_cells[index % len(sheet_cells)] for index in range(cells)]
+
+    uncached = ingParser.parse_ingredient.__wrapped__
+    start = time.perf_counter()
+    for cell in column:
+        uncached(cell)
+    rate = cells / (time.perf_counter() - start)
+    print("  single: {:.0f} cells/sec (target {}, {})".format(
+        rate, PARSE_TARGET, "met" if rate >= PARSE_TARGET else "MISSED"))
+
+    ingParser.parse_ingredient.cache_clear()
+    start = time.perf_counter()
+    ingParser.parse_column(column)
+    print("  column: {:.0f} cells/sec with {} distinct cells".format(
+        cells / (time.perf_counter() - start), len(set(column))))
+
+
+def _run_threads(count, work):
+    """Runs work(thread_number) on count threads at once. Returns (seconds taken, number of calls that raised)"""
+    errors = []
+
+    def run(number):
+        try:
+            work(number)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(number,)) for number in range(count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, len(errors)
+
+
+def bench_engines(operations=2000, threads=4):
+    """
+    Compares a bare create_engine() with the dbEngine engines: concurrent inventory writes and reads on user.db,
+    and concurrent recipe lookups on drinks.db
+    """
+    import dbUpdater
+    import userSqlDb
+    from drinksSqlDb import Drink
+    from userSqlDb import User, Inventory, inv_assc_table
+
+    work_dir = tempfile.mkdtemp()
+    source = os.path.join(work_dir, "source.db")
+    shutil.copy(drinksSqlDb.DB_PATH, source)
+    # The copy may come from an older drinks.db, bring it up to date like the bot does at startup
+    dbUpdater.upgrade_drinks_db(source)
+    per_thread = operations // threads
+    try:
+        for label, make_user, make_drinks in (("default", None, None),
+                                              ("tuned", dbEngine.user_engine, dbEngine.drinks_engine)):
+            user_path = os.path.join(work_dir, "{}_user.db".format(label))
+            drinks_path = os.path.join(work_dir, "{}_drinks.db".format(label))
+            shutil.copy(source, drinks_path)
+            user_engine = make_user(user_path) if make_user else create_engine('sqlite:///{}'.format(user_path))
+            drinks_engine = (make_drinks(drinks_path) if make_drinks
+                             else create_engine('sqlite:///{}'.format(drinks_path)))
+            userSqlDb.Base.metadata.create_all(user_engine)
+            UserSession = sessionmaker(bind=user_engine)
+            DrinkSession = sessionmaker(bind=drinks_engine)
+            session = DrinkSession()
+            drink_names = [name for name, in session.query(Drink.drink_name)]
+            session.close()
+            session = UserSession()
+            session.add_all(User(user_id=number, first_name="User", chat_id=number) for number in range(threads))
+            session.commit()
+            session.close()
+
+            def add_inventory(number):
+                # One commit per item, the way /addinv works
+                for item in range(per_thread):
+                    stock = "ITEM {} {}".format(number, item)
+                    session = UserSession()
+                    session.execute(Inventory.__table__.insert(), {"stock": stock})
+                    session.execute(inv_assc_table.insert(), {"User_user_id": number, "Inventory_stock": stock})
+                    session.commit()
+                    session.close()
+
+            def read_inventory(number):
+                for item in range(per_thread):
+                    session = UserSession()
+                    session.query(inv_assc_table).filter(inv_assc_table.c.User_user_id == number,
+                                                         inv_assc_table.c.Inventory_stock == "ITEM {} {}".format(
+                                                             number, item)).first()
+                    session.close()
+
+            def read_recipes(number):
+                for item in range(per_thread):
+                    session = DrinkSession()
+                    drink = session.query(Drink).options(selectinload(Drink.ingredients)).filter(
+                        Drink.drink_name == drink_names[(number * per_thread + item) % len(drink_names)]).first()
+                    len(drink.ingredients)
+                    session.close()
+
+            for name, work in (("user writes", add_inventory), ("user reads", read_inventory),
+                               ("drink reads", read_recipes)):
+                elapsed, errors = _run_threads(threads, work)
+                print("{:>8} {:>11}: {:.0f} ops/sec{}".format(
+                    label, name, per_thread * threads / elapsed, ", {} threads failed".format(errors) if errors else ""))
+            user_engine.dispose()
+            drinks_engine.dispose()
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def _time_calls(calls):
+    """Runs each no-argument function once. Returns a list of milliseconds taken"""
+    timings = []
+    for call in calls:
+        start = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def bench_search(drinks=10000, searches=300):
+    """
+    Compares search latency on the in-memory catalog with the ftsIndex tables, for /drinks, /ing and /addinv
+    suggestions, against a generated database
+    """
+    import searchDB
+
+    frame = make_sheet_rows(drinks)
+    original = drinksSqlDb.DB_PATH
+    path = fresh_database()
+    try:
+        builder = drinksSqlDb.DB_Builder()
+        builder.sql_bulk_from_itertuples(frame)
+        builder.populate_simple_drink()
+        drink_catalog = catalog.load_catalog()
+        session = drinksSqlDb.Session()
+
+        rand = random.Random(2)
+        names = list(drink_catalog.recipes)
+        drink_terms = [[rand.choice(names).split()[rand.randint(0, 1)][:rand.randint(3, 6)]] for _ in range(searches)]
+        ing_terms = [rand.choice(["gin", "lime juice", "sweet verm", "angostura", "campari", "rye", "orgeat"])
+                     for _ in range(searches)]
+        print("{} drinks, {} searches per path".format(len(drink_catalog), searches))
+        for label, index_session in (("catalog", None), ("fts", session)):
+            paths = (
+                ("/drinks", [functools.partial(searchDB.drink_search, terms, 10, drink_catalog, index_session)
+                             for terms in drink_terms]),
+                ("/ing", [functools.partial(searchDB.ing_search, term, index_session, drink_catalog)
+                          for term in ing_terms]),
+                ("suggest", [functools.partial(searchDB.ingredient_suggestions, term, index_session, drink_catalog)
+                             for term in ing_terms]),
+            )
+            for path_name, calls in paths:
+                timings = _time_calls(calls)
+                print("{:>8} {:>8}: p50 {:.2f}ms, p99 {:.2f}ms".format(
+                    label, path_name, percentile(timings, 50), percentile(timings, 99)))
+        session.close()
+    finally:
+        drinksSqlDb.use_database(original).dispose()
+        os.remove(path)
+
+
+def percentile(values, percent):
+    """Returns the value below which percent of the (non-empty) values fall"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100.0))]
+
+
+def _run_path(calls, engines):
+    """
+    Runs each no-argument function once, counting the statements sent through engines
+    :return: tuple of (list of milliseconds taken, list of statements run) for each call
+    """
+    counters = [QueryCounter(engine) for engine in engines]
+    for counter in counters:
+        counter.__enter__()
+    timings, queries = [], []
+    try:
+        for call in calls:
+            before = sum(counter.count for counter in counters)
+            start = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - start) * 1000)
+            queries.append(sum(counter.count for counter in counters) - before)
+    finally:
+        for counter in counters:
+            counter.__exit__(None, None, None)
+    return timings, queries
+
+
+def _suite_calls(telegramBot, bot, drink_catalog, stock_names, users, samples, rand):
+    """Returns (path name, list of calls) for every command path, each call being one update through its handler"""
+    import unitOfWork
+    from fakeBot import make_update
+
+    def handler_call(callback, text, user_id, args=None):
+        update = make_update(text, user_id=user_id)
+        wrapped = unitOfWork.per_update(callback)
+        if args is None:
+            return functools.partial(wrapped, bot, update)
+        return functools.partial(wrapped, bot, update, args=args)
+
+    names = list(drink_catalog.recipes)
+    # A distinct user for every sample, so /makeable builds each set from scratch the way it does after a restart
+    user_ids = rand.sample(range(1, users + 1), min(users, samples))
+    paths = []
+
+    calls = []
+    for _ in range(samples):
+        words = rand.choice(names).split()
+        term = words[0] if rand.random() < 0.5 else " ".join(words[:2])
+        calls.append(handler_call(telegramBot.drinks, "/drinks " + term, rand.choice(user_ids), term.split()))
+    paths.append(("/drinks", calls))
+
+    calls = []
+    for _ in range(samples):
+        term = rand.choice(stock_names).split()[-1].lower()
+        calls.append(handler_call(telegramBot.ing, "/ing " + term, rand.choice(user_ids), [term]))
+    paths.append(("/ing", calls))
+
+    # Mostly exact names that get added, some partial ones that get suggestions instead
+    calls = []
+    for user_id in user_ids:
+        name = rand.choice(stock_names)
+        text = name.title() if rand.random() < 0.7 else name.split()[-1][:4]
+        calls.append(handler_call(telegramBot.add_user_inv, text, user_id))
+    paths.append(("/addinv", calls))
+
+    paths.append(("/makeable", [handler_call(telegramBot.makeable, "/makeable", user_id) for user_id in user_ids]))
+    paths.append(("/almost", [handler_call(telegramBot.almost, "/almost", user_id, []) for user_id in user_ids]))
+    paths.append(("/fav", [handler_call(telegramBot.favorite_recipes, "/fav", user_id) for user_id in user_ids]))
+    return paths
+
+
+def bench_suite(scale="small", save=False, samples=300):
+    """
+    Generates drinks.db and user.db at one of SUITE_SCALES, then times each command's handler and counts the SQL it
+    runs. Prints p50/p95/p99 and queries per update for every path, compared with the saved baseline
+    :param scale: key of SUITE_SCALES
+    :param save: if True, the results replace the baseline for this scale in BASELINE_PATH
+    :param samples: updates run per path
+    """
+    import makeableCache
+    import telegramBot
+    import userSqlDb
+    from fakeBot import FakeBot
+    from readJSON import Settings
+
+    drinks, ingredients, users = SUITE_SCALES[scale]
+    telegramBot.settings = Settings()
+    telegramBot.info_log = logging.getLogger("info.telegramBot")
+    telegramBot.warn_log = logging.getLogger("warn.telegramBot")
+    telegramBot.outbox = outbound.Outbox(global_rate=10000, chat_rate=10000, chat_burst=10000)
+
+    work_dir = tempfile.mkdtemp()
+    original_drinks, original_users = drinksSqlDb.DB_PATH, userSqlDb.USER_DB_PATH
+    original_store = makeableCache.store
+    try:
+        print("Generating {} drinks, {} ingredients and {} users".format(drinks, ingredients, users))
+        build_seconds = generateDb.generate(work_dir, drinks, ingredients, users)
+        drinks_path = os.path.join(work_dir, "drinks.db")
+        stock_names = generateDb.stock_names_for(drinks_path)
+        drinksSqlDb.use_database(drinks_path).dispose()
+        userSqlDb.use_database(os.path.join(work_dir, "user.db")).dispose()
+        drink_catalog = catalog.reload_catalog()
+        telegramBot.searchDB.recipe_cache.warm(drink_catalog)
+        makeableCache.store = makeableCache.MakeableStore()
+
+        results = {}
+        bot = FakeBot()
+        for path_name, calls in _suite_calls(telegramBot, bot, drink_catalog, stock_names, users, samples,
+                                             random.Random(3)):
+            timings, queries = _run_path(calls, (drinksSqlDb.engine, userSqlDb.engine))
+            results[path_name] = {"p50_ms": round(percentile(timings, 50), 3),
+                                  "p95_ms": round(percentile(timings, 95), 3),
+                                  "p99_ms": round(percentile(timings, 99), 3),
+                                  "queries": round(sum(queries) / float(len(queries)), 2),
+                                  "max_queries": max(queries)}
+        telegramBot.outbox.stop()
+    finally:
+        makeableCache.store = original_store
+        drinksSqlDb.use_database(original_drinks).dispose()
+        userSqlDb.use_database(original_users).dispose()
+        catalog.clear_catalog()
+        shutil.rmtree(work_dir)
+
+    report = {"scale": scale, "drinks": drinks, "ingredients": ingredients, "users": users, "samples": samples,
+              "build_seconds": {name: round(seconds, 2) for name, seconds in build_seconds.items()},
+              "paths": results}
+    _print_suite(report, _load_baseline().get(scale))
+    if save:
+        baselines = _load_baseline()
+        baselines[scale] = report
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("Saved {} baseline to {}".format(scale, BASELINE_PATH))
+    return report
+
+
+def _load_baseline():
+    """Returns dict of scale -> saved report, empty if there's no baseline file"""
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH) as f:
+        return json.load(f)
+
+
+def _print_suite(report, baseline):
+    built = report["build_seconds"]
+    print("Built drinks.db (DB_Builder bulk path) in {}s{} and user.db in {}s".format(
+        built["drinks.db"], " (baseline {}s)".format(baseline["build_seconds"]["drinks.db"]) if baseline else "",
+        built["user.db"]))
+    print("{:>10} {:>9} {:>9} {:>9} {:>8}  {}".format("path", "p50 ms", "p95 ms", "p99 ms", "queries",
+                                                       "vs baseline" if baseline else ""))
+    for path_name, result in report["paths"].items():
+        line = "{:>10} {:>9.2f} {:>9.2f} {:>9.2f} {:>8}".format(
+            path_name, result["p50_ms"], result["p95_ms"], result["p99_ms"], result["queries"])
+        old = baseline["paths"].get(path_name) if baseline else None
+        if old:
+            ratio = result["p50_ms"] / old["p50_ms"] if old["p50_ms"] else 1.0
+            flags = []
+            if ratio > REGRESSION_RATIO:
+                flags.append("SLOWER")
+            if result["queries"] > old["queries"]:
+                flags.append("MORE QUERIES (was {})".format(old["queries"]))
+            line += "  p50 x{:.2f} {}".format(ratio, " ".join(flags))
+        print(line)
+
+
+def _dispatch(updates):
+    """Calls handlers one at a time off a queue, the way the python-telegram-bot dispatcher thread does"""
+    while True:
+        item = updates.get()
+        if item is None:
+            return
+        callback, bot, update, kwargs = item
+        callback(bot, update, **kwargs)
+
+
+def bench_async_load(requests=200, update_seconds=2.0, send_latency=0.02):
+    """
+    Measures /drinks latency, from the update being queued to its recipe being sent, while an /update with a slow
+    download is running. Runs once with handlers on the dispatcher thread and once on the asyncio runtime.
+    Works on a copy of drinks.db, which the fake download copies over again
+    """
+    # telegramBot only imports with python-telegram-bot installed
+    import dbUpdater
+    import telegramBot
+    import unitOfWork
+    from asyncRuntime import AsyncRuntime
+    from fakeBot import FakeBot, make_update
+    from readJSON import Settings
+
+    telegramBot.settings = Settings()
+    telegramBot.info_log = logging.getLogger("info.telegramBot")
+    telegramBot.warn_log = logging.getLogger("warn.telegramBot")
+
+    work_dir = tempfile.mkdtemp()
+    source = os.path.join(work_dir, "source.db")
+    shutil.copy(drinksSqlDb.DB_PATH, source)
+    # The copy may come from an older drinks.db, bring it up to date like the bot does at startup
+    dbUpdater.upgrade_drinks_db(source)
+    shutil.copy(source, os.path.join(work_dir, "drinks.db"))
+    original = drinksSqlDb.DB_PATH
+    original_download = dbUpdater.download_drinks_db
+
+    def slow_download(local_path):
+        time.sleep(update_seconds)
+        shutil.copy(source, local_path)
+        return True
+
+    try:
+        drinksSqlDb.use_database(os.path.join(work_dir, "drinks.db")).dispose()
+        drink_names = [name.title() for name in list(catalog.load_catalog().recipes)[:50]]
+        dbUpdater.download_drinks_db = slow_download
+        for mode in ("threaded", "asyncio"):
+            telegramBot.searchDB.recipe_cache.warm(catalog.reload_catalog())
+            bot = FakeBot(latency=send_latency)
+            # Limits high enough that only the runtime is being measured
+            telegramBot.outbox = outbound.Outbox(global_rate=10000, chat_rate=100, chat_burst=100, senders=8)
+            runtime = None
+            # Wrapped the same way create_handlers() does it
+            drinks_callback = unitOfWork.per_update(telegramBot.drinks)
+            update_callback = unitOfWork.per_update(telegramBot.update_db)
+            if mode == "asyncio":
+                runtime = AsyncRuntime()
+                runtime.start()
+                wrap = telegramBot.run_on(runtime)
+                drinks_callback = wrap(drinks_callback, True)
+                update_callback = wrap(update_callback, False)
+
+            updates = queue.Queue()
+            dispatcher = threading.Thread(target=_dispatch, args=(updates,))
+            dispatcher.start()
+            updates.put((update_callback, bot, make_update("/update", user_id=0), {}))
+            queued_at = {}
+            for chat_id in range(1, requests + 1):
+                name = drink_names[chat_id % len(drink_names)]
+                queued_at[chat_id] = time.perf_counter()
+                updates.put((drinks_callback, bot, make_update("/drinks " + name, user_id=chat_id), {"args": [name]}))
+                time.sleep(0.002)
+            updates.put(None)
+            dispatcher.join()
+            if runtime:
+                runtime.stop()
+            telegramBot.outbox.stop()
+
+            latencies = [(bot.sent_to(chat_id)[0][1] - queued_at[chat_id]) * 1000 for chat_id in queued_at]
+            print("{:>8}: {} /drinks during /update, p50 {:.0f}ms, p99 {:.0f}ms".format(
+                mode, requests, percentile(latencies, 50), percentile(latencies, 99)))
+    finally:
+        dbUpdater.download_drinks_db = original_download
+        drinksSqlDb.use_database(original).dispose()
+        catalog.clear_catalog()
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1].lower() == 'builder':
+        bench_builder(int(sys.argv[2]) if len(sys.argv) > 2 else 500)
+    elif sys.argv[1].lower() == 'parser':
+        bench_parser(int(sys.argv[2]) if len(sys.argv) > 2 else 100000)
+    elif sys.argv[1].lower() == 'asyncload':
+        bench_async_load(int(sys.argv[2]) if len(sys.argv) > 2 else 200)
+    elif sys.argv[1].lower() == 'engines':
+        bench_engines(int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
+    elif sys.argv[1].lower() == 'search':
+        bench_search(int(sys.argv[2]) if len(sys.argv) > 2 else 10000)
+    elif sys.argv[1].lower() == 'suite':
+        bench_suite(sys.argv[2] if len(sys.argv) > 2 else "small", "save" in sys.argv[3:])
+    elif sys.argv[1].lower() == 'botload':
+        # End to end through a fake Bot API, see loadGenerator
+        import loadGenerator
+        loadGenerator.run_load(int(sys.argv[2]) if len(sys.argv) > 2 else 1000,
+                               sys.argv[3] if len(sys.argv) > 3 else "polling", "limited" in sys.argv[4:])
@@ -0,0 +1,366 @@
+import bisect
+import logging
+import re
+import threading
+from collections import namedtuple, OrderedDict
+from itertools import count
+
+import drinksSqlDb
+import ftsIndex
+from dbMigrations import normalize_key
+from fuzzyMatch import TrigramIndex
+from drinksSqlDb import Ingredient, Simple_Drink
+
+cat_info = logging.getLogger("info." + __name__)
+cat_warn = logging.getLogger("warn." + __name__)
+
+# Plain read-only copies of the drinks.db rows. Field names match the ORM attributes so helpers like
+# drinksSqlDb.get_formatted_ingredients() and drinksSqlDb.simplify_ingredient() work on either one.
+Recipe = namedtuple("Recipe", ["drink_name", "page", "ingredients", "garnishes"])
+RecipeIngredient = namedtuple("RecipeIngredient", ["ing_id", "ing", "quantity", "measurement", "popularity",
+                                                   "simple_ing", "quantity_max"])
+RecipeGarnish = namedtuple("RecipeGarnish", ["gar"])
+
+# Ingredient names and /ing searches are split into these tokens for the inverted index
+_token_pattern = re.compile(r"\w+")
+
+# Each loaded catalog gets a new version number, so caches built from it can tell when they are stale
+_versions = count(1)
+
+
+class Catalog:
+    """Read-only snapshot of every Drink, Ingredient, Garnish and Simple_Drink row in drinks.db"""
+
+    def __init__(self, recipes, ingredients, simple, version, search_index=False):
+        """
+        :param recipes: OrderedDict of drink name -> Recipe
+        :param ingredients: list of RecipeIngredient objects
+        :param simple: list of simplified ingredient names (Strings)
+        :param version: int that identifies this snapshot
+        :param search_index: True if the drinks.db this came from has the ftsIndex tables
+        """
+        self.recipes = recipes
+        self.ingredients = ingredients
+        self.search_index = search_index
+        self.simple = simple
+        self.version = version
+
+        # Lookups use normalize_key(), like the ing_key columns in drinks.db, so case and extra whitespace in what
+        # users type don't matter
+        self._recipe_keys = OrderedDict((normalize_key(name), recipe) for name, recipe in recipes.items())
+        self._ingredient_rows = [(normalize_key(ingredient.ing), ingredient) for ingredient in ingredients]
+        self._ingredient_keys = OrderedDict()
+        for key, ingredient in self._ingredient_rows:
+            self._ingredient_keys.setdefault(key, ingredient)
+        self._simple_keys = OrderedDict((normalize_key(name), name) for name in simple)
+        # Fuzzy drink name matcher for typos that a substring search can't catch
+        self._name_index = TrigramIndex(recipes)
+
+        # Inverted ingredient index. Ingredient rows that share a name (with different quantities) collapse into one
+        # entry, so a search costs the same however many rows there are
+        drink_positions = {name: position for position, name in enumerate(recipes)}
+        self._drink_order = list(recipes)
+        name_drinks = OrderedDict()
+        for recipe in recipes.values():
+            for ingredient in recipe.ingredients:
+                name_drinks.setdefault(ingredient.ing.upper(), set()).add(drink_positions[recipe.drink_name])
+        # _name_drinks[i] is the set of drink positions using distinct ingredient name i
+        self._name_drinks = list(name_drinks.values())
+        # _token_names maps a token to the set of distinct ingredient names (by index) that contain it
+        self._token_names = {}
+        for name_index, name in enumerate(name_drinks):
+            for token in _tokenize(name):
+                self._token_names.setdefault(token, set()).add(name_index)
+        self._tokens = sorted(self._token_names)
+
+        # Makeable index: every simplified ingredient gets one bit, every drink gets the mask of the bits it needs.
+        # Checking a whole inventory against the catalog is then one AND NOT per drink instead of a query per drink
+        self._simple_bits = OrderedDict()
+        # Summed Ingredient.popularity for each bit, used to rank near-makeable drinks. Popularity already counts
+        # every drink using the ingredient, so each ingredient row is added once, not once per drink
+        self._bit_popularity = []
+        counted_ingredients = set()
+        self._drink_names = []
+        self._drink_masks = []
+        for recipe in recipes.values():
+            mask = 0
+            for ingredient in recipe.ingredients:
+                simple_name = drinksSqlDb.simplify_ingredient(ingredient, None)
+                bit = self._simple_bits.setdefault(simple_name, len(self._simple_bits))
+                if bit == len(self._bit_popularity):
+                    self._bit_popularity.append(0)
+                if ingredient.ing_id not in counted_ingredients:
+                    counted_ingredients.add(ingredient.ing_id)
+                    self._bit_popularity[bit] += ingredient.popularity or 0
+                mask |= 1 << bit
+            # Drinks without ingredients can't be matched against an inventory, so leave them out
+            if mask:
+                self._drink_names.append(recipe.drink_name)
+                self._drink_masks.append(mask)
+
+        # Reverse makeable index: bit -> positions (in _drink_names) of the drinks that need that ingredient
+        self._bit_drinks = [[] for bit in self._simple_bits]
+        for position, mask in enumerate(self._drink_masks):
+            for bit in _bits_of(mask):
+                self._bit_drinks[bit].append(position)
+
+    def __len__(self):
+        return len(self.recipes)
+
+    def find_drink(self, name):
+        """Returns the Recipe whose name matches exactly (ignoring case and extra whitespace), otherwise None"""
+        return self._recipe_keys.get(normalize_key(name))
+
+    def drinks_containing(self, term):
+        """Returns list of Recipes whose name contains term (ignoring case and extra whitespace)"""
+        term = normalize_key(term)
+        return [recipe for key, recipe in self._recipe_keys.items() if term in key]
+
+    def search_drinks(self, terms, limit=None):
+        """
+        Finds the drinks matching any of the search terms in one pass over the drink names
+        :param terms: list of Strings. A drink matches a term if its name contains it (ignoring case and extra
+        whitespace).
+        Terms that match nothing fall back on the closest fuzzy match
+        :param limit: int, maximum number of drinks to return (all of them if not given)
+        :return: list of Recipes with no duplicates, in catalog order followed by any fuzzy matches
+        """
+        # Drop blanks and repeated terms
+        keys = list(OrderedDict.fromkeys(normalize_key(term) for term in terms if term.strip()))
+        results = OrderedDict()
+        matched = set()
+        for key, recipe in self._recipe_keys.items():
+            hits = [term for term in keys if term in key]
+            if hits:
+                results[recipe.drink_name] = recipe
+                matched.update(hits)
+
+        # Anything left over may be misspelled
+        for term in keys:
+            if term not in matched:
+                for recipe, score in self.similar_drinks(term, limit=1):
+                    results.setdefault(recipe.drink_name, recipe)
+
+        found = list(results.values())
+        return found if limit is None else found[:limit]
+
+    def similar_drinks(self, name, limit=5):
+        """
+        :param name: String, possibly misspelled drink name
+        :param limit: int, maximum number of drinks to return
+        :return: list of (Recipe, score) tuples for the closest drink names, best match first
+        """
+        return [(self.recipes[match], score) for match, score in self._name_index.search(name, limit)]
+
+    def ingredients_containing(self, term):
+        """Returns list of RecipeIngredients whose name contains term (ignoring case and extra whitespace)"""
+        term = normalize_key(term)
+        return [ingredient for key, ingredient in self._ingredient_rows if term in key]
+
+    def simple_containing(self, term):
+        """Returns list of simplified ingredient names that contain term (ignoring case)"""
+        term = normalize_key(term)
+        return [name for key, name in self._simple_keys.items() if term in key]
+
+    def drinks_using(self, ing_name):
+        """
+        Returns list of drink names that use an ingredient matching every word in ing_name.
+        A word matches a whole token in the ingredient name, or the start of one if no token matches exactly
+        """
+        name_indexes = None
+        for token in _tokenize(ing_name):
+            matches = self._token_names.get(token) or self._prefix_names(token)
+            name_indexes = matches if name_indexes is None else name_indexes & matches
+            if not name_indexes:
+                return []
+        if not name_indexes:
+            return []
+
+        drink_positions = set()
+        for name_index in name_indexes:
+            drink_positions |= self._name_drinks[name_index]
+        return [self._drink_order[position] for position in sorted(drink_positions)]
+
+    def _prefix_names(self, prefix):
+        """Returns set of ingredient name indexes for every token that starts with prefix"""
+        matches = set()
+        position = bisect.bisect_left(self._tokens, prefix)
+        while position < len(self._tokens) and self._tokens[position].startswith(prefix):
+            matches |= self._token_names[self._tokens[position]]
+            position += 1
+        return matches
+
+    def verify_ing_for_inv(self, ing_name):
+        """
+        Compares ing_name vs ingredient names and simplified names
+        :param ing_name: a String that holds the ingredient name to be added
+        :return: ingredient name if one exists, otherwise empty string
+        """
+        key = normalize_key(ing_name)
+        if key in self._ingredient_keys:
+            return self._ingredient_keys[key].ing
+        return self._simple_keys.get(key, "")
+
+    def simplify_stock(self, stock):
+        """
+        Maps an inventory item to the simplified name used when comparing against recipes
+        :param stock: String taken from an Inventory object
+        :return: uppercase simplified name, or empty string if no ingredient matches
+        """
+        key = normalize_key(stock)
+        if key in self._simple_keys:
+            return self._simple_keys[key].upper()
+        ingredient = self._ingredient_keys.get(key)
+        if not ingredient:
+            # Fall back on the first ingredient that contains the stock name
+            matches = self.ingredients_containing(stock)
+            if not matches:
+                return ""
+            ingredient = matches[0]
+        return drinksSqlDb.simplify_ingredient(ingredient, None)
+
+    def stock_bit(self, stock):
+        """Returns the makeable index bit for an inventory item, or None if no recipe uses it"""
+        return self._simple_bits.get(self.simplify_stock(stock))
+
+    def drinks_needing(self, bit):
+        """Returns list of (drink name, mask) for every drink that uses the simplified ingredient at bit"""
+        return [(self._drink_names[position], self._drink_masks[position]) for position in self._bit_drinks[bit]]
+
+    def inventory_mask(self, stock_names):
+        """
+        Builds the bitmask of simplified ingredients covered by an inventory
+        :param stock_names: iterable of Strings taken from Inventory objects
+        :return: int with one bit set per simplified ingredient in stock
+        """
+        mask = 0
+        for stock in stock_names:
+            bit = self.stock_bit(stock)
+            if bit is not None:
+                mask |= 1 << bit
+        return mask
+
+    def makeable(self, inventory_mask):
+        """
+        :param inventory_mask: int returned by inventory_mask()
+        :return: list of drink names whose ingredients are all covered by the inventory
+        """
+        missing = ~inventory_mask
+        return [name for name, mask in zip(self._drink_names, self._drink_masks) if not mask & missing]
+
+    def near_makeable(self, inventory_mask, max_missing=1, limit=None):
+        """
+        Finds drinks that are short at most max_missing simplified ingredients
+        :param inventory_mask: int returned by inventory_mask()
+        :param max_missing: int, largest number of missing ingredients a drink can have
+        :param limit: int, maximum number of results to return (all of them if not given)
+        :return: list of (drink name, list of missing simplified names) tuples. Drinks missing the fewest
+        ingredients come first, then drinks whose missing ingredients are the most popular
+        """
+        missing = ~inventory_mask
+        candidates = []
+        for name, mask in zip(self._drink_names, self._drink_masks):
+            short = mask & missing
+            # bin().count() is the popcount, int.bit_count() needs Python 3.10
+            if short and bin(short).count("1") <= max_missing:
+                candidates.append((name, short))
+
+        ranked = []
+        for name, short in candidates:
+            bits = _bits_of(short)
+            popularity = sum(self._bit_popularity[bit] for bit in bits)
+            ranked.append((len(bits), -popularity, name, bits))
+        ranked.sort()
+        if limit is not None:
+            ranked = ranked[:limit]
+
+        simple_names = list(self._simple_bits)
+        return [(name, [simple_names[bit] for bit in bits]) for count_missing, popularity, name, bits in ranked]
+
+
+def _tokenize(text):
+    """Splits text into the uppercase word tokens used by the ingredient index"""
+    return _token_pattern.findall(text.upper())
+
+
+def _bits_of(mask):
+    """Returns list of the bit positions set in mask, lowest first"""
+    bits = []
+    while mask:
+        low = mask & -mask
+        bits.append(low.bit_length() - 1)
+        mask ^= low
+    return bits
+
+
+def load_catalog(session=None):
+    """
+    Reads every row needed to serve recipes out of drinks.db
+    :param session: a drinks.db Session() object, a new one is opened (and closed) if not given
+    :return: Catalog object
+    """
+    own_session = not session
+    if own_session:
+        session = drinksSqlDb.get_drink_session()
+    try:
+        ingredients = OrderedDict()
+        for row in session.query(Ingredient).order_by(Ingredient.ing_id):
+            ingredients[row.ing_id] = RecipeIngredient(row.ing_id, row.ing, row.quantity, row.measurement,
+                                                       row.popularity, row.simple_ing, row.quantity_max)
+        simple = [row.ing for row in session.query(Simple_Drink)]
+        search_index = ftsIndex.has_search_index(session)
+
+        # Eager loading keeps this to a fixed number of queries however many drinks there are
+        drinks, session = drinksSqlDb.query_drink_all("%", session, eager=True)
+        recipes = OrderedDict()
+        for row in drinks:
+            recipes[row.drink_name] = Recipe(row.drink_name, row.page,
+                                             tuple(ingredients[ingredient.ing_id] for ingredient in row.ingredients),
+                                             tuple(RecipeGarnish(garnish.gar) for garnish in row.garnishes))
+    finally:
+        if own_session:
+            drinksSqlDb.close_session(session)
+
+    catalog = Catalog(recipes, list(ingredients.values()), simple, next(_versions), search_index)
+    cat_info.info("Loaded catalog version {}: {} drinks, {} ingredients".format(
+        catalog.version, len(recipes), len(ingredients)))
+    return catalog
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+# Functions called with the new Catalog every time reload_catalog() swaps one in
+catalog_listeners = []
+
+
+def get_catalog():
+    """Returns the current Catalog, loading it the first time it's needed.
+    Callers should hold on to the returned object for the rest of a request so they see one snapshot."""
+    global _catalog
+    catalog = _catalog
+    if catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = load_catalog()
+            catalog = _catalog
+    return catalog
+
+
+def clear_catalog():
+    """Drops the current Catalog, so the next get_catalog() loads it from whichever drinks.db is in use by then"""
+    global _catalog
+    with _catalog_lock:
+        _catalog = None
+
+
+def reload_catalog():
+    """Builds a new Catalog from drinks.db and swaps it in. Requests already holding the old one keep using it"""
+    global _catalog
+    # Load outside of the lock so readers are never blocked while the database is read
+    catalog = load_catalog()
+    with _catalog_lock:
+        _catalog = catalog
+    for listener in catalog_listeners:
+        listener(catalog)
+    return catalog
@@ -0,0 +1,66 @@
+import functools
+import logging
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+engine_info = logging.getLogger("info." + __name__)
+
+# Connections kept open per engine, plus how many more can be opened when every kept one is busy.
+# Enough for the asyncio runtime's database workers and the dispatcher thread
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+
+# Seconds a connection waits on a locked database before giving up
+BUSY_TIMEOUT = 30
+
+# user.db is written by handlers all the time. WAL lets reads carry on while a write is happening, and
+# synchronous=NORMAL only syncs at checkpoints, which in WAL mode can lose the last commits on power loss but
+# never corrupts the file. Only main is switched, so drinks.db (attached for /fav) keeps its own journal
+USER_PRAGMAS = (("main.journal_mode", "WAL"), ("main.synchronous", "NORMAL"))
+
+# drinks.db is only read while the bot runs (/update swaps in a whole new file), so reads go through memory mapped
+# I/O and query_only makes any stray write fail instead of touching the file
+DRINKS_PRAGMAS = (("mmap_size", 64 * 1024 * 1024), ("query_only", "ON"))
+
+
+def _set_pragmas(pragmas, dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas:
+        cursor.execute("PRAGMA {} = {}".format(name, value))
+    cursor.close()
+
+
+def sqlite_engine(path, pragmas=(), uri=False):
+    """
+    Creates an engine for a SQLite file with a connection pool that handler threads can share
+    :param path: path to the database file, made absolute so the working directory doesn't matter
+    :param pragmas: tuple of (name, value) pairs run on every new connection
+    :param uri: True lets connections ATTACH "file:" URIs, eg. to open a database read only. Plain paths still work
+    :return: Engine
+    """
+    path = os.path.abspath(path)
+    engine = create_engine('sqlite:///{}'.format(path), poolclass=QueuePool, pool_size=POOL_SIZE,
+                           max_overflow=MAX_OVERFLOW,
+                           # Pooled connections move between threads, each one is only used by one at a time
+                           connect_args={"check_same_thread": False, "timeout": BUSY_TIMEOUT, "uri": uri})
+    if pragmas:
+        event.listen(engine, "connect", functools.partial(_set_pragmas, pragmas))
+    engine_info.debug("Created engine for {} with pragmas {}".format(path, pragmas))
+    return engine
+
+
+def user_engine(path):
+    """Engine for user.db. Its connections attach drinks.db read only through a URI"""
+    return sqlite_engine(path, USER_PRAGMAS, uri=True)
+
+
+def drinks_engine(path):
+    """Read only engine for drinks.db, used while the bot runs"""
+    return sqlite_engine(path, DRINKS_PRAGMAS)
+
+
+def builder_engine(path):
+    """Writable engine for drinks.db, used by DB_Builder and sheetSync"""
+    return sqlite_engine(path)
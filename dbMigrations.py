@@ -0,0 +1,191 @@
+#! python3
+"""
+Schema changes for databases made by older versions of the bot.
+Usage: python3 dbMigrations.py [user.db] [drinks.db]
+migrates both files in place (defaults to the ones next to this file). Every step checks what's already there, so
+running it again does nothing.
+"""
+import logging
+import os.path
+import sys
+from collections import namedtuple
+
+from sqlalchemy import text
+
+migrate_info = logging.getLogger("info." + __name__)
+migrate_warn = logging.getLogger("warn." + __name__)
+
+# A name column with a normalized copy used for case insensitive lookups.
+# references: (table, column) pairs holding names from the source column, repointed when duplicates are merged.
+# pair_columns: for association tables, the columns that make a row unique once names are merged, or None.
+# counter: column summed when duplicates are merged, or None
+KeyColumn = namedtuple("KeyColumn", ["table", "source", "key", "unique", "references", "counter"])
+Reference = namedtuple("Reference", ["table", "column", "pair_columns"])
+# A plain (non unique) index on one column, for tables made before the Column had index=True
+ColumnIndex = namedtuple("ColumnIndex", ["table", "column"])
+# A column added after the table was first made. Existing rows get the value of the fill_from column
+AddedColumn = namedtuple("AddedColumn", ["table", "column", "type", "fill_from"])
+
+USER_KEYS = (
+    KeyColumn("favorites", "favorites", "favorite_key", True,
+              (Reference("fav_asso", "Favorite_drink", ("User_user_id", "Favorite_drink")),), "popularity"),
+    KeyColumn("inv", "stock", "stock_key", True,
+              (Reference("inv_assc", "Inventory_stock", ("User_user_id", "Inventory_stock")),), None),
+)
+# Every favorites and inventory lookup filters the association tables by user
+USER_INDEXES = (
+    ColumnIndex("fav_asso", "User_user_id"),
+    ColumnIndex("inv_assc", "User_user_id"),
+)
+
+# ingredients has one row per name, quantity and measurement, so its key can't be unique
+DRINKS_KEYS = (
+    KeyColumn("ingredients", "ing", "ing_key", False, (), None),
+    KeyColumn("simple", "ing", "ing_key", True, (Reference("ingredients", "simple_ing", None),), "population"),
+)
+# Ranges like "1-2 DASHES" used to keep only their low end
+DRINKS_COLUMNS = (
+    AddedColumn("ingredients", "quantity_max", "FLOAT", "quantity"),
+)
+
+
+def normalize_key(name):
+    """
+    Case folds name and collapses runs of whitespace, so "  Lemon   juice" and "LEMON JUICE" get the same key
+    :param name: String, or None
+    :return: key String, or None if name is None
+    """
+    if name is None:
+        return None
+    return " ".join(name.casefold().split())
+
+
+def key_default(source):
+    """
+    Column default that fills a key column from another column of the row being inserted. Works for ORM inserts
+    and for Core executemany() inserts like DB_Builder.bulk_add_rows()
+    :param source: name of the column the key is made from
+    """
+    def default(context):
+        return normalize_key(context.get_current_parameters().get(source))
+    return default
+
+
+def index_name(key_column):
+    """Same name SQLAlchemy gives the index of a Column(index=True), so create_all() and migrate() agree"""
+    return "ix_{}_{}".format(key_column.table, key_column.key)
+
+
+def migrate(engine, key_columns, indexes=(), columns=()):
+    """
+    Adds any missing columns, adds, fills and indexes key columns, then adds any missing indexes, in one transaction
+    :param engine: writable Engine for the database
+    :param key_columns: tuple of KeyColumn, eg. USER_KEYS
+    :param indexes: tuple of ColumnIndex, eg. USER_INDEXES
+    :param columns: tuple of AddedColumn, eg. DRINKS_COLUMNS
+    """
+    with engine.begin() as connection:
+        for added_column in columns:
+            _add_column(connection, added_column)
+        for key_column in key_columns:
+            _migrate_key_column(connection, key_column)
+        for column_index in indexes:
+            _add_index(connection, column_index)
+
+
+def migrate_user_db(engine):
+    migrate(engine, USER_KEYS, USER_INDEXES)
+
+
+def migrate_drinks_db(engine):
+    migrate(engine, DRINKS_KEYS, columns=DRINKS_COLUMNS)
+
+
+def _columns(connection, table):
+    return [row[1] for row in connection.execute(text("PRAGMA main.table_info({})".format(table)))]
+
+
+def _migrate_key_column(connection, key_column):
+    table, source, key = key_column.table, key_column.source, key_column.key
+    columns = _columns(connection, table)
+    if not columns:
+        return
+    if key not in columns:
+        connection.execute(text("ALTER TABLE {} ADD COLUMN {} VARCHAR".format(table, key)))
+        migrate_info.info("Added {}.{}".format(table, key))
+
+    missing = connection.execute(text("SELECT rowid, {1} FROM {0} WHERE {2} IS NULL AND {1} IS NOT NULL".format(
+        table, source, key))).fetchall()
+    if missing:
+        connection.execute(text("UPDATE {} SET {} = :key WHERE rowid = :row".format(table, key)),
+                           [{"key": normalize_key(name), "row": rowid} for rowid, name in missing])
+        migrate_info.info("Filled {}.{} for {} rows".format(table, key, len(missing)))
+
+    if key_column.unique:
+        _merge_duplicates(connection, key_column)
+    connection.execute(text("CREATE {}INDEX IF NOT EXISTS {} ON {} ({})".format(
+        "UNIQUE " if key_column.unique else "", index_name(key_column), table, key)))
+
+
+def _add_column(connection, added_column):
+    table, column = added_column.table, added_column.column
+    columns = _columns(connection, table)
+    if not columns or column in columns:
+        return
+    connection.execute(text("ALTER TABLE {} ADD COLUMN {} {}".format(table, column, added_column.type)))
+    connection.execute(text("UPDATE {} SET {} = {}".format(table, column, added_column.fill_from)))
+    migrate_info.info("Added {}.{}".format(table, column))
+
+
+def _add_index(connection, column_index):
+    if column_index.column not in _columns(connection, column_index.table):
+        return
+    # SQLAlchemy's name for the index of a Column(index=True), like index_name()
+    name = "ix_{}_{}".format(column_index.table, column_index.column)
+    if connection.execute(text("SELECT count(*) FROM sqlite_master WHERE type = 'index' AND name = :name"),
+                          {"name": name}).scalar():
+        return
+    connection.execute(text("CREATE INDEX {} ON {} ({})".format(name, column_index.table, column_index.column)))
+    migrate_info.info("Indexed {}.{}".format(column_index.table, column_index.column))
+
+
+def _merge_duplicates(connection, key_column):
+    """Folds rows whose names only differ in case or spacing into the oldest one, so the unique index can be built"""
+    table, source, key = key_column.table, key_column.source, key_column.key
+    duplicate_keys = [row[0] for row in connection.execute(text(
+        "SELECT {1} FROM {0} WHERE {1} IS NOT NULL GROUP BY {1} HAVING count(*) > 1".format(table, key)))]
+    for duplicate_key in duplicate_keys:
+        rows = connection.execute(text("SELECT rowid, {1} FROM {0} WHERE {2} = :key ORDER BY rowid".format(
+            table, source, key)), {"key": duplicate_key}).fetchall()
+        keep_name = rows[0][1]
+        merged = [name for rowid, name in rows[1:]]
+        for reference in key_column.references:
+            connection.execute(text("UPDATE {0} SET {1} = :keep WHERE {1} = :name".format(
+                reference.table, reference.column)), [{"keep": keep_name, "name": name} for name in merged])
+        if key_column.counter:
+            connection.execute(text(
+                "UPDATE {0} SET {1} = (SELECT sum(coalesce({1}, 0)) FROM {0} WHERE {2} = :key) WHERE rowid = :row"
+                .format(table, key_column.counter, key)), {"key": duplicate_key, "row": rows[0][0]})
+        connection.execute(text("DELETE FROM {} WHERE {} = :key AND rowid != :row".format(table, key)),
+                           {"key": duplicate_key, "row": rows[0][0]})
+        migrate_warn.warning("Merged {} into {} in {}".format(", ".join(merged), keep_name, table))
+
+    if duplicate_keys:
+        # A user who had both spellings now has the same row twice
+        for reference in key_column.references:
+            if reference.pair_columns:
+                connection.execute(text("DELETE FROM {0} WHERE rowid NOT IN (SELECT min(rowid) FROM {0} GROUP BY {1})"
+                                        .format(reference.table, ", ".join(reference.pair_columns))))
+
+
+if __name__ == '__main__':
+    import dbEngine
+
+    here = os.path.abspath(os.path.dirname(__file__))
+    user_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(here, "user.db")
+    drinks_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(here, "drinks.db")
+    for path, migrate_db in ((user_path, migrate_user_db), (drinks_path, migrate_drinks_db)):
+        engine = dbEngine.builder_engine(path)
+        migrate_db(engine)
+        engine.dispose()
+        print("Migrated {}".format(path))
@@ -0,0 +1,138 @@
+import logging
+import os
+import sqlite3
+import tempfile
+from ftplib import FTP, all_errors
+
+import catalog
+import dbEngine
+import dbMigrations
+import drinksSqlDb
+import ftsIndex
+import ftpHandler
+import userSqlDb
+from readJSON import Secrets
+
+update_info = logging.getLogger("info." + __name__)
+update_warn = logging.getLogger("warn." + __name__)
+
+# Name of the database file on the FTP server
+REMOTE_NAME = "drinks.db"
+
+# Tables that have to hold rows for a downloaded database to be usable
+REQUIRED_TABLES = ("drinks", "ingredients", "ing_assc")
+
+
+def download_drinks_db(local_path, remote_name=REMOTE_NAME):
+    """
+    Downloads drinks.db from the FTP server
+    :param local_path: path to write the download to
+    :param remote_name: name of the file on the server
+    :return: True if the download finished, otherwise False
+    """
+    auth = Secrets()
+    try:
+        ftp = FTP(auth.ftp_host, auth.ftp_user, auth.ftp_pass)
+    except all_errors as e:
+        update_warn.error("Could not connect to the FTP server: {}".format(e))
+        return False
+    try:
+        return ftpHandler.download_file(ftp, local_path, remote_name)
+    finally:
+        try:
+            ftp.quit()
+        except all_errors:
+            ftp.close()
+
+
+def verify_drinks_db(path):
+    """
+    Checks that the file at path is an intact drinks database before it's put into service
+    :param path: path to the downloaded database
+    :return: empty string if the file is usable, otherwise a String describing the problem
+    """
+    try:
+        # Open read only so a bad download is never modified
+        conn = sqlite3.connect("file:{}?mode=ro".format(path), uri=True)
+    except sqlite3.Error as e:
+        return "could not open database: {}".format(e)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()
+        if not result or result[0] != "ok":
+            return "integrity check failed: {}".format(result[0] if result else "no result")
+        for table in REQUIRED_TABLES:
+            rows = conn.execute("SELECT COUNT(*) FROM {}".format(table)).fetchone()[0]
+            if not rows:
+                return "table {} is empty".format(table)
+    except sqlite3.DatabaseError as e:
+        return "could not read database: {}".format(e)
+    finally:
+        conn.close()
+    return ""
+
+
+def upgrade_drinks_db(path):
+    """
+    Brings a drinks.db made by an older version up to date: adds the dbMigrations key columns and builds the
+    ftsIndex search tables if they aren't there yet
+    :param path: path to a drinks database that isn't being served yet (or the current one, at startup)
+    """
+    engine = dbEngine.builder_engine(path)
+    dbMigrations.migrate_drinks_db(engine)
+    session = drinksSqlDb.BuildSession(bind=engine)
+    try:
+        if not ftsIndex.has_search_index(session):
+            ftsIndex.build_search_index(session)
+            session.commit()
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def install_drinks_db(new_path, db_path=None):
+    """
+    Upgrades a verified database, moves it into place and switches the bot over to it.
+    os.replace() swaps the file in one step, so a reader only ever sees the old file or the new one. Requests that
+    are already running keep their open connection (and catalog) on the old file until they finish
+    :param new_path: path to the verified database, must be on the same filesystem as db_path
+    :param db_path: path the bot reads drinks.db from, defaults to drinksSqlDb.DB_PATH
+    :return: the new Catalog
+    """
+    db_path = db_path or drinksSqlDb.DB_PATH
+    upgrade_drinks_db(new_path)
+    os.replace(new_path, db_path)
+    old_engine = drinksSqlDb.use_database(db_path)
+    # user.db connections have the old drinks.db attached, new ones attach the file just installed
+    userSqlDb.engine.dispose()
+    new_catalog = catalog.reload_catalog()
+    # Only idle pooled connections are closed here, checked out ones are closed when their session is done
+    old_engine.dispose()
+    update_info.info("Installed new drinks database with {} drinks".format(len(new_catalog)))
+    return new_catalog
+
+
+def update_drinks_db(download=None, db_path=None):
+    """
+    Downloads, verifies and installs a new drinks.db
+    :param download: function that takes a local path and writes the new database there, returning True on success.
+    Defaults to download_drinks_db()
+    :param db_path: path the bot reads drinks.db from, defaults to drinksSqlDb.DB_PATH
+    :return: tuple of (new Catalog or None, message String for the user)
+    """
+    download = download or download_drinks_db
+    db_path = db_path or drinksSqlDb.DB_PATH
+    # The temp file sits next to drinks.db so the final os.replace() stays on one filesystem
+    fd, tmp_path = tempfile.mkstemp(suffix=".db.tmp", dir=os.path.dirname(db_path))
+    os.close(fd)
+    try:
+        if not download(tmp_path):
+            return None, "Could not download the database"
+        problem = verify_drinks_db(tmp_path)
+        if problem:
+            update_warn.error("Downloaded database failed verification: {}".format(problem))
+            return None, "Downloaded database failed verification ({}), keeping the current one".format(problem)
+        new_catalog = install_drinks_db(tmp_path, db_path)
+        return new_catalog, "Successfully updated database ({} drinks)".format(len(new_catalog))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
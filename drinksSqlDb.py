@@ -1,18 +1,27 @@
 import re, pygsheets, json, os, os.path
 
-from sqlalchemy import create_engine, Column, String, Integer, Table, ForeignKey, Float
+from sqlalchemy import Column, String, Integer, Table, ForeignKey, Float, func
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, selectinload
 from sqlalchemy.exc import IntegrityError, InvalidRequestError
 import logging.handlers
+import dbEngine
+import dbMigrations
+import ftsIndex
+from dbMigrations import key_default, normalize_key
 from readJSON import Secrets, Loggers
+from ingParser import parse_ingredient
 
 drinks_info = logging.getLogger("info." + __name__)
 drinks_warn = logging.getLogger("warn." + __name__)
 
-# dbpath = os.path.join(os.path.abspath(os.path.dirname(__file__)), "drinks.db")
-# engine = create_engine('sqlite:////{}'.format(dbpath))
-engine = create_engine('sqlite:///drinks.db')
+# Absolute path, so /update replaces the same file no matter where the bot was launched from. COCKTAIL_DRINKS_DB
+# points it somewhere else, eg. a scratch file for the tests
+DB_PATH = os.path.abspath(os.environ.get("COCKTAIL_DRINKS_DB") or
+                          os.path.join(os.path.abspath(os.path.dirname(__file__)), "drinks.db"))
+# The bot only reads drinks.db, so its sessions use a read only engine. Building and syncing use build_engine
+engine = dbEngine.drinks_engine(DB_PATH)
+build_engine = dbEngine.builder_engine(DB_PATH)
 
 Base = declarative_base()
 
@@ -42,7 +51,11 @@ class Ingredient(Base):
     # Make ing the primary key, will hold all ingredients
     ing_id = Column(Integer, primary_key=True)
     ing = Column(String)
+    # Case folded copy of ing for equality lookups. Not unique, the same name comes in several quantities
+    ing_key = Column(String, default=key_default("ing"), index=True)
     quantity = Column(Float)
+    # High end of a range like "1-2 DASHES", otherwise the same as quantity
+    quantity_max = Column(Float)
     measurement = Column(String)
     popularity = Column(Integer)
 
@@ -68,6 +81,7 @@ class Simple_Drink(Base):
     __tablename__ = 'simple'
 
     ing = Column(String, primary_key= True)
+    ing_key = Column(String, default=key_default("ing"), index=True, unique=True)
 
     # Intended to count how many ingredients match to this simplification. Not currently implemented
     population = Column(Integer)
@@ -75,8 +89,18 @@ class Simple_Drink(Base):
     def __repr__(self):
         return "<Simple_Drink(ing = {}, population = {})>".format(self.ing, self.population)
 
+class Sheet_Row(Base):
+    __tablename__ = 'sheet_rows'
+    # Hash of each drink's row in the AllDrinks worksheet the last time it was synced, used to find changed rows
+    drink_name = Column(String, primary_key=True)
+    row_hash = Column(String)
+
+    def __repr__(self):
+        return "<Sheet_Row(drink_name = {}, row_hash = {})>".format(self.drink_name, self.row_hash)
+
 Session = sessionmaker(bind=engine, autoflush= False)
-Base.metadata.create_all(engine)
+BuildSession = sessionmaker(bind=build_engine, autoflush= False)
+Base.metadata.create_all(build_engine)
 
 def verify_ing_for_inv(ing_name, session):
     """
@@ -86,8 +110,9 @@ def verify_ing_for_inv(ing_name, session):
     :return: ingredient name if one exists, otherwise empty string
     """
 
-    ingredients_check = session.query(Ingredient).filter(Ingredient.ing.like(ing_name)).first()
-    simple_ing_check = session.query(Simple_Drink).filter(Simple_Drink.ing.like(ing_name)).first()
+    key = normalize_key(ing_name)
+    ingredients_check = session.query(Ingredient).filter(Ingredient.ing_key == key).first()
+    simple_ing_check = session.query(Simple_Drink).filter(Simple_Drink.ing_key == key).first()
     if ingredients_check:
         # if ing_name matches an Ingredient in the table, return that Ingredient's name
         return ingredients_check.ing
@@ -108,20 +133,33 @@ def simplify_ingredient(ingredient, session):
         return ingredient.ing.upper()
 
 
-def query_drink_contains(name, session= ""):
+def drink_query(session, eager=False):
+    """
+    Starts a query for Drink objects
+    :param session: a drinks.db Session() object
+    :param eager: if True, ingredients and garnishes are loaded up front with one extra SELECT each for the whole
+    result, instead of one lazy SELECT per drink the first time they're touched
+    :return: Query object
+    """
+    query = session.query(Drink)
+    if eager:
+        query = query.options(selectinload(Drink.ingredients), selectinload(Drink.garnishes))
+    return query
+
+def query_drink_contains(name, session= "", eager=False):
     if not session:
         session = Session()
-    return session.query(Drink).filter(Drink.drink_name.contains(name)).all(), session
+    return drink_query(session, eager).filter(Drink.drink_name.contains(name)).all(), session
 
-def query_drink_all(name, session = ""):
+def query_drink_all(name, session = "", eager=False):
     if not session:
         session = Session()
-    return session.query(Drink).filter(Drink.drink_name.like(name)).all(), session
+    return drink_query(session, eager).filter(Drink.drink_name.like(name)).all(), session
 
-def query_drink_first(name, session = ""):
+def query_drink_first(name, session = "", eager=False):
     if not session:
         session = Session()
-    return session.query(Drink).filter(Drink.drink_name.like(name)).first(), session
+    return drink_query(session, eager).filter(Drink.drink_name.like(name)).first(), session
 
 def add_ingredient(quantity, measurement, ingredient, session =""):
     if not session:
@@ -143,7 +181,7 @@ def add_drink(name, page):
     try:
         new_drink = Drink(drink_name = name, page = page)
         # create an instance of Session class
-        session = Session()
+        session = BuildSession()
         # Add our User object to our Session
         session.add(new_drink)
         # Commit the changes to the database
@@ -154,6 +192,42 @@ def add_drink(name, page):
         raise
 
 
+class Simplifier:
+    """
+    simplify.json compiled into one regex, so an ingredient is classified in a single scan.
+    Every key is matched case insensitively anywhere in the ingredient name. When several keys match, a key that
+    is a whole word (or words) beats one found inside a longer word, then the one that starts first wins, and of the
+    keys starting at the same place the longest wins
+    (eg. LEMON HART ORIGINAL RUM -> 'rum' not 'gin', LAIRD'S BONDED APPLE BRANDY -> 'laird' not 'brandy')
+    """
+
+    def __init__(self, simplify_dict):
+        """
+        :param simplify_dict: dict of ingredient name fragment -> simplified name
+        """
+        self.simplify_dict = {key.lower(): value for key, value in simplify_dict.items()}
+        # Longest keys first, so the alternation prefers them at any one position.
+        # The lookahead lets finditer() report matches that overlap each other
+        keys = sorted(self.simplify_dict, key=len, reverse=True)
+        self._pattern = re.compile("(?=({}))".format("|".join(re.escape(key) for key in keys)), flags=re.IGNORECASE)
+
+    def classify(self, ing_name):
+        """
+        :param ing_name: ingredient name String
+        :return: tuple of (simplified name or None, sorted list of every simplified name that matched)
+        """
+        whole_words, partial_words = [], []
+        for match in self._pattern.finditer(ing_name):
+            start, end = match.start(1), match.end(1)
+            whole = ((start == 0 or not ing_name[start - 1].isalnum()) and
+                     (end == len(ing_name) or not ing_name[end].isalnum()))
+            (whole_words if whole else partial_words).append(self.simplify_dict[match.group(1).lower()])
+        matches = whole_words + partial_words
+        if not matches:
+            return None, []
+        return matches[0], sorted(set(matches))
+
+
 class DB_Builder():
     """This class is used to quickly rebuild my databases in case I lose them"""
 
@@ -161,9 +235,10 @@ class DB_Builder():
         with open(os.path.join(os.path.abspath(os.path.dirname(__file__)),"json", "simplify.json"),'r') as f:
             self.simplify_dict = json.load(f)
 
-    def sql_from_itertuples(self):
+    def sql_from_itertuples(self, df=None):
         # Get dataframe object
-        df, sh = self.sheets_init()
+        if df is None:
+            df, sh = self.sheets_init()
         # Squash the object to just drink names and pages
         for row in df.itertuples():
             drinks_info.debug(row)
@@ -175,8 +250,12 @@ class DB_Builder():
                 if row[col]:
                     # get Ingredient object, then append it to the Drink object just created.
                     # continue this until all ingredients are added
-                    quantity, measurement, ing_name = ing_regex(row[col])
-                    ingred = check_ing_in_table(ing_name, session, quantity, measurement)
+                    try:
+                        quantity, quantity_max, measurement, ing_name = ing_regex(row[col])
+                    except ValueError as e:
+                        drinks_warn.warning("Skipping an ingredient of {}: {}".format(row[0], e))
+                        continue
+                    ingred = check_ing_in_table(ing_name, session, quantity, measurement, quantity_max)
                     new_drink.ingredients.append(ingred)
 
             # Check the garnish row, and add to garnishes
@@ -190,6 +269,112 @@ class DB_Builder():
                 session.rollback()
                 drinks_warn.warning("Attempting to add duplicate Ingredient, rolling back session")
                 session.close()
+        self.build_search_index()
+
+    def build_search_index(self, session = ""):
+        """Rebuilds the ftsIndex search tables from what's in the database and commits
+        :param session: a writable drinks.db BuildSession() object
+        """
+        if not session:
+            session = BuildSession()
+        try:
+            ftsIndex.build_search_index(session)
+            session.commit()
+        finally:
+            session.close()
+
+    def sql_bulk_from_itertuples(self, df=None, session=""):
+        """
+        Builds the same rows as sql_from_itertuples(), but parses the whole sheet first, resolves ingredients and
+        garnishes through dictionaries, and writes everything with bulk inserts in a single transaction
+        :param df: dataframe (or anything with itertuples()) laid out like the AllDrinks worksheet.
+        Pulled from Google Sheets if not given
+        :param session: a writable drinks.db BuildSession() object
+        :return: number of drinks added
+        """
+        if df is None:
+            df, sh = self.sheets_init()
+        if not session:
+            session = BuildSession()
+        try:
+            added = self.bulk_add_rows(df.itertuples(), session)
+            ftsIndex.build_search_index(session)
+            session.commit()
+        except IntegrityError as e:
+            session.rollback()
+            drinks_warn.error("Bulk build failed, rolling back every row: {}".format(e))
+            raise
+        finally:
+            session.close()
+        return added
+
+    def bulk_add_rows(self, rows, session):
+        """
+        Adds drinks with bulk inserts, without committing. Used by sql_bulk_from_itertuples() and sheetSync
+        :param rows: iterable of tuples laid out like the AllDrinks worksheet: drink name, page, ten ingredient cells
+        and a garnish
+        :param session: a writable drinks.db BuildSession() object
+        :return: number of drinks added
+        """
+        # Load what's already in the database once, instead of one SELECT per cell
+        ing_ids = {}
+        popularity = {}
+        for ing_id, ing_name, quantity, quantity_max, measurement, count in session.query(
+                Ingredient.ing_id, Ingredient.ing, Ingredient.quantity, Ingredient.quantity_max, Ingredient.measurement,
+                Ingredient.popularity):
+            ing_ids[(ing_name, quantity, quantity_max, measurement)] = ing_id
+            popularity[ing_id] = count or 0
+        existing_ings = set(ing_ids.values())
+        known_garnishes = set(gar for gar, in session.query(Garnish.gar))
+        known_drinks = set(name for name, in session.query(Drink.drink_name))
+        next_id = (session.query(func.max(Ingredient.ing_id)).scalar() or 0) + 1
+
+        drink_rows, ing_links, gar_links, new_ings, new_garnishes = [], [], [], [], []
+        for row in rows:
+            # Columns 0 and 1 are drink names and pages respectively
+            if row[0] in known_drinks:
+                drinks_warn.warning("Skipping duplicate drink {}".format(row[0]))
+                continue
+            known_drinks.add(row[0])
+            drink_rows.append({"drink_name": row[0], "page": row[1]})
+
+            # Range 2 to 12 in row are ingredients
+            for col in range(2, 12):
+                if row[col]:
+                    try:
+                        quantity, quantity_max, measurement, ing_name = ing_regex(row[col])
+                    except ValueError as e:
+                        drinks_warn.warning("Skipping an ingredient of {}: {}".format(row[0], e))
+                        continue
+                    key = (ing_name, quantity, quantity_max, measurement)
+                    if key not in ing_ids:
+                        ing_ids[key] = next_id
+                        popularity[next_id] = 0
+                        new_ings.append(key)
+                        next_id += 1
+                    popularity[ing_ids[key]] += 1
+                    ing_links.append({"Drink_name": row[0], "Ingredients_string": ing_ids[key]})
+
+            # Check the garnish row, and add to garnishes
+            if row[12]:
+                if row[12] not in known_garnishes:
+                    known_garnishes.add(row[12])
+                    new_garnishes.append({"gar": row[12]})
+                gar_links.append({"Drink_name": row[0], "Garnish_string": row[12]})
+
+        ing_rows = [{"ing_id": ing_ids[key], "ing": key[0], "quantity": key[1], "quantity_max": key[2],
+                     "measurement": key[3], "popularity": popularity[ing_ids[key]]} for key in new_ings]
+        updated_ings = [{"ing_id": ing_id, "popularity": popularity[ing_id]} for ing_id in existing_ings]
+        for table, table_rows in ((Drink.__table__, drink_rows), (Ingredient.__table__, ing_rows),
+                                  (Garnish.__table__, new_garnishes), (ing_assc_table, ing_links),
+                                  (gar_assc_table, gar_links)):
+            if table_rows:
+                session.execute(table.insert(), table_rows)
+        if updated_ings:
+            session.bulk_update_mappings(Ingredient, updated_ings)
+        drinks_info.info("Bulk added {} drinks, {} ingredients and {} garnishes".format(
+            len(drink_rows), len(ing_rows), len(new_garnishes)))
+        return len(drink_rows)
 
     def get_df(self, has_header, index_comlumn, start, end, wks):
         """Returns dataframe with given specifications"""
@@ -206,38 +391,67 @@ class DB_Builder():
         wks = sh.worksheet_by_title(wks_name)  # changed this over night
         return sh, wks
 
-    def sheets_init(self):
-        """Initializes google sheets, returns dataframe and sheet object"""
+    def open_all_drinks(self):
+        """Authorizes with google sheets, returns sheet and AllDrinks worksheet"""
         # Get private details from secret.json file
         auth = Secrets()
         client_secret = auth.client_secret
         sheet_name = auth.sheet_name
         gc = pygsheets.authorize(client_secret)
-        sh, wks = self.open_sheet(sheet_name, 'AllDrinks', gc)  # Open sheet with given name, or create if not found
+        return self.open_sheet(sheet_name, 'AllDrinks', gc)  # Open sheet with given name, or create if not found
+
+    def sheets_init(self):
+        """Initializes google sheets, returns dataframe and sheet object"""
+        sh, wks = self.open_all_drinks()
         last_row = 'N' + str(wks.rows)
         df = self.get_df(True, 1, 'A1', last_row, wks)  # get dataframe from AllDrinks worksheet
         return df, sh
 
     def populate_simple_drink(self, session = ""):
+        """
+        Links every ingredient to its simplified name in a single pass and a single transaction
+        :param session: a writable drinks.db BuildSession() object
+        :return: dict of ingredient name -> list of simplified names, for ingredients that matched more than one
+        """
         if not session:
-            session = Session()
-        # Iterate through simplify_dict to find each ingredient that contains the name of the dictionary key
-        for category in self.simplify_dict:
-            associate_ing = session.query(Ingredient).filter(Ingredient.ing.contains(category)).all()
-
-            # associate_ing is list of Ingredient objects
-            # iterate through associate_ing list to associate the ingredients with their simplified name
-            for ing in associate_ing:
-                # Add the value associated with current key in simplify_dict to simple
-                simple, session = self.add_ing_to_simple(self.simplify_dict[category], session)
-                if simple:
-                    drinks_info.debug("Trying to append this {}".format(simple))
-                    ing.simple.append(simple)
+            session = BuildSession()
+        simplifier = Simplifier(self.simplify_dict)
+        known_simple = set(ing for ing, in session.query(Simple_Drink.ing))
+
+        updates, ambiguous = [], {}
+        for ing_id, ing_name in session.query(Ingredient.ing_id, Ingredient.ing):
+            simple_name, candidates = simplifier.classify(ing_name)
+            if not simple_name:
+                continue
+            updates.append({"ing_id": ing_id, "simple_ing": simple_name})
+            if len(candidates) > 1:
+                ambiguous[ing_name] = candidates
+                drinks_warn.warning("{} matches {}, using {}".format(ing_name, ", ".join(candidates), simple_name))
+
+        new_simple = set(update["simple_ing"] for update in updates) - known_simple
+        try:
+            if new_simple:
+                session.execute(Simple_Drink.__table__.insert(),
+                                [{"ing": name, "population": 0} for name in sorted(new_simple)])
+            if updates:
+                session.bulk_update_mappings(Ingredient, updates)
+            # The search index holds the simplified names too
+            ftsIndex.build_search_index(session)
+            session.commit()
+        except IntegrityError as e:
+            session.rollback()
+            drinks_warn.error("Failed to link simplified ingredients, rolling back: {}".format(e))
+            raise
+        finally:
+            session.close()
+        drinks_info.info("Simplified {} ingredients, {} matched more than one category".format(
+            len(updates), len(ambiguous)))
+        return ambiguous
 
     def add_ing_to_simple(self, ing_name, session = ""):
         """Check that ingredient isn't in simple table, and then add it"""
         if not session:
-            session = Session()
+            session = BuildSession()
 
         in_table = session.query(Simple_Drink).filter(Simple_Drink.ing == ing_name).first()
         if not in_table:
@@ -260,13 +474,18 @@ def ing_contains_all(ing_name, session):
 def ing_contains_first(ing_name, session):
     return session.query(Ingredient).filter(Ingredient.ing.contains(ing_name)).first()
 
-def check_ing_in_table(ing_name, session, quantity, measurement):
-    """Creates new Ingredient object and adds it to table if not already there, then returns the object"""
+def check_ing_in_table(ing_name, session, quantity, measurement, quantity_max=None):
+    """Creates new Ingredient object and adds it to table if not already there, then returns the object
+    :param quantity_max: high end of a range, quantity if not given"""
+    if quantity_max is None:
+        quantity_max = quantity
     in_table = session.query(Ingredient).filter(Ingredient.ing == ing_name, Ingredient.quantity == quantity,
+                                                Ingredient.quantity_max == quantity_max,
                                                 Ingredient.measurement == measurement).first()
     if not in_table:
         drinks_info.info("Adding Ingredient {} to database.".format(ing_name))
-        ingred = Ingredient(ing = ing_name, quantity = quantity, measurement = measurement, popularity = 0) #popularity = 0 because not in anyones favorites yet
+        ingred = Ingredient(ing = ing_name, quantity = quantity, quantity_max = quantity_max, measurement = measurement,
+                            popularity = 0) #popularity = 0 because not in anyones favorites yet
 
     #If the drink is in the table, simply add it to user
     else:
@@ -297,15 +516,38 @@ def get_formatted_ingredients(drink):
     """Takes a Drink object and returns a list of ingredients"""
     ings = []
     for ingredient in drink.ingredients:
+        quantity = ingredient.quantity
+        # Ranges read "1.0-2.0 DASHES"
+        if ingredient.quantity_max is not None and ingredient.quantity_max != quantity:
+            quantity = "{}-{}".format(quantity, ingredient.quantity_max)
         # Check that there is a value for measurement so spacing is consistent
         if ingredient.measurement:
-            ings.append("{} {} {}".format(ingredient.quantity, ingredient.measurement, ingredient.ing))
+            ings.append("{} {} {}".format(quantity, ingredient.measurement, ingredient.ing))
         else:
-            ings.append("{} {}".format(ingredient.quantity, ingredient.ing))
+            ings.append("{} {}".format(quantity, ingredient.ing))
 
     # Return list of strings to be output.
     return ings
 
+def use_database(path):
+    """
+    Points new sessions at the database file at path. Sessions that are already open keep reading through the old
+    engine until they close
+    :param path: path to a drinks.db file
+    :return: the read only engine that was replaced
+    """
+    global engine, build_engine, DB_PATH
+    old_engine = engine
+    DB_PATH = os.path.abspath(path)
+    engine = dbEngine.drinks_engine(DB_PATH)
+    Session.configure(bind=engine)
+    # Nothing holds on to build sessions between calls, so the old build engine can be closed straight away
+    build_engine.dispose()
+    build_engine = dbEngine.builder_engine(DB_PATH)
+    BuildSession.configure(bind=build_engine)
+    drinks_info.info("Drink sessions now use {}".format(path))
+    return old_engine
+
 def get_drink_session():
     session = Session()
     return session
@@ -321,60 +563,20 @@ def close_session(session):
 
 def ing_regex(ing_name):
     """
-    Uses regex to separate quantity from ingredients
-    :param ingredient: ingredient name from spreadsheet (eg. 2 DASHES ANGOSTURA BITTERS)
-    :return: Returns three variables: quantity (float), measurement (String), ing (String)
+    Separates quantity and measurement from an ingredient name. See ingParser.parse_ingredient() for the details
+    :param ing_name: ingredient name from spreadsheet (eg. 2 DASHES ANGOSTURA BITTERS)
+    :return: Returns four variables: quantity (float), quantity_max (float, the high end of a range, otherwise the
+    same as quantity), measurement (String), ing (String)
+    :raises ValueError: if the cell has no ingredient name
     """
-    # Initialize holder variables
-    quantity, dash_hold, tsp_hold, special_flag, oz_hold = "", "", "", "", ""
-
-    # Num pattern looks for numbers and periods at start of string, plus a space after
-    num_pattern = r"^[1-9.]+ "
-    match_num = re.match(num_pattern, ing_name)
-
-    # If ing_name has a number at start of string, proceed
-    if match_num:
-        # float value for quantity specified
-        quantity = float(match_num.group().strip())
-        # Remove this number substring from ing_name
-        ing_name = re.sub(num_pattern, "", ing_name)
-
-    # Move on to checking for corner case values (TSP, DASHES, etc.)
-    # These can be done simultaneously because they are mutually exclusive
-    dash_pattern = r"^DASH[E]*[S]* "
-    tsp_pattern = r"^TSP[S]* "
-    match_dash = re.match(dash_pattern, ing_name,flags = re.IGNORECASE)
-    match_tsp = re.match(tsp_pattern, ing_name, flags = re.IGNORECASE)
-    if match_dash:
-        dash_hold = match_dash.group().strip()
-        ing_name = re.sub(dash_pattern, "", ing_name)
-    elif match_tsp:
-        tsp_hold = match_tsp.group().strip()
-        ing_name = re.sub(tsp_pattern, "", ing_name)
-    # For special cases, there will be no measurement given (Egg, Mint, etc)
-    elif re.match(r"(MINT )+(EGG )+(FUJI )+(RIPE )+", ing_name, flags = re.IGNORECASE):
-        # special_flag acts to show that the measurement should stay blank
-        special_flag = True
-    else:
-        oz_hold = 'oz.'
-
-    #First value
-    # If no number matched, set quantity to zero (arbitrary number), else return quantity
-    if not quantity:
-        quantity = 0
-
-    #Second value
-    # OR the _hold vars, if all are None, then special_flag is true, and measurement = ""
-    measurement = dash_hold or tsp_hold or oz_hold
-    if not measurement:
-        # This is the special case with no measurement given
-        measurement = ""
-
-    return quantity, measurement, ing_name
+    parsed = parse_ingredient(ing_name)
+    return parsed.quantity, parsed.quantity_max, parsed.unit, parsed.name
 
 if __name__ == '__main__':
     setup_loggers = Loggers()
     setup_loggers.setup_logging(default_level=logging.INFO)
+    # Importing this module only creates missing tables, bringing an older drinks.db up to date happens here
+    dbMigrations.migrate_drinks_db(build_engine)
 
     #
     populate = DB_Builder()
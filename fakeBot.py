@@ -0,0 +1,44 @@
+import threading
+import time
+from types import SimpleNamespace
+
+
+class FakeBot:
+    """
+    Stands in for telegram.Bot when running handlers without Telegram. Every send_message() call is recorded
+    with the time it finished, and can be made to take as long as a real round trip to the Bot API
+    """
+
+    def __init__(self, latency=0.0):
+        """
+        :param latency: seconds each send_message() call blocks for
+        """
+        self.latency = latency
+        # list of (chat_id, text, time.perf_counter() when the send finished)
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.sent.append((chat_id, text, time.perf_counter()))
+
+    def sent_to(self, chat_id):
+        """Returns the (text, time) of every message sent to one chat, in the order they were sent"""
+        with self._lock:
+            return [(text, sent_at) for sent_chat, text, sent_at in self.sent if sent_chat == chat_id]
+
+
+def make_update(text, user_id=1, chat_id=None):
+    """
+    Builds the parts of a telegram.Update the handlers read
+    :param text: message text, eg. "/drinks Negroni"
+    :param user_id: Telegram user ID of the sender
+    :param chat_id: chat the message came from, defaults to the user's private chat (same as user_id)
+    :return: object with message.text, message.chat_id, message.from_user and message.reply_text()
+    """
+    from_user = SimpleNamespace(id=user_id, first_name="Test", last_name="User", username="user{}".format(user_id))
+    message = SimpleNamespace(text=text, chat_id=user_id if chat_id is None else chat_id, from_user=from_user,
+                              reply_text=lambda *args, **kwargs: None)
+    return SimpleNamespace(message=message, effective_user=from_user)
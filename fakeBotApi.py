@@ -0,0 +1,244 @@
+#! python3
+"""
+Local stand-in for the Telegram Bot API, for running the whole bot (create_handlers(), polling or the webhook
+receiver, the outbox) without Telegram. Point an Updater at it with Updater(token=api.token, base_url=api.base_url).
+Usage: python3 fakeBotApi.py [port]
+runs it on its own and prints every message the bot sends.
+"""
+import itertools
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+api_info = logging.getLogger("info." + __name__)
+api_warn = logging.getLogger("warn." + __name__)
+
+# Any token in the right shape works, python-telegram-bot only checks the format
+FAKE_TOKEN = "123456:FAKE-TOKEN"
+
+# Most updates getUpdates hands out at once, same as Telegram
+MAX_UPDATES = 100
+
+
+class _ApiHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _handle(self):
+        api = self.server
+        path, _, query = self.path.partition("?")
+        prefix = "/bot{}/".format(api.token)
+        if not path.startswith(prefix):
+            self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            return
+        method = api.methods.get(path[len(prefix):].lower())
+        if method is None:
+            self._reply(404, {"ok": False, "error_code": 404, "description": "Method not found"})
+            return
+        try:
+            params = self._params(query)
+            result = method(params)
+        except (ValueError, KeyError, TypeError) as e:
+            self._reply(400, {"ok": False, "error_code": 400, "description": "Bad Request: {}".format(e)})
+            return
+        self._reply(200, {"ok": True, "result": result})
+
+    def _params(self, query):
+        """Bot API parameters can come as JSON, a form or the query string"""
+        params = {key: values[-1] for key, values in urllib.parse.parse_qs(query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            body = self.rfile.read(length).decode("utf8")
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                params.update(json.loads(body))
+            else:
+                params.update({key: values[-1] for key, values in urllib.parse.parse_qs(body).items()})
+        return params
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The bot gave up on a long poll, eg. while it's stopping
+            api_info.debug("Client went away before the reply to {} was sent".format(self.path))
+
+    def log_message(self, format, *args):
+        api_info.debug(format % args)
+
+
+class FakeBotApi(ThreadingMixIn, HTTPServer):
+    """
+    Serves getMe, getUpdates, sendMessage, setWebhook, deleteWebhook and getWebhookInfo. Updates are made up with
+    inject() and go out through getUpdates, or are posted to the webhook once one is set. Every sendMessage is
+    recorded and passed to on_send
+    """
+    daemon_threads = True
+
+    def __init__(self, listen="127.0.0.1", port=0, token=FAKE_TOKEN, send_latency=0.0):
+        """
+        :param port: port to bind to, 0 picks a free one
+        :param token: bot token the API answers to
+        :param send_latency: seconds each sendMessage takes to answer, like a round trip to the real API
+        """
+        self.token = token
+        self.send_latency = send_latency
+        # Called with (chat_id, text, time.perf_counter() it arrived) for every sendMessage, from the server thread
+        self.on_send = None
+        # list of (chat_id, text, time it arrived)
+        self.sent = []
+        self.webhook_url = ""
+        self.webhook_secret = ""
+        self.methods = {"getme": self._get_me, "getupdates": self._get_updates, "sendmessage": self._send_message,
+                        "setwebhook": self._set_webhook, "deletewebhook": self._delete_webhook,
+                        "getwebhookinfo": self._get_webhook_info}
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        # Updates waiting for getUpdates, oldest first
+        self._pending = []
+        self._condition = threading.Condition()
+        self._webhook_queue = queue.Queue()
+        self._workers = []
+        self._stopping = False
+        HTTPServer.__init__(self, (listen, port), _ApiHandler)
+
+    @property
+    def base_url(self):
+        """base_url for Updater and Bot, which add the token themselves"""
+        return "http://{}:{}/bot".format(self.server_address[0], self.server_address[1])
+
+    def start(self):
+        self._stopping = False
+        for target, name in ((self.serve_forever, "fake-bot-api"), (self._deliver_webhooks, "fake-bot-webhook")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._workers.append(thread)
+        api_info.info("Fake Bot API listening on {}".format(self.base_url))
+
+    def stop(self):
+        with self._condition:
+            # Lets long polling getUpdates calls return straight away
+            self._stopping = True
+            self._condition.notify_all()
+        self.shutdown()
+        self.server_close()
+        self._webhook_queue.put(None)
+        for thread in self._workers:
+            thread.join()
+        self._workers = []
+
+    def inject(self, chat_id, text, user_id=None, first_name="Load", last_name="Tester"):
+        """
+        Makes up an update for a private message, the way Telegram would deliver it
+        :param chat_id: chat the message comes from
+        :param text: message text. A leading /command is marked as a bot command
+        :param user_id: sender, defaults to chat_id (a private chat)
+        :return: the update's update_id
+        """
+        user_id = chat_id if user_id is None else user_id
+        update_id = next(self._update_ids)
+        message = {"message_id": next(self._message_ids), "date": int(time.time()), "text": text,
+                   "chat": {"id": chat_id, "type": "private", "first_name": first_name},
+                   "from": {"id": user_id, "is_bot": False, "first_name": first_name, "last_name": last_name}}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        update = {"update_id": update_id, "message": message}
+        with self._condition:
+            if self.webhook_url:
+                self._webhook_queue.put((self.webhook_url, self.webhook_secret, update))
+            else:
+                self._pending.append(update)
+                self._condition.notify_all()
+        return update_id
+
+    def _get_me(self, params):
+        return {"id": int(self.token.split(":")[0]), "is_bot": True, "first_name": "Fake Bot", "username": "fake_bot"}
+
+    def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = min(int(params.get("limit") or MAX_UPDATES), MAX_UPDATES)
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        with self._condition:
+            if self.webhook_url:
+                raise ValueError("can't use getUpdates method while webhook is active")
+            # Asking for an offset confirms every update before it
+            self._pending = [update for update in self._pending if update["update_id"] >= offset]
+            while not self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stopping:
+                    return []
+                self._condition.wait(remaining)
+            return self._pending[:limit]
+
+    def _send_message(self, params):
+        if self.send_latency:
+            time.sleep(self.send_latency)
+        chat_id, text = int(params["chat_id"]), params["text"]
+        received_at = time.perf_counter()
+        self.sent.append((chat_id, text, received_at))
+        if self.on_send:
+            self.on_send(chat_id, text, received_at)
+        return {"message_id": next(self._message_ids), "date": int(time.time()), "text": text,
+                "chat": {"id": chat_id, "type": "private"}}
+
+    def _set_webhook(self, params):
+        with self._condition:
+            self.webhook_url = params.get("url", "")
+            self.webhook_secret = params.get("secret_token", "")
+            # Updates nobody fetched go to the webhook from now on
+            pending, self._pending = self._pending, []
+            for update in pending if self.webhook_url else []:
+                self._webhook_queue.put((self.webhook_url, self.webhook_secret, update))
+        api_info.info("Webhook set to {}".format(self.webhook_url or "nothing"))
+        return True
+
+    def _delete_webhook(self, params):
+        with self._condition:
+            self.webhook_url = ""
+            self.webhook_secret = ""
+        return True
+
+    def _get_webhook_info(self, params):
+        return {"url": self.webhook_url, "has_custom_certificate": False,
+                "pending_update_count": len(self._pending) + self._webhook_queue.qsize()}
+
+    def _deliver_webhooks(self):
+        while True:
+            item = self._webhook_queue.get()
+            if item is None:
+                return
+            # Only needed (and only importable with python-telegram-bot installed) in webhook mode
+            from webhookServer import post_update
+            url, secret, update = item
+            status = post_update(url, json.dumps(update), secret)
+            if status != 200:
+                api_warn.warning("Webhook answered {} for update {}".format(status, update["update_id"]))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    api = FakeBotApi(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8081)
+    api.on_send = lambda chat_id, text, received_at: print("{}: {}".format(chat_id, text))
+    api.start()
+    print("Token {}, base_url {}".format(api.token, api.base_url))
+    try:
+        while True:
+            line = input("chat_id message> ")
+            chat_id, _, text = line.partition(" ")
+            api.inject(int(chat_id), text)
+    except (EOFError, KeyboardInterrupt):
+        api.stop()
@@ -29,16 +29,19 @@ def download_file(ftp, local_path, file_name):
     :param ftp: FTP object logged into server
     :param local_path: local absolute path including filename
     :param file_name: name of file on server
-    :return:
+    :return: True if the download finished, otherwise False
     """
     retr_cmd = "RETR " + file_name
     try:
-        ftp.retrbinary(retr_cmd, open(local_path, 'wb').write)
+        with open(local_path, 'wb') as f:
+            ftp.retrbinary(retr_cmd, f.write)
         print("File successfully downloaded to {}".format(local_path))
+        return True
     except error_perm as e:
         print("File transfer failed due to permanent error\n{}".format(e))
     except error_temp as e:
         print("File transfer failed due to temporary error\n{}".format(e))
+    return False
 
 def list_files(ftp):
     for file in ftp.nlst():
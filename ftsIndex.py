@@ -0,0 +1,166 @@
+import logging
+import re
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+fts_info = logging.getLogger("info." + __name__)
+
+# One row per drink: its name, every ingredient, garnish and simplified ingredient name
+DRINK_TABLE = "drink_fts"
+# One row per ingredient (rowid is its ing_id), so a search for several words only matches them within one
+# ingredient. Drinks are found through ing_assc
+INGREDIENT_TABLE = "ingredient_fts"
+
+# Plain index so drinks can be looked up from the ingredients INGREDIENT_TABLE finds
+LINK_INDEX = "ix_ing_assc_ingredient"
+
+# Prefix indexes make "neg*" style queries a lookup instead of a scan of every token
+_TABLE_OPTIONS = "tokenize = 'unicode61', prefix = '2 3'"
+
+# bm25 column weights for DRINK_TABLE: a hit in the drink name counts far more than one in its ingredients
+_DRINK_WEIGHTS = "10.0, 1.0, 1.0, 2.0"
+
+_build_statements = [
+    "DROP TABLE IF EXISTS {}".format(DRINK_TABLE),
+    "DROP TABLE IF EXISTS {}".format(INGREDIENT_TABLE),
+    "CREATE INDEX IF NOT EXISTS {} ON ing_assc (Ingredients_string)".format(LINK_INDEX),
+    "CREATE VIRTUAL TABLE {} USING fts5(drink_name, ingredients, garnish, simple, {})".format(
+        DRINK_TABLE, _TABLE_OPTIONS),
+    # Each link table is grouped once. Correlated subqueries per drink would scan ing_assc (which has no index on
+    # Drink_name) once for every drink
+    """INSERT INTO {} (drink_name, ingredients, garnish, simple)
+       SELECT drinks.drink_name, ings.names, gars.names, ings.simple
+       FROM drinks
+       LEFT JOIN (SELECT ing_assc.Drink_name, group_concat(ing, ' | ') AS names,
+                         group_concat(DISTINCT simple_ing) AS simple
+                  FROM ing_assc JOIN ingredients ON ingredients.ing_id = ing_assc.Ingredients_string
+                  GROUP BY ing_assc.Drink_name) AS ings ON ings.Drink_name = drinks.drink_name
+       LEFT JOIN (SELECT Drink_name, group_concat(Garnish_string, ' | ') AS names
+                  FROM gar_assc GROUP BY Drink_name) AS gars ON gars.Drink_name = drinks.drink_name""".format(
+        DRINK_TABLE),
+    "CREATE VIRTUAL TABLE {} USING fts5(ing, simple, {})".format(INGREDIENT_TABLE, _TABLE_OPTIONS),
+    """INSERT INTO {} (rowid, ing, simple)
+       SELECT ing_id, ing, coalesce(simple_ing, '') FROM ingredients""".format(INGREDIENT_TABLE),
+]
+
+# Same word characters as the unicode61 tokenizer: letters and digits, with everything else a separator
+_word_pattern = re.compile(r"[^\W_]+", flags=re.UNICODE)
+
+
+def build_search_index(session):
+    """
+    Rebuilds the full text search tables from the drinks, ingredients and garnishes tables. Doesn't commit
+    :param session: a writable drinks.db session
+    """
+    for statement in _build_statements:
+        session.execute(text(statement))
+    fts_info.info("Rebuilt the drink search index")
+
+
+def has_search_index(session):
+    """Returns True if the drinks.db behind session has the search tables"""
+    return session.execute(text("SELECT count(*) FROM sqlite_master WHERE name IN (:drinks, :ingredients, :links)"),
+                           {"drinks": DRINK_TABLE, "ingredients": INGREDIENT_TABLE, "links": LINK_INDEX}).scalar() == 3
+
+
+def words(search_text):
+    """Splits text into lowercase words the same way the index's tokenizer does"""
+    return _word_pattern.findall(search_text.lower())
+
+
+def match_expression(search_text, columns=None):
+    """
+    Turns search text into an FTS5 query where every word has to match the start of a word in the row
+    :param search_text: String from the user
+    :param columns: list of column names to search, every column if not given
+    :return: query String, or "" if search_text has no words
+    """
+    terms = words(search_text)
+    if not terms:
+        return ""
+    # Quoting each word keeps FTS5 operators and punctuation in user text from being interpreted
+    query = " AND ".join('"{}"*'.format(term) for term in terms)
+    if columns:
+        query = "{{{}}} : ({})".format(" ".join(columns), query)
+    return query
+
+
+def any_of(search_texts, columns=None):
+    """Combines several searches into one query matching rows that match any of them"""
+    queries = ["({})".format(query) for query in (match_expression(search_text) for search_text in search_texts)
+               if query]
+    if not queries:
+        return ""
+    query = " OR ".join(queries)
+    if columns:
+        query = "{{{}}} : ({})".format(" ".join(columns), query)
+    return query
+
+
+def matches(search_text, name):
+    """Returns True if every word of search_text starts a word of name, the same test the index applies"""
+    name_words = words(name)
+    return all(any(name_word.startswith(term) for name_word in name_words) for term in words(search_text))
+
+
+def search_drinks(session, search_texts, columns=("drink_name",), limit=None):
+    """
+    :param session: a drinks.db session
+    :param search_texts: list of Strings, a drink matches if it matches any of them
+    :param columns: DRINK_TABLE columns to search
+    :param limit: int, maximum number of names to return
+    :return: list of drink names, best match first (bm25, with hits in the name weighted highest)
+    """
+    query = any_of(search_texts, columns)
+    if not query:
+        return []
+    sql = "SELECT drink_name FROM {0} WHERE {0} MATCH :query ORDER BY bm25({0}, {1})".format(
+        DRINK_TABLE, _DRINK_WEIGHTS)
+    if limit is not None:
+        sql += " LIMIT {:d}".format(limit)
+    return [name for name, in session.execute(text(sql), {"query": query})]
+
+
+def drinks_with_ingredient(session, search_text, limit=None):
+    """
+    :param search_text: ingredient words, all of which have to match within one ingredient (or its simplified name)
+    :return: list of drink names, best match first
+    """
+    query = match_expression(search_text, ["ing", "simple"])
+    if not query:
+        return []
+    sql = """SELECT ing_assc.Drink_name
+             FROM (SELECT rowid AS ing_id, bm25({0}) AS score FROM {0} WHERE {0} MATCH :query) AS hits
+             -- ing_assc stores ids as text, so compare as text and LINK_INDEX can be used
+             JOIN ing_assc ON ing_assc.Ingredients_string = CAST(hits.ing_id AS TEXT)
+             ORDER BY hits.score, ing_assc.Drink_name""".format(INGREDIENT_TABLE)
+    return _first_of_each(session.execute(text(sql), {"query": query}), limit)
+
+
+def matching_ingredients(session, search_text, column="ing", limit=None):
+    """
+    :param column: "ing" for ingredient names or "simple" for simplified names
+    :return: list of distinct names in that column matching search_text, best match first
+    """
+    if column not in ("ing", "simple"):
+        raise ValueError("Can't search ingredient column {}".format(column))
+    query = match_expression(search_text, [column])
+    if not query:
+        return []
+    sql = "SELECT {1} FROM {0} WHERE {0} MATCH :query AND {1} != '' ORDER BY bm25({0})".format(
+        INGREDIENT_TABLE, column)
+    return _first_of_each(session.execute(text(sql), {"query": query}), limit)
+
+
+def _first_of_each(rows, limit):
+    """
+    Keeps the first (best ranked) row for each name. SQLite can't use bm25() inside GROUP BY, so duplicates (a
+    drink using two matching ingredients, or the same ingredient in different amounts) are dropped here
+    """
+    names = OrderedDict()
+    for name, in rows:
+        names[name] = None
+        if limit is not None and len(names) >= limit:
+            break
+    return list(names)
@@ -0,0 +1,61 @@
+import re
+from collections import Counter
+
+# Everything that isn't a letter or digit is treated as a word break
+_clean_pattern = re.compile(r"[\W_]+")
+
+
+def trigrams(text):
+    """
+    Splits text into the set of three character chunks used for fuzzy matching
+    :param text: String to split
+    :return: set of Strings. Each word is padded so its first and last letters count as much as the middle ones
+    """
+    grams = set()
+    for word in _clean_pattern.sub(" ", text.lower()).split():
+        padded = "  {} ".format(word)
+        for start in range(len(padded) - 2):
+            grams.add(padded[start:start + 3])
+    return grams
+
+
+class TrigramIndex:
+    """Finds the names closest to a (possibly misspelled) search term by counting shared trigrams"""
+
+    def __init__(self, names):
+        """
+        :param names: iterable of Strings to index
+        """
+        self.names = list(names)
+        self._sizes = []
+        # _postings maps each trigram to the indexes of the names that contain it
+        self._postings = {}
+        for index, name in enumerate(self.names):
+            grams = trigrams(name)
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(index)
+
+    def search(self, term, limit=5, min_score=0.3):
+        """
+        :param term: String to look up
+        :param limit: int, maximum number of names to return
+        :param min_score: float between 0 and 1, names scoring lower than this are left out
+        :return: list of (name, score) tuples, best match first. Score is the Dice coefficient of the trigram sets
+        """
+        grams = trigrams(term)
+        if not grams:
+            return []
+
+        # Only names sharing at least one trigram are ever looked at
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+
+        scored = []
+        for index, count in shared.items():
+            score = 2.0 * count / (len(grams) + self._sizes[index])
+            if score >= min_score:
+                scored.append((-score, self.names[index]))
+        scored.sort()
+        return [(name, -score) for score, name in scored[:limit]]
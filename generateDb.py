@@ -0,0 +1,226 @@
+#! python3
+"""
+Builds large, realistic drinks.db and user.db files for benchmarking.
+Usage: python3 generateDb.py out_dir [drinks] [ingredients] [users]
+writes out_dir/drinks.db and out_dir/user.db (defaults: 10000 drinks, 2000 distinct ingredients, 100000 users).
+The same arguments always produce the same files.
+"""
+import itertools
+import logging
+import os
+import random
+import sys
+import time
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+import dbEngine
+import drinksSqlDb
+import userSqlDb
+from dbMigrations import normalize_key
+
+gen_info = logging.getLogger("info." + __name__)
+
+# Made up brand names, combined with the product types below into distinct ingredients
+BRANDS = ["HOUSE", "OLD", "NEW", "RESERVE", "NAVY", "GOLD", "SMALL BATCH", "HIGH WEST", "ALPINE", "COASTAL",
+          "COPPER", "IRON", "ORCHARD", "HARBOR", "LANTERN", "MERIDIAN", "NORTHGATE", "OXBOW", "PINNACLE", "QUARRY",
+          "RIDGELINE", "SHORELINE", "THORNE", "UPLAND", "VALLEY", "WILLOW", "YARROW", "ZENITH", "BLACKWOOD",
+          "CEDAR", "DRIFTWOOD", "EMBER", "FALCON", "GRANITE", "HOLLOW", "IVY", "JUNIPER HILL", "KESTREL", "LOCH",
+          "MOSS", "NETTLE", "OAKHEART", "PRAIRIE", "RAVEN", "SUMMIT", "TIMBER", "UNION", "VESPER", "WREN"]
+# Product types. Most contain a key from json/simplify.json, so populate_simple_drink() links them like real rows
+PRODUCTS = ["GIN", "LONDON DRY GIN", "OLD TOM GIN", "RUM", "AGED RUM", "OVERPROOF RUM", "BOURBON", "RYE WHISKEY",
+            "BLANCO TEQUILA", "REPOSADO TEQUILA", "MEZCAL", "BRANDY", "APPLE BRANDY", "VODKA", "COGNAC", "PISCO",
+            "SWEET VERMOUTH", "DRY VERMOUTH", "BLANC VERMOUTH", "AMARO", "APERITIVO", "ORANGE LIQUEUR",
+            "MARASCHINO LIQUEUR", "GREEN CHARTREUSE", "YELLOW CHARTREUSE", "CREME DE CACAO", "CREME DE MENTHE",
+            "CREME DE PECHE", "ABSINTHE", "AROMATIC BITTERS", "ORANGE BITTERS", "MOLE BITTERS", "SIMPLE SYRUP",
+            "DEMERARA SYRUP", "HONEY SYRUP", "ORGEAT", "GRENADINE"]
+# Ages and styles, only used when more ingredients are asked for than brands and products can make
+EDITIONS = ["12 YEAR", "BARREL PROOF", "BOTTLED IN BOND", "SINGLE CASK", "CASK STRENGTH", "SMALL LOT",
+            "NAVY STRENGTH", "EXTRA OLD", "RESERVA"]
+# Every drink has a good chance of one of these, the way real recipes lean on a few fresh ingredients
+STAPLES = ["LEMON JUICE", "LIME JUICE", "GRAPEFRUIT JUICE", "SIMPLE SYRUP", "EGG WHITE", "ANGOSTURA BITTERS"]
+AMOUNTS = ["2", "1 1/2", "1", "3/4", "1/2", "1/4", "1 TSP.", "1 BARSPOON"]
+GARNISHES = ["1 LEMON TWIST", "1 LIME WHEEL", "1 BRANDIED CHERRY", "1 ORANGE TWIST", "1 MINT SPRIG",
+             "1 GRAPEFRUIT TWIST", "NUTMEG", "1 CUCUMBER RIBBON", ""]
+FIRST_WORDS = ["Old", "Last", "Golden", "Smoky", "Paper", "Naked", "Hanky", "Corpse", "Jungle", "Bitter", "Midnight",
+               "Silver", "Velvet", "Final", "Lost", "Royal", "Broken", "Little", "Scarlet", "Wild"]
+LAST_WORDS = ["Fashioned", "Word", "Dawn", "Sling", "Plane", "Reviver", "Bird", "Panky", "Fizz", "Daisy", "Sour",
+              "Flip", "Smash", "Cobbler", "Swizzle", "Julep", "Rickey", "Collins", "Punch", "Cocktail"]
+FIRST_NAMES = ["Alex", "Sam", "Jordan", "Taylor", "Casey", "Riley", "Jamie", "Morgan", "Robin", "Quinn"]
+
+
+def _skewed_weights(count, exponent=0.9):
+    """
+    Zipf-like weights, so a few ingredients and drinks are very popular and most are rare
+    :return: cumulative weights for random.choices(), worked out once instead of on every call
+    """
+    return list(itertools.accumulate(1.0 / (rank + 1) ** exponent for rank in range(count)))
+
+
+def make_ingredient_names(count, seed=1):
+    """
+    :param count: number of distinct ingredient names
+    :return: list of uppercase names, staples first and then in a repeatable shuffled order
+    """
+    rand = random.Random(seed)
+    # Plain brand + product names first, editions only once those run out
+    plain = ["{} {}".format(brand, product) for brand, product in itertools.product(BRANDS, PRODUCTS)]
+    editions = ["{} {} {}".format(brand, edition, product)
+                for brand, edition, product in itertools.product(BRANDS, EDITIONS, PRODUCTS)]
+    if count > len(STAPLES) + len(plain) + len(editions):
+        raise ValueError("Can generate at most {} distinct ingredients".format(
+            len(STAPLES) + len(plain) + len(editions)))
+    rand.shuffle(plain)
+    rand.shuffle(editions)
+    return (STAPLES + plain + editions)[:count]
+
+
+def make_drink_rows(drinks, ingredients, seed=1):
+    """
+    Builds AllDrinks style rows: drink name, page, ten ingredient cells and a garnish
+    :param drinks: number of drinks
+    :param ingredients: number of distinct ingredient names to draw from
+    :return: list of tuples
+    """
+    rand = random.Random(seed)
+    names = make_ingredient_names(ingredients, seed)
+    staples, others = names[:len(STAPLES)], names[len(STAPLES):]
+    weights = _skewed_weights(len(others))
+    # Every ingredient is used at least once, then the rest are drawn by popularity
+    unused = list(others)
+    rand.shuffle(unused)
+
+    rows = []
+    for number in range(drinks):
+        picked = set()
+        if unused:
+            picked.add(unused.pop())
+        size = rand.randint(2, 5)
+        while len(picked) < size:
+            picked.add(rand.choices(others, cum_weights=weights)[0])
+        if rand.random() < 0.7:
+            picked.add(rand.choice(staples))
+        cells = []
+        for name in sorted(picked):
+            if name.endswith("BITTERS"):
+                cells.append("{} DASHES {}".format(rand.randint(1, 3), name))
+            else:
+                cells.append("{} {}".format(rand.choice(AMOUNTS), name))
+        cells += [""] * (10 - len(cells))
+        drink_name = "{} {} {}".format(rand.choice(FIRST_WORDS), rand.choice(LAST_WORDS), number)
+        rows.append(tuple([drink_name, str(number // 4 + 1)] + cells + [rand.choice(GARNISHES)]))
+    return rows
+
+
+def build_drinks_db(path, drinks=10000, ingredients=2000, seed=1):
+    """
+    Writes a new drinks database at path with DB_Builder's bulk path, simplified names and the search index
+    :return: list of drink names in the database
+    """
+    rows = make_drink_rows(drinks, ingredients, seed)
+    engine = dbEngine.builder_engine(path)
+    try:
+        drinksSqlDb.Base.metadata.create_all(engine)
+        builder = drinksSqlDb.DB_Builder()
+        session = drinksSqlDb.BuildSession(bind=engine)
+        try:
+            builder.bulk_add_rows(rows, session)
+            session.commit()
+        finally:
+            session.close()
+        # Also builds the ftsIndex tables and commits
+        builder.populate_simple_drink(drinksSqlDb.BuildSession(bind=engine))
+    finally:
+        engine.dispose()
+    return [row[0] for row in rows]
+
+
+def build_user_db(path, drink_names, stock_names, users=100000, seed=1):
+    """
+    Writes a new user database at path, with an inventory and favorites for every user
+    :param drink_names: names favorites are drawn from
+    :param stock_names: names inventories are drawn from (ingredient and simplified names, as /addinv stores them)
+    :param users: number of users, with ids 1 to users
+    """
+    rand = random.Random(seed)
+    stock_weights = _skewed_weights(len(stock_names), 0.7)
+    drink_weights = _skewed_weights(len(drink_names))
+    user_rows, inv_links, fav_links = [], [], []
+    popularity = {}
+    for user_id in range(1, users + 1):
+        user_rows.append({"user_id": user_id, "chat_id": user_id, "first_name": rand.choice(FIRST_NAMES),
+                          "last_name": ""})
+        # Sorted, so the files don't depend on string hashing
+        for stock in sorted(set(rand.choices(stock_names, cum_weights=stock_weights, k=rand.randint(3, 25)))):
+            inv_links.append({"User_user_id": user_id, "Inventory_stock": stock})
+        for drink in sorted(set(rand.choices(drink_names, cum_weights=drink_weights, k=rand.randint(0, 8)))):
+            fav_links.append({"User_user_id": user_id, "Favorite_drink": drink})
+            popularity[drink] = popularity.get(drink, 0) + 1
+
+    used_stock = sorted(set(link["Inventory_stock"] for link in inv_links))
+    # Core inserts, so the key column defaults fill favorite_key and stock_key
+    engine = dbEngine.builder_engine(path)
+    try:
+        userSqlDb.Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            for table, table_rows in ((userSqlDb.User.__table__, user_rows),
+                                      (userSqlDb.Inventory.__table__, [{"stock": name} for name in used_stock]),
+                                      (userSqlDb.Favorite.__table__, [{"favorites": name, "popularity": count}
+                                                                      for name, count in popularity.items()]),
+                                      (userSqlDb.inv_assc_table, inv_links), (userSqlDb.fav_assc_table, fav_links)):
+                if table_rows:
+                    connection.execute(table.insert(), table_rows)
+    finally:
+        engine.dispose()
+    gen_info.info("Generated {} users with {} inventory items and {} favorites".format(
+        users, len(inv_links), len(fav_links)))
+
+
+def stock_names_for(drinks_path):
+    """
+    Returns the simplified and ingredient names in a drinks database, the names /addinv accepts. Names that only
+    differ in case (eg. simple syrup and SIMPLE SYRUP) are kept once, like the inv table's unique key
+    """
+    engine = dbEngine.builder_engine(drinks_path)
+    try:
+        with engine.connect() as connection:
+            ingredients = [name for name, in connection.execute(text("SELECT DISTINCT ing FROM ingredients ORDER BY ing"))]
+            simple = [name for name, in connection.execute(text("SELECT ing FROM simple ORDER BY ing"))]
+    finally:
+        engine.dispose()
+    names = OrderedDict()
+    for name in simple + ingredients:
+        names.setdefault(normalize_key(name), name)
+    return list(names.values())
+
+
+def generate(out_dir, drinks=10000, ingredients=2000, users=100000, seed=1):
+    """
+    Writes out_dir/drinks.db and out_dir/user.db, replacing any that are there
+    :return: dict of seconds taken for each file
+    """
+    timings = {}
+    drinks_path = os.path.join(out_dir, "drinks.db")
+    user_path = os.path.join(out_dir, "user.db")
+    for path in (drinks_path, user_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    start = time.perf_counter()
+    drink_names = build_drinks_db(drinks_path, drinks, ingredients, seed)
+    timings["drinks.db"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    build_user_db(user_path, drink_names, stock_names_for(drinks_path), users, seed)
+    timings["user.db"] = time.perf_counter() - start
+    return timings
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    target = sys.argv[1]
+    counts = [int(arg) for arg in sys.argv[2:5]]
+    os.makedirs(target, exist_ok=True)
+    for name, seconds in generate(target, *counts).items():
+        print("{}: {:.1f}s".format(name, seconds))
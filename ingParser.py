@@ -0,0 +1,84 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+# Result of parsing one ingredient cell, eg. "1 1/2 OZ. RYE" -> ParsedIngredient(1.5, 1.5, "oz.", "RYE")
+# quantity is 0 when the cell has no number. For ranges ("1-2 DASHES") quantity is the low end, quantity_max the high
+ParsedIngredient = namedtuple("ParsedIngredient", ["quantity", "quantity_max", "unit", "name"])
+
+# Spellings accepted for each unit -> the measurement stored in the database.
+# DASH/DASHES and TSP/TSPS keep their singular or plural form to match the rows already in drinks.db
+UNITS = {
+    "OZ": "oz.", "OZS": "oz.", "OUNCE": "oz.", "OUNCES": "oz.",
+    "DASH": "DASH", "DASHE": "DASHES", "DASHES": "DASHES", "DASHS": "DASHES",
+    "TSP": "TSP", "TSPS": "TSPS", "TEASPOON": "TSP", "TEASPOONS": "TSPS",
+    "TBSP": "TBSP", "TBSPS": "TBSP", "TABLESPOON": "TBSP", "TABLESPOONS": "TBSP",
+    "BARSPOON": "BARSPOON", "BARSPOONS": "BARSPOON",
+    "DROP": "DROP", "DROPS": "DROPS",
+    "PINCH": "PINCH", "PINCHES": "PINCH",
+    "ML": "ml", "CL": "cl",
+}
+
+# Ingredients that are counted rather than measured, so no unit is given (eg. "1 EGG WHITE", "10 MINT LEAVES",
+# "2 EGGS"). Matched as a whole word, singular or plural, at the start of the ingredient name
+COUNTED = ("EGG", "MINT", "RIPE", "FUJI", "WHOLE")
+
+# Used when the cell doesn't name a unit
+DEFAULT_UNIT = "oz."
+
+_NUMBER = r"(?:\d+\.?\d*|\.\d+)"
+_AMOUNT = r"(?:{n}\s+{n}/{n}|{n}/{n}|{n})".format(n=_NUMBER)
+# One pass splits the amount (with an optional range) from the rest of the cell. The amount may end the cell, so a
+# cell that is only an amount ("1 1/2") is caught as having no name instead of the fraction becoming one
+_line_pattern = re.compile(
+    r"^\s*(?:(?P<low>{a})(?:\s*(?:-|–|TO)\s*(?P<high>{a}))?(?:\s+|$))?(?P<rest>.*?)\s*$".format(a=_AMOUNT),
+    flags=re.IGNORECASE | re.DOTALL)
+_word_pattern = re.compile(r"([A-Za-z]+)\.?(?:\s+|$)")
+_counted_pattern = re.compile(r"^(?:{})S?\b".format("|".join(COUNTED)), flags=re.IGNORECASE)
+
+
+def _amount(text):
+    """Turns '2', '.75', '3/4' or '1 1/2' into a float"""
+    total = 0.0
+    for part in text.split():
+        if "/" in part:
+            numerator, denominator = part.split("/")
+            total += float(numerator) / float(denominator) if float(denominator) else 0.0
+        else:
+            total += float(part)
+    return total
+
+
+@lru_cache(maxsize=4096)
+def parse_ingredient(cell):
+    """
+    Separates the quantity and unit from an ingredient cell
+    :param cell: ingredient text from the spreadsheet (eg. 2 DASHES ANGOSTURA BITTERS)
+    :return: ParsedIngredient. Results are cached, since the same cells repeat all over the sheet
+    :raises ValueError: if the cell has an amount or unit but no ingredient name (eg. "2 OZ")
+    """
+    match = _line_pattern.match(cell)
+    low, high, rest = match.group("low"), match.group("high"), match.group("rest")
+    quantity = _amount(low) if low else 0
+    quantity_max = _amount(high) if high else quantity
+
+    unit = DEFAULT_UNIT
+    word = _word_pattern.match(rest)
+    if word and word.group(1).upper() in UNITS:
+        unit = UNITS[word.group(1).upper()]
+        rest = rest[word.end():]
+    elif _counted_pattern.match(rest):
+        unit = ""
+    if not rest:
+        raise ValueError("Ingredient cell {!r} has no ingredient name".format(cell))
+    return ParsedIngredient(quantity, quantity_max, unit, rest)
+
+
+def parse_column(cells):
+    """
+    Parses a whole column of ingredient cells at once
+    :param cells: iterable of Strings, blank cells are allowed
+    :return: list with a ParsedIngredient for each cell, or None where the cell was blank
+    :raises ValueError: for a cell with no ingredient name, see parse_ingredient()
+    """
+    return [parse_ingredient(cell) if cell else None for cell in cells]
@@ -0,0 +1,259 @@
+#! python3
+"""
+End to end load test: runs the bot against fakeBotApi with many simulated users going through /start, /drinks, an
+/addinv conversation, /makeable and /fav, and reports updates/sec and per-command latency from the update being
+injected to the bot's reply reaching the API.
+Usage: python3 loadGenerator.py [users] [polling|webhook] [limited]
+"limited" keeps the outbox at the flood limits in settings.json, otherwise they're lifted so the bot itself is measured.
+"""
+import heapq
+import logging
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+import catalog
+import drinksSqlDb
+import generateDb
+import makeableCache
+import outbound
+import userSqlDb
+from benchmark import percentile
+
+load_info = logging.getLogger("info." + __name__)
+
+# label: name latencies are reported under. replies: messages the bot sends back for it, the step is done (and
+# its latency taken) when the last one arrives
+Step = namedtuple("Step", ["label", "text", "replies"])
+
+
+def user_script(rand, drink_names, ingredient_names):
+    """
+    Returns the list of Steps one new user goes through
+    :param rand: random.Random
+    :param drink_names: drink names to search for
+    :param ingredient_names: exact ingredient names, so /addinv adds them
+    """
+    return [
+        Step("/start", "/start", 2),
+        # Thanks message, then the one confirming the user was stored
+        Step("/start yes", "Yes", 2),
+        # The trailing comma makes the name one search term instead of one per word
+        Step("/drinks", "/drinks", 1),
+        Step("/drinks name", "{},".format(rand.choice(drink_names)), 1),
+        Step("/addinv", "/addinv", 1),
+        Step("/addinv item", rand.choice(ingredient_names).title(), 1),
+        Step("/addinv exit", "exit", 1),
+        Step("/makeable", "/makeable", 1),
+        Step("/fav", "/fav", 1),
+    ]
+
+
+class _UserState:
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.position = 0
+        self.replies = 0
+        self.injected_at = None
+
+
+class SimulatedUsers:
+    """
+    Drives many users' conversations through a FakeBotApi. Each user sends its next message once the bot has answered
+    the last one (plus think_time), so every user is mid-conversation at the same time, the way real ones are
+    """
+
+    def __init__(self, api, scripts, think_time=0.5, ramp_seconds=5.0):
+        """
+        :param api: started FakeBotApi
+        :param scripts: dict of chat_id -> list of Steps
+        :param think_time: seconds a user waits after a reply before sending the next message
+        :param ramp_seconds: users start spread over this many seconds
+        """
+        self.api = api
+        self.think_time = think_time
+        self.ramp_seconds = ramp_seconds
+        self._states = {chat_id: _UserState(steps) for chat_id, steps in scripts.items()}
+        # label -> list of seconds from injection to the step's last reply
+        self.latencies = {}
+        self.injected = 0
+        self.unexpected_replies = 0
+        self._finished = 0
+        self._done = threading.Event()
+        self._lock = threading.Condition()
+        # heap of (time.perf_counter() to send at, chat_id)
+        self._due = []
+        self._thread = None
+
+    def run(self, timeout=600):
+        """
+        Sends every user's script and waits for the bot to answer all of it
+        :return: seconds from the first message to the last reply
+        """
+        self.api.on_send = self._on_send
+        start = time.perf_counter()
+        spacing = self.ramp_seconds / max(len(self._states), 1)
+        with self._lock:
+            for number, chat_id in enumerate(self._states):
+                heapq.heappush(self._due, (start + number * spacing, chat_id))
+        self._thread = threading.Thread(target=self._send_due, name="load-users", daemon=True)
+        self._thread.start()
+        self._done.wait(timeout)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._due = []
+            self._lock.notify()
+        return elapsed
+
+    @property
+    def unfinished(self):
+        return len(self._states) - self._finished
+
+    def _send_due(self):
+        while not self._done.is_set():
+            with self._lock:
+                now = time.perf_counter()
+                if not self._due or self._due[0][0] > now:
+                    self._lock.wait(self._due[0][0] - now if self._due else 0.1)
+                    continue
+                sent_at, chat_id = heapq.heappop(self._due)
+                state = self._states[chat_id]
+                state.replies = 0
+                state.injected_at = time.perf_counter()
+                step = state.steps[state.position]
+                self.injected += 1
+            self.api.inject(chat_id, step.text)
+
+    def _on_send(self, chat_id, text, received_at):
+        with self._lock:
+            state = self._states.get(chat_id)
+            if state is None or state.injected_at is None or state.position >= len(state.steps):
+                self.unexpected_replies += 1
+                return
+            step = state.steps[state.position]
+            state.replies += 1
+            if state.replies < step.replies:
+                return
+            if state.replies > step.replies:
+                self.unexpected_replies += 1
+                return
+            self.latencies.setdefault(step.label, []).append(received_at - state.injected_at)
+            state.position += 1
+            state.injected_at = None
+            if state.position < len(state.steps):
+                heapq.heappush(self._due, (received_at + self.think_time, chat_id))
+                self._lock.notify()
+            else:
+                self._finished += 1
+                if self._finished == len(self._states):
+                    self._done.set()
+
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def run_load(users=1000, mode="polling", limited=False, drinks=1000, think_time=0.5, send_latency=0.0, seed=1):
+    """
+    Starts the bot the way telegramBot's __main__ does, against a FakeBotApi and freshly generated databases, and
+    runs users through user_script()
+    :param mode: "polling" or "webhook"
+    :param limited: keep the outbox at the settings.json flood limits
+    :param drinks: size of the generated drinks.db
+    :param send_latency: seconds the fake API takes to answer each sendMessage
+    :return: SimulatedUsers with the results
+    """
+    import telegramBot
+    from asyncRuntime import AsyncRuntime
+    from fakeBotApi import FakeBotApi
+    from readJSON import Settings
+    from telegram.ext import Updater
+
+    settings = Settings()
+    settings.update_mode = mode
+    if mode == "webhook":
+        settings.webhook_listen = "127.0.0.1"
+        settings.webhook_port = _free_port()
+        settings.webhook_url = "http://127.0.0.1:{}/{}".format(settings.webhook_port, settings.webhook_path)
+    telegramBot.settings = settings
+    telegramBot.info_log = logging.getLogger("info.telegramBot")
+    telegramBot.warn_log = logging.getLogger("warn.telegramBot")
+    if limited:
+        telegramBot.outbox = outbound.Outbox(settings.send_global_rate, settings.send_chat_rate,
+                                             settings.send_chat_burst, settings.send_threads)
+    else:
+        telegramBot.outbox = outbound.Outbox(global_rate=100000, chat_rate=1000, chat_burst=1000,
+                                             senders=settings.send_threads)
+
+    work_dir = tempfile.mkdtemp()
+    original_drinks, original_users = drinksSqlDb.DB_PATH, userSqlDb.USER_DB_PATH
+    original_store = makeableCache.store
+    api = FakeBotApi(send_latency=send_latency)
+    api.start()
+    updater = receiver = runtime = None
+    try:
+        drinks_path = os.path.join(work_dir, "drinks.db")
+        drink_names = generateDb.build_drinks_db(drinks_path, drinks, max(drinks // 5, 50), seed)
+        drinksSqlDb.use_database(drinks_path).dispose()
+        userSqlDb.use_database(os.path.join(work_dir, "user.db")).dispose()
+        drink_catalog = catalog.reload_catalog()
+        telegramBot.searchDB.recipe_cache.warm(drink_catalog)
+        makeableCache.store = makeableCache.MakeableStore()
+        ingredient_names = sorted(set(ingredient.ing for ingredient in drink_catalog.ingredients))
+
+        rand = random.Random(seed)
+        scripts = {chat_id: user_script(rand, drink_names, ingredient_names)
+                   for chat_id in range(1000, 1000 + users)}
+        simulated = SimulatedUsers(api, scripts, think_time)
+
+        updater = Updater(token=api.token, base_url=api.base_url)
+        telegramBot.updater = updater
+        if settings.runtime_mode == "asyncio":
+            runtime = AsyncRuntime(db_workers=settings.db_workers, send_workers=settings.send_workers)
+            runtime.start()
+        telegramBot.create_handlers(updater, updater.dispatcher, runtime)
+        receiver = telegramBot.start_updates(updater, updater.dispatcher)
+
+        elapsed = simulated.run()
+        _report(simulated, elapsed, users, mode, settings.runtime_mode)
+        return simulated
+    finally:
+        if updater:
+            telegramBot.shutdown(updater, updater.dispatcher, receiver, runtime)
+        else:
+            telegramBot.outbox.stop()
+        api.stop()
+        makeableCache.store = original_store
+        drinksSqlDb.use_database(original_drinks).dispose()
+        userSqlDb.use_database(original_users).dispose()
+        catalog.clear_catalog()
+        shutil.rmtree(work_dir)
+
+
+def _report(simulated, elapsed, users, mode, runtime_mode):
+    print("{} users over {} ({} runtime): {} updates in {:.1f}s, {:.0f} updates/sec".format(
+        users, mode, runtime_mode, simulated.injected, elapsed, simulated.injected / elapsed))
+    if simulated.unfinished:
+        print("{} users didn't finish their script".format(simulated.unfinished))
+    if simulated.unexpected_replies:
+        print("{} replies didn't match the script".format(simulated.unexpected_replies))
+    print("{:>14} {:>7} {:>9} {:>9} {:>9}".format("command", "count", "p50 ms", "p95 ms", "p99 ms"))
+    for label, latencies in simulated.latencies.items():
+        print("{:>14} {:>7} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+            label, len(latencies), percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000,
+            percentile(latencies, 99) * 1000))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    run_load(int(sys.argv[1]) if len(sys.argv) > 1 else 1000, sys.argv[2] if len(sys.argv) > 2 else "polling",
+             "limited" in sys.argv[3:])
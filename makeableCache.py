@@ -0,0 +1,113 @@
+import logging
+import threading
+
+import catalog
+import userSqlDb
+
+cache_info = logging.getLogger("info." + __name__)
+
+
+class _UserMakeable:
+    """One user's inventory and the drinks it can make, as of one catalog version"""
+
+    def __init__(self, version, stock_bits, makeable):
+        self.version = version
+        # Uppercase stock name -> makeable index bit (None if no recipe uses it)
+        self.stock_bits = stock_bits
+        self.makeable = makeable
+
+    @property
+    def mask(self):
+        mask = 0
+        for bit in self.stock_bits.values():
+            if bit is not None:
+                mask |= 1 << bit
+        return mask
+
+
+class MakeableStore:
+    """
+    Keeps every user's set of makeable drinks materialized. An inventory change only re-checks the drinks that use the
+    changed ingredient (through the catalog's reverse index), and a new catalog version recomputes everyone in a
+    background thread, so reading a user's set doesn't recompute anything
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user):
+        """
+        :param user: User object. Its stock is only loaded if the user hasn't been seen since the catalog changed
+        :return: frozenset of drink names the user can make
+        """
+        drink_catalog = catalog.get_catalog()
+        entry = self._entries.get(user.user_id)
+        if entry is None or entry.version != drink_catalog.version:
+            entry = self._build(drink_catalog, [item.stock for item in user.stock])
+            with self._lock:
+                self._entries[user.user_id] = entry
+        return entry.makeable
+
+    def inventory_changed(self, user_id, stock, added):
+        """
+        Updates one user's makeable set after a single inventory item was added or removed.
+        Registered with userSqlDb.inventory_listeners
+        """
+        drink_catalog = catalog.get_catalog()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry.version != drink_catalog.version:
+                # Nothing current to update, the next get() builds it from the database
+                self._entries.pop(user_id, None)
+                return
+
+            stock_bits = dict(entry.stock_bits)
+            if added:
+                stock_bits[stock.upper()] = drink_catalog.stock_bit(stock)
+            else:
+                stock_bits.pop(stock.upper(), None)
+            updated = _UserMakeable(entry.version, stock_bits, entry.makeable)
+            bit = drink_catalog.stock_bit(stock)
+            # Another item in stock may simplify to the same ingredient, in which case nothing changes
+            if bit is not None and entry.mask != updated.mask:
+                missing = ~updated.mask
+                affected = drink_catalog.drinks_needing(bit)
+                if added:
+                    updated.makeable = entry.makeable | frozenset(name for name, mask in affected
+                                                                  if not mask & missing)
+                else:
+                    updated.makeable = entry.makeable - frozenset(name for name, mask in affected)
+            self._entries[user_id] = updated
+
+    def refresh_all(self, drink_catalog):
+        """Recomputes every cached user against a new catalog without blocking the caller.
+        Registered with catalog.catalog_listeners"""
+        thread = threading.Thread(target=self._refresh, args=(drink_catalog,), name="makeable-refresh", daemon=True)
+        thread.start()
+        return thread
+
+    def _refresh(self, drink_catalog):
+        for user_id, entry in list(self._entries.items()):
+            # A newer catalog may have been swapped in while this one was still refreshing
+            if catalog.get_catalog() is not drink_catalog:
+                return
+            if entry.version != drink_catalog.version:
+                refreshed = self._build(drink_catalog, list(entry.stock_bits))
+                with self._lock:
+                    if self._entries.get(user_id) is entry:
+                        self._entries[user_id] = refreshed
+        cache_info.info("Refreshed makeable drinks for {} users against catalog version {}".format(
+            len(self._entries), drink_catalog.version))
+
+    @staticmethod
+    def _build(drink_catalog, stock_names):
+        stock_bits = {stock.upper(): drink_catalog.stock_bit(stock) for stock in stock_names}
+        entry = _UserMakeable(drink_catalog.version, stock_bits, frozenset())
+        entry.makeable = frozenset(drink_catalog.makeable(entry.mask))
+        return entry
+
+
+store = MakeableStore()
+userSqlDb.inventory_listeners.append(store.inventory_changed)
+catalog.catalog_listeners.append(store.refresh_all)
@@ -0,0 +1,316 @@
+#! python3
+"""
+In-process metrics: latency histograms and error counters for every handler and for Telegram sends, plus gauges
+read when the metrics are collected (eg. the dispatcher's queue depth).
+They're served in the Prometheus text format by MetricsServer and summarised by the /stats command.
+Usage: python3 metrics.py [url]
+prints the metrics of a running bot (default http://127.0.0.1:9464/metrics).
+"""
+import bisect
+import functools
+import inspect
+import logging
+import sys
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+metrics_info = logging.getLogger("info." + __name__)
+metrics_warn = logging.getLogger("warn." + __name__)
+
+# Upper bounds in seconds, from a cached lookup up to a slow /update
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HANDLER_SECONDS = "bot_handler_seconds"
+HANDLER_ERRORS = "bot_handler_errors_total"
+SEND_SECONDS = "bot_send_seconds"
+SEND_ERRORS = "bot_send_errors_total"
+UPDATE_QUEUE_DEPTH = "bot_update_queue_depth"
+OUTBOX_DEPTH = "bot_outbox_depth"
+OPEN_SESSIONS = "bot_open_sessions"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Counts observations into fixed buckets, the way a Prometheus histogram does. Not thread safe on its own"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # One count per bucket and a last one for anything above the largest bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Estimates a quantile by interpolating within the bucket it falls in, like Prometheus' histogram_quantile()
+        :param q: float between 0 and 1
+        :return: value in seconds, or 0.0 with no observations
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if index == len(self.buckets):
+                    # Above every bound, the largest bound is the best guess there is
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Registry:
+    """Every metric the bot keeps, by name and labels"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # name -> (type, help text), in the order metrics are exposed
+        self._descriptions = OrderedDict()
+        # name -> {labels tuple: Histogram}
+        self._histograms = {}
+        # name -> {labels tuple: count}
+        self._counters = {}
+        # name -> function returning the current value
+        self._gauges = {}
+
+    def describe(self, name, kind, help_text):
+        """
+        :param kind: "histogram", "counter" or "gauge"
+        :param help_text: HELP line shown with the metric
+        """
+        with self._lock:
+            self._descriptions[name] = (kind, help_text)
+
+    def observe(self, name, seconds, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def increment(self, name, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def gauge(self, name, help_text, function):
+        """
+        Registers (or replaces) a gauge read when the metrics are collected
+        :param function: takes no arguments and returns a number
+        """
+        self.describe(name, "gauge", help_text)
+        with self._lock:
+            self._gauges[name] = function
+
+    def histograms(self, name):
+        """Returns a dict of labels -> copy of the Histogram, for one metric. Labels are sorted (name, value) pairs"""
+        with self._lock:
+            copies = {}
+            for key, histogram in self._histograms.get(name, {}).items():
+                copy = Histogram(histogram.buckets)
+                copy.counts, copy.count, copy.sum = list(histogram.counts), histogram.count, histogram.sum
+                copies[key] = copy
+        return copies
+
+    def counters(self, name):
+        """Returns a dict of labels -> count, for one metric"""
+        with self._lock:
+            return dict(self._counters.get(name, {}))
+
+    def gauge_values(self):
+        """Reads every gauge. A gauge that raises is left out"""
+        with self._lock:
+            gauges = list(self._gauges.items())
+        values = OrderedDict()
+        for name, function in sorted(gauges):
+            try:
+                values[name] = function()
+            except Exception as e:
+                metrics_warn.error("Could not read gauge {}: {}".format(name, e))
+        return values
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format"""
+        gauges = self.gauge_values()
+        with self._lock:
+            descriptions = list(self._descriptions.items())
+            histograms = {name: {key: (list(histogram.counts), histogram.count, histogram.sum)
+                                 for key, histogram in series.items()}
+                          for name, series in self._histograms.items()}
+            counters = {name: dict(series) for name, series in self._counters.items()}
+
+        lines = []
+        for name, (kind, help_text) in descriptions:
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, kind))
+            if kind == "histogram":
+                for key, (counts, count, total) in sorted(histograms.get(name, {}).items()):
+                    cumulative = 0
+                    for bound, bucket_count in zip(self.buckets, counts):
+                        cumulative += bucket_count
+                        lines.append("{}_bucket{} {}".format(name, _labels_text(key + (("le", repr(bound)),)),
+                                                             cumulative))
+                    lines.append("{}_bucket{} {}".format(name, _labels_text(key + (("le", "+Inf"),)), count))
+                    lines.append("{}_sum{} {!r}".format(name, _labels_text(key), total))
+                    lines.append("{}_count{} {}".format(name, _labels_text(key), count))
+            elif kind == "counter":
+                for key, count in sorted(counters.get(name, {}).items()):
+                    lines.append("{}{} {}".format(name, _labels_text(key), count))
+            elif name in gauges:
+                lines.append("{} {}".format(name, gauges[name]))
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        Returns a short plain text report for the /stats command: handlers by total time spent, then sends and gauges
+        """
+        handlers = self.histograms(HANDLER_SECONDS)
+        errors = {}
+        for labels, count in self.counters(HANDLER_ERRORS).items():
+            handler = dict(labels)["handler"]
+            errors[handler] = errors.get(handler, 0) + count
+        lines = ["Handlers (calls, errors, p50/p99 ms):"]
+        for labels, histogram in sorted(handlers.items(), key=lambda item: -item[1].sum):
+            handler = dict(labels)["handler"]
+            lines.append("{}: {}, {}, {:.0f}/{:.0f}".format(
+                handler, histogram.count, errors.get(handler, 0),
+                histogram.quantile(0.5) * 1000, histogram.quantile(0.99) * 1000))
+        if not handlers:
+            lines.append("No updates handled yet")
+
+        sends = Histogram(self.buckets)
+        for histogram in self.histograms(SEND_SECONDS).values():
+            sends.counts = [mine + theirs for mine, theirs in zip(sends.counts, histogram.counts)]
+            sends.count += histogram.count
+            sends.sum += histogram.sum
+        lines.append("\nSends: {}, {} failed, p50/p99 {:.0f}/{:.0f} ms".format(
+            sends.count, sum(self.counters(SEND_ERRORS).values()), sends.quantile(0.5) * 1000,
+            sends.quantile(0.99) * 1000))
+        for name, value in self.gauge_values().items():
+            lines.append("{}: {}".format(name, value))
+        return "\n".join(lines)
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _labels_text(key):
+    if not key:
+        return ""
+    return "{{{}}}".format(",".join('{}="{}"'.format(
+        name, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in key))
+
+
+# Shared by the whole bot, like sqlMetrics.session_tracker
+registry = Registry()
+registry.describe(HANDLER_SECONDS, "histogram", "Seconds spent in each handler, including its database sessions")
+registry.describe(HANDLER_ERRORS, "counter", "Exceptions raised by each handler, by exception type")
+registry.describe(SEND_SECONDS, "histogram", "Seconds each Telegram send_message call took")
+registry.describe(SEND_ERRORS, "counter", "Telegram send_message calls that failed, by exception type")
+
+
+def timed_handler(callback, in_conversation=False):
+    """
+    Wraps a (bot, update, ...) handler so every call is timed into HANDLER_SECONDS and every exception counted in
+    HANDLER_ERRORS, labelled with the handler's function name. Has the signature wrap_handlers() expects
+    """
+    name = inspect.unwrap(callback).__name__
+
+    @functools.wraps(callback)
+    def wrapper(bot, update, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return callback(bot, update, *args, **kwargs)
+        except Exception as e:
+            registry.increment(HANDLER_ERRORS, handler=name, error=type(e).__name__)
+            raise
+        finally:
+            registry.observe(HANDLER_SECONDS, time.perf_counter() - start, handler=name)
+    return wrapper
+
+
+def timed_send(send_message):
+    """Wraps Bot.send_message so every call is timed into SEND_SECONDS and every failure counted in SEND_ERRORS"""
+    @functools.wraps(send_message)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return send_message(*args, **kwargs)
+        except Exception as e:
+            registry.increment(SEND_ERRORS, error=type(e).__name__)
+            raise
+        finally:
+            registry.observe(SEND_SECONDS, time.perf_counter() - start)
+    return wrapper
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/") != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = self.server.registry.render().encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        metrics_info.debug(format % args)
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    """Serves GET /metrics in the Prometheus text format. Meant to listen on localhost only"""
+    daemon_threads = True
+
+    def __init__(self, listen="127.0.0.1", port=9464, metrics_registry=None):
+        """
+        :param port: port to bind to, 0 picks a free one
+        :param metrics_registry: Registry to serve, the shared one if not given
+        """
+        self.registry = metrics_registry or registry
+        self._thread = None
+        HTTPServer.__init__(self, (listen, port), _MetricsHandler)
+
+    @property
+    def local_url(self):
+        return "http://{}:{}/metrics".format(self.server_address[0], self.server_address[1])
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+        metrics_info.info("Serving metrics on {}".format(self.local_url))
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+
+if __name__ == '__main__':
+    url = sys.argv[1] if len(sys.argv) > 1 else "http://127.0.0.1:9464/metrics"
+    with urllib.request.urlopen(url, timeout=10) as response:
+        print(response.read().decode("utf8"))
@@ -0,0 +1,235 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from asyncRuntime import unwrap_bot
+
+outbound_info = logging.getLogger("info." + __name__)
+outbound_warn = logging.getLogger("warn." + __name__)
+
+# Longest text Telegram accepts in one message
+MESSAGE_LIMIT = 4096
+
+
+def split_block(block, limit=MESSAGE_LIMIT):
+    """
+    Splits a block of text that is too long for one message, at line breaks where possible
+    :return: list of Strings no longer than limit
+    """
+    pieces = []
+    current = ""
+    for line in block.split("\n"):
+        while len(line) > limit:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(line[:limit])
+            line = line[limit:]
+        if current and len(current) + 1 + len(line) > limit:
+            pieces.append(current)
+            current = line
+        else:
+            current = "{}\n{}".format(current, line) if current else line
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def coalesce(blocks, limit=MESSAGE_LIMIT, separator="\n\n"):
+    """
+    Packs blocks of text (eg. one recipe each) into as few messages as possible. Blocks stay in order and are only
+    split if a single block is longer than limit
+    :param blocks: iterable of Strings
+    :return: list of message Strings
+    """
+    messages = []
+    current = ""
+    for block in blocks:
+        for piece in (split_block(block, limit) if len(block) > limit else [block]):
+            if current and len(current) + len(separator) + len(piece) <= limit:
+                current += separator + piece
+            else:
+                if current:
+                    messages.append(current)
+                current = piece
+    if current:
+        messages.append(current)
+    return messages
+
+
+class TokenBucket:
+    """Allows rate sends per second on average, with bursts of up to capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        # No tokens are handed out before this time, set after Telegram asks us to back off
+        self.paused_until = 0.0
+
+    def delay(self, now):
+        """Returns how many seconds until a token is free, 0 if one is free now"""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, now, seconds):
+        self.paused_until = now + seconds
+        self.tokens = 0.0
+        # Nothing refills while paused, so sending picks up at rate once the pause ends rather than with a burst
+        self.updated = self.paused_until
+
+
+class Outbox:
+    """
+    Queues replies and sends them from a few worker threads within Telegram's flood limits: a global token bucket
+    for the whole bot and one bucket per chat. Messages to one chat go out in order, one at a time, and chats take
+    turns so one long reply can't hold up everyone else
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, senders=4):
+        """
+        :param global_rate: messages per second across every chat
+        :param chat_rate: messages per second to any one chat
+        :param chat_burst: messages one chat can get at once before chat_rate applies
+        :param senders: worker threads, so slow round trips to Telegram don't keep the bot under global_rate
+        """
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.senders = senders
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        # chat_id -> TokenBucket, only kept while the chat has been active recently
+        self._chat_buckets = {}
+        # chat_id -> deque of (bot, text, kwargs) still to send, in the order chats take turns
+        self._pending = OrderedDict()
+        # Chats with a message being sent right now. They're skipped until it's done, which keeps their order
+        self._in_flight = set()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stopping = False
+
+    def send(self, bot, chat_id, blocks, **kwargs):
+        """
+        Queues blocks of text for a chat, packed into as few messages as possible
+        :param bot: Bot used to send
+        :param blocks: String or list of Strings, eg. one recipe each
+        :param kwargs: passed on to bot.send_message() for every message
+        :return: number of messages queued
+        """
+        if isinstance(blocks, str):
+            blocks = [blocks]
+        # A BotProxy's send_message only schedules the send, so its errors (and RetryAfter) would never reach us.
+        # The outbox already sends from its own thread, so it calls the real bot
+        bot = unwrap_bot(bot)
+        messages = coalesce(blocks)
+        with self._condition:
+            queue = self._pending.setdefault(chat_id, deque())
+            queue.extend((bot, text, kwargs) for text in messages)
+            if not self._threads:
+                self._stopping = False
+                for number in range(self.senders):
+                    thread = threading.Thread(target=self._run, name="outbox-{}".format(number), daemon=True)
+                    self._threads.append(thread)
+                    thread.start()
+            self._condition.notify()
+        return len(messages)
+
+    def depth(self):
+        """Returns the number of messages waiting to be sent"""
+        with self._condition:
+            return sum(len(queue) for queue in self._pending.values())
+
+    def stop(self):
+        """Sends everything still queued, then stops the workers"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                chat_id, message = self._next_message()
+                if chat_id is None:
+                    self._threads.remove(threading.current_thread())
+                    return
+                self._in_flight.add(chat_id)
+            try:
+                self._deliver(chat_id, message)
+            finally:
+                with self._condition:
+                    self._in_flight.discard(chat_id)
+                    # The chat can have its next message now
+                    self._condition.notify_all()
+
+    def _next_message(self):
+        """Waits for a message that can be sent now. Must be called holding the condition"""
+        while True:
+            if not self._pending:
+                if self._stopping:
+                    return None, None
+                self._condition.wait()
+                continue
+
+            now = time.monotonic()
+            wait = self._global_bucket.delay(now)
+            if not wait:
+                wait = None
+                for chat_id in self._pending:
+                    if chat_id in self._in_flight:
+                        continue
+                    bucket = self._chat_buckets.get(chat_id)
+                    if bucket is None:
+                        bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+                    chat_wait = bucket.delay(now)
+                    if not chat_wait:
+                        bucket.take()
+                        self._global_bucket.take()
+                        queue = self._pending.pop(chat_id)
+                        message = queue.popleft()
+                        if queue:
+                            # Back of the line, so the other chats get a turn first
+                            self._pending[chat_id] = queue
+                        self._forget_idle_buckets(now)
+                        return chat_id, message
+                    wait = chat_wait if wait is None else min(wait, chat_wait)
+            self._condition.wait(wait)
+
+    def _forget_idle_buckets(self, now):
+        # A bucket that has refilled is the same as a new one, so it doesn't need to be kept
+        if len(self._chat_buckets) > 1000:
+            for chat_id, bucket in list(self._chat_buckets.items()):
+                if (chat_id not in self._pending and chat_id not in self._in_flight and bucket.delay(now) == 0
+                        and bucket.tokens >= bucket.capacity):
+                    del self._chat_buckets[chat_id]
+
+    def _deliver(self, chat_id, message):
+        bot, text, kwargs = message
+        try:
+            bot.send_message(chat_id=chat_id, text=text, **kwargs)
+        except Exception as e:
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is None:
+                outbound_warn.error("Failed to send message to chat {}: {}".format(chat_id, e))
+                return
+            # Flood limit hit anyway, so hold every send back for as long as Telegram asks and try this one again
+            outbound_warn.warning("Telegram asked to wait {}s before sending more messages".format(retry_after))
+            with self._condition:
+                self._global_bucket.pause(time.monotonic(), retry_after)
+                queue = self._pending.pop(chat_id, deque())
+                queue.appendleft(message)
+                self._pending[chat_id] = queue
+                self._pending.move_to_end(chat_id, last=False)
+                self._condition.notify()
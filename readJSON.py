@@ -13,6 +13,7 @@ class Secrets:
         self.ftp_pass = ""
         self.debug_token = ""
         self.bottender_token = ""
+        self.webhook_secret = ""
         self.json_log = logging.getLogger('warn.' + __name__)
         try:
             self.open_json()
@@ -28,10 +29,75 @@ class Secrets:
             self.sheet_name = data["sheets"]["name"]
             self.debug_token = data["telegram"]["debug_token"]
             self.bottender_token = data["telegram"]["bottender_token"]
+            # Optional, a random secret is used for each run if it isn't set
+            self.webhook_secret = data["telegram"].get("webhook_secret", "")
             self.ftp_host = data["ftp"]["host"]
             self.ftp_user = data["ftp"]["username"]
             self.ftp_pass = data["ftp"]["password"]
 
+class Settings:
+    """Bot settings from json/settings.json. Anything missing from the file keeps its default value"""
+
+    def __init__(self):
+        # Most recipes returned for one /drinks search
+        self.search_result_limit = 10
+        # "threaded" runs handlers on the dispatcher thread, "asyncio" runs them as coroutines (see asyncRuntime.py)
+        self.runtime_mode = "threaded"
+        # Threads for blocking database work and for Telegram sends in asyncio mode
+        self.db_workers = 4
+        self.send_workers = 8
+        # "polling" asks Telegram for updates with getUpdates, "webhook" has Telegram post them to webhookServer.py
+        self.update_mode = "polling"
+        # Public HTTPS URL Telegram posts to, and the local address the receiver listens on behind it
+        self.webhook_url = ""
+        self.webhook_listen = "127.0.0.1"
+        self.webhook_port = 8443
+        self.webhook_path = "telegram"
+        # Outbound limits in messages per second. Telegram allows about 30 overall and 1 per chat
+        self.send_global_rate = 30
+        self.send_chat_rate = 1
+        self.send_chat_burst = 3
+        # Threads sending replies, so the round trip to Telegram doesn't cap the bot below send_global_rate
+        self.send_threads = 4
+        # Prometheus style metrics are served on this local address, a port of null turns them off
+        self.metrics_listen = "127.0.0.1"
+        self.metrics_port = 9464
+        # Telegram user ids allowed to use admin commands like /stats
+        self.admin_ids = []
+        self.json_log = logging.getLogger('warn.' + __name__)
+        try:
+            self.open_json()
+        except FileNotFoundError as e:
+            self.json_log.error("settings.json does not exist on this system, using default settings.")
+
+    def open_json(self):
+        telegram_path = os.path.abspath(os.path.dirname(__file__))
+        path = os.path.join(telegram_path, "json", "settings.json")
+        with open(path, 'r') as f:
+            data = json.load(f)
+            search = data.get("search", {})
+            self.search_result_limit = search.get("result_limit", self.search_result_limit)
+            runtime = data.get("runtime", {})
+            self.runtime_mode = runtime.get("mode", self.runtime_mode)
+            self.db_workers = runtime.get("db_workers", self.db_workers)
+            self.send_workers = runtime.get("send_workers", self.send_workers)
+            updates = data.get("updates", {})
+            self.update_mode = updates.get("mode", self.update_mode)
+            self.webhook_url = updates.get("webhook_url", self.webhook_url)
+            self.webhook_listen = updates.get("webhook_listen", self.webhook_listen)
+            self.webhook_port = updates.get("webhook_port", self.webhook_port)
+            self.webhook_path = updates.get("webhook_path", self.webhook_path)
+            outbound = data.get("outbound", {})
+            self.send_global_rate = outbound.get("global_rate", self.send_global_rate)
+            self.send_chat_rate = outbound.get("chat_rate", self.send_chat_rate)
+            self.send_chat_burst = outbound.get("chat_burst", self.send_chat_burst)
+            self.send_threads = outbound.get("senders", self.send_threads)
+            metrics = data.get("metrics", {})
+            self.metrics_listen = metrics.get("listen", self.metrics_listen)
+            self.metrics_port = metrics.get("port", self.metrics_port)
+            admin = data.get("admin", {})
+            self.admin_ids = admin.get("user_ids", self.admin_ids)
+
 class Loggers:
 
     def setup_logging(self,
@@ -1,52 +1,98 @@
 import logging
-from drinksSqlDb import query_drink_contains, get_formatted_ingredients, get_drink_session, close_session, ing_contains_all
+import re
+import threading
+from collections import OrderedDict
+
+import ftsIndex
+from drinksSqlDb import get_formatted_ingredients
+from catalog import get_catalog
 
 log = logging.getLogger("info." + __name__)
 
-def drink_search(drink_list):
-    """Returns Drink objects corresponding to searched drink names"""
-    # Start a new SQL session, pass it as return
-    session = get_drink_session()
-    result_list = []
+def drink_search(drink_list, limit=None, catalog=None, session=None):
+    """
+    Returns Recipe objects corresponding to searched drink names
+    :param drink_list: list of search terms, any number of them
+    :param limit: int, maximum number of recipes to return (all of them if not given)
+    :param catalog: Catalog to search, defaults to the current one
+    :param session: a drinks.db Session() object. With one (and a drinks.db that has the search index) the search
+    runs on the full text index, otherwise on the catalog
+    :return: list of Recipe objects with no duplicates
+    """
+    catalog = catalog or get_catalog()
+    if session is None or not catalog.search_index:
+        result_list = catalog.search_drinks(drink_list, limit)
+    else:
+        result_list = _indexed_drink_search(drink_list, limit, catalog, session)
+    log.debug(result_list)
+    return result_list
+
+def _indexed_drink_search(drink_list, limit, catalog, session):
+    """Exact names first, then every drink whose name matches a term ranked by bm25, then fuzzy matches for
+    terms the index found nothing for"""
+    terms = list(OrderedDict.fromkeys(term.strip() for term in drink_list if term.strip()))
+    results = OrderedDict()
+    for term in terms:
+        recipe = catalog.find_drink(term)
+        if recipe:
+            results[recipe.drink_name] = recipe
 
-    # Number of drinks is currently capped at 4
-    num_drinks = min(len(drink_list), 4)
+    names = ftsIndex.search_drinks(session, terms, limit=limit)
+    for name in names:
+        recipe = catalog.find_drink(name)
+        # The catalog can be a moment behind the file while /update swaps drinks.db
+        if recipe:
+            results.setdefault(recipe.drink_name, recipe)
 
-    # If no drink names sent, return empty string
-    if num_drinks == 0:
-        close_session(session)
-        return []
+    # Anything left over may be misspelled
+    for term in terms:
+        if catalog.find_drink(term) or any(ftsIndex.matches(term, name) for name in names):
+            continue
+        for recipe, score in catalog.similar_drinks(term, limit=1):
+            results.setdefault(recipe.drink_name, recipe)
 
-    # Iterate through all the searched drinks (or at least the first four)
-    for index in range(num_drinks):
-        # Get a list of drink names that contain the searched term for each index
-        # session remains consistent throughout this loop
-        recipe, session = query_drink_contains(drink_list[index], session)
-        # list.extend concatenates the list so it's one dimensional
-        result_list.extend(recipe)
+    found = list(results.values())
+    return found if limit is None else found[:limit]
 
-    log.debug(result_list)
-    return result_list, session
+def split_search_terms(text):
+    """Splits a message into drink search terms. Lists of full drink names can be sent one per line or separated by
+    commas, otherwise every word is its own term"""
+    if "\n" in text or "," in text:
+        return [term.strip() for term in re.split(r"[\n,]", text) if term.strip()]
+    return text.split()
 
-def ing_search(ing_name):
-    """Returns list of drinks that use given ingredient"""
+def ing_search(ing_name, session=None, catalog=None):
+    """
+    Returns list of drinks that use given ingredient. The in-memory catalog answers this about ten times faster than
+    the full text index, so the index (given a session) is only asked when the catalog finds nothing, to also match
+    simplified ingredient names
+    """
+    catalog = catalog or get_catalog()
     # list of drinks that use the ingredient
-    use_list = []
-    session = get_drink_session()
-    # lstoflst_drinks is a list of lists containing drink objects
-    lstoflst_drinks = ing_contains_all(ing_name, session)
-    for lst in lstoflst_drinks:
-        # lst.drinks is a list of Drink objects
-        for drink in lst.drinks:
-            # append each drink name to existing list
-            use_list.append(drink.drink_name)
+    use_list = catalog.drinks_using(ing_name)
+    if not use_list and session is not None and catalog.search_index:
+        use_list = ftsIndex.drinks_with_ingredient(session, ing_name)
     log.debug("{} results for ingredient {}: {}".format(len(use_list), ing_name, use_list))
-    close_session(session)
     return use_list
 
+def ingredient_suggestions(text, session=None, catalog=None):
+    """
+    Returns ingredient names, then simplified names, that look like what the user typed. Used when an item sent to
+    /addinv doesn't match exactly
+    :return: list of Strings in title case
+    """
+    catalog = catalog or get_catalog()
+    if session is None or not catalog.search_index:
+        names = [ingredient.ing for ingredient in catalog.ingredients_containing(text)]
+        names += catalog.simple_containing(text)
+    else:
+        names = ftsIndex.matching_ingredients(session, text, "ing")
+        names += ftsIndex.matching_ingredients(session, text, "simple")
+    return [name.title() for name in names]
 
-def recipe_string(recipe, session):
-    """Takes recipe (instance of Drink), and builds string for output"""
+
+def recipe_string(recipe):
+    """Takes recipe (Recipe or Drink object), and builds string for output"""
     botString = "{} is found on page {}:\n".format(recipe.drink_name, recipe.page)
     botString += '\n'.join(get_formatted_ingredients(recipe)).title()
     # If the drink has a garnish, add it to the bottom of the string
@@ -55,3 +101,75 @@ def recipe_string(recipe, session):
         botString += "\nGarnish with {}".format(recipe.garnishes[0].gar.title())
     log.debug("botstring output: {}".format(botString))
     return botString
+
+
+class RecipeCache:
+    """Finished recipe messages keyed by drink name. Every message belongs to one catalog version, and looking up a
+    newer version throws the old messages away in one step. Requests still using an older catalog get their
+    messages rendered without touching the cache"""
+
+    def __init__(self):
+        # (catalog version, dict of drink name -> message) swapped as a single object so readers never see a mix
+        self._state = (None, {})
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, recipe, version):
+        """
+        :param recipe: Recipe object to render
+        :param version: version of the Catalog that recipe came from
+        :return: the message text for recipe
+        """
+        messages = self._messages_for(version)
+        text = messages.get(recipe.drink_name) if messages is not None else None
+        if text is None:
+            self.misses += 1
+            text = recipe_string(recipe)
+            if messages is not None:
+                messages[recipe.drink_name] = text
+        else:
+            self.hits += 1
+        return text
+
+    def warm(self, catalog):
+        """Renders every recipe in catalog up front so the first requests after a load are hits"""
+        messages = self._messages_for(catalog.version)
+        if messages is None:
+            log.info("Not caching recipe messages for catalog version {}, a newer one is in use".format(
+                catalog.version))
+            return
+        for name, recipe in catalog.recipes.items():
+            if name not in messages:
+                messages[name] = recipe_string(recipe)
+        log.info("Cached {} recipe messages for catalog version {}".format(len(messages), catalog.version))
+
+    def stats(self):
+        """Returns dict of the cache's current version, size, hits and misses"""
+        version, messages = self._state
+        return {"version": version, "size": len(messages), "hits": self.hits, "misses": self.misses}
+
+    def _messages_for(self, version):
+        """
+        Returns the message dict for version, replacing the cached one if version is newer
+        :return: dict, or None if version is older than the cached one and shouldn't be cached
+        """
+        current_version, messages = self._state
+        if current_version != version:
+            with self._lock:
+                current_version, messages = self._state
+                if current_version is None or version > current_version:
+                    messages = {}
+                    self._state = (version, messages)
+                elif version < current_version:
+                    # Only ever move forward, so a request finishing on an old catalog can't wipe the new one
+                    return None
+        return messages
+
+
+recipe_cache = RecipeCache()
+
+
+def recipe_message(recipe, catalog):
+    """Returns the output string for recipe (a Recipe from catalog), rendering it only the first time it's asked for"""
+    return recipe_cache.get(recipe, catalog.version)
@@ -0,0 +1,164 @@
+#! python3
+"""
+Brings drinks.db in line with the AllDrinks worksheet by applying only the rows that changed.
+Usage: python3 sheetSync.py [path/to/AllDrinks.csv]
+Without a path the worksheet is read from Google Sheets.
+"""
+import csv
+import hashlib
+import logging
+import sys
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+import dbMigrations
+import drinksSqlDb
+import ftsIndex
+from drinksSqlDb import Drink, Sheet_Row, ing_assc_table, gar_assc_table
+from readJSON import Loggers
+
+sync_info = logging.getLogger("info." + __name__)
+sync_warn = logging.getLogger("warn." + __name__)
+
+# Worksheet columns A through M: drink name, page, ten ingredients and a garnish
+ROW_WIDTH = 13
+
+
+class CsvWorksheet:
+    """Local stand-in for a pygsheets worksheet, backed by a CSV export of AllDrinks"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def get_all_values(self):
+        with open(self.path, 'r', newline='', encoding='utf8') as f:
+            return [row for row in csv.reader(f)]
+
+
+class SyncReport:
+    """Names of the drinks a sync added, updated and removed, and how many it left alone"""
+
+    def __init__(self, added, updated, removed, unchanged=0):
+        self.added = added
+        self.updated = updated
+        self.removed = removed
+        # Number of worksheet rows that already matched drinks.db
+        self.unchanged = unchanged
+
+    def __bool__(self):
+        return bool(self.added or self.updated or self.removed)
+
+    def __repr__(self):
+        return "<SyncReport(added = {}, updated = {}, removed = {}, unchanged = {})>".format(
+            len(self.added), len(self.updated), len(self.removed), self.unchanged)
+
+    def summary(self):
+        """Returns a readable list of every change"""
+        lines = []
+        for label, names in (("Added", self.added), ("Updated", self.updated), ("Removed", self.removed)):
+            lines.append("{} {} drink(s){}".format(label, len(names), ": " + ", ".join(names) if names else ""))
+        lines.append("{} drink(s) unchanged".format(self.unchanged))
+        return "\n".join(lines)
+
+
+def row_hash(row):
+    """Returns a stable hash of one worksheet row"""
+    return hashlib.sha1("\x1f".join(row).encode("utf8")).hexdigest()
+
+
+def read_rows(wks):
+    """
+    Reads every drink row out of a worksheet
+    :param wks: pygsheets worksheet or CsvWorksheet
+    :return: OrderedDict of drink name -> tuple of ROW_WIDTH cell Strings. The header row is skipped
+    """
+    rows = OrderedDict()
+    for values in wks.get_all_values()[1:]:
+        cells = tuple(cell.strip() for cell in (list(values) + [""] * ROW_WIDTH)[:ROW_WIDTH])
+        if not cells[0]:
+            continue
+        if cells[0] in rows:
+            sync_warn.warning("Drink {} is in the worksheet more than once, keeping the first row".format(cells[0]))
+            continue
+        rows[cells[0]] = cells
+    return rows
+
+
+def sync_from_worksheet(wks, session="", builder=None):
+    """
+    Applies the differences between a worksheet and drinks.db in one transaction
+    :param wks: pygsheets worksheet or CsvWorksheet laid out like AllDrinks
+    :param session: a writable drinks.db BuildSession() object
+    :param builder: DB_Builder used to add rows, a new one is made if not given
+    :return: SyncReport
+    """
+    if not session:
+        session = drinksSqlDb.BuildSession()
+    if builder is None:
+        builder = drinksSqlDb.DB_Builder()
+
+    sheet_rows = read_rows(wks)
+    sheet_hashes = {name: row_hash(cells) for name, cells in sheet_rows.items()}
+    # Drinks built before syncing existed have no stored hash, so they are always treated as changed
+    stored_hashes = {name: None for name, in session.query(Drink.drink_name)}
+    stored_hashes.update((row.drink_name, row.row_hash) for row in session.query(Sheet_Row)
+                         if row.drink_name in stored_hashes)
+
+    added = [name for name in sheet_hashes if name not in stored_hashes]
+    removed = [name for name in stored_hashes if name not in sheet_hashes]
+    updated = [name for name in sheet_hashes
+               if name in stored_hashes and stored_hashes[name] != sheet_hashes[name]]
+    report = SyncReport(added, updated, removed, len(sheet_hashes) - len(added) - len(updated))
+    if not report:
+        sync_info.info("Worksheet and database already match")
+        session.close()
+        return report
+
+    try:
+        # Updated drinks are dropped and added again, which replaces their ing_assc and gar_assc links
+        stale = removed + updated
+        if stale:
+            session.execute(ing_assc_table.delete().where(ing_assc_table.c.Drink_name.in_(stale)))
+            session.execute(gar_assc_table.delete().where(gar_assc_table.c.Drink_name.in_(stale)))
+            session.query(Drink).filter(Drink.drink_name.in_(stale)).delete(synchronize_session=False)
+            session.query(Sheet_Row).filter(Sheet_Row.drink_name.in_(stale)).delete(synchronize_session=False)
+
+        builder.bulk_add_rows([sheet_rows[name] for name in added + updated], session)
+        session.execute(Sheet_Row.__table__.insert(),
+                        [{"drink_name": name, "row_hash": sheet_hashes[name]} for name in added + updated])
+
+        # Clear out ingredients and garnishes nothing uses any more, then recount popularity from the links
+        session.execute(text("DELETE FROM ingredients WHERE ing_id NOT IN "
+                             "(SELECT CAST(Ingredients_string AS INTEGER) FROM ing_assc)"))
+        session.execute(text("DELETE FROM garnishes WHERE gar NOT IN (SELECT Garnish_string FROM gar_assc)"))
+        session.execute(text("UPDATE ingredients SET popularity = (SELECT COUNT(*) FROM ing_assc "
+                             "WHERE CAST(ing_assc.Ingredients_string AS INTEGER) = ingredients.ing_id)"))
+        ftsIndex.build_search_index(session)
+        session.commit()
+    except Exception:
+        session.rollback()
+        sync_warn.error("Sync failed, no changes were made")
+        raise
+    finally:
+        session.close()
+
+    sync_info.info("Synced worksheet: {}".format(report))
+    return report
+
+
+if __name__ == '__main__':
+    setup_loggers = Loggers()
+    setup_loggers.setup_logging(default_level=logging.INFO)
+    dbMigrations.migrate_drinks_db(drinksSqlDb.build_engine)
+
+    sync_builder = drinksSqlDb.DB_Builder()
+    if len(sys.argv) > 1:
+        worksheet = CsvWorksheet(sys.argv[1])
+    else:
+        worksheet = sync_builder.open_all_drinks()[1]
+    sync_report = sync_from_worksheet(worksheet, builder=sync_builder)
+    if sync_report.added or sync_report.updated:
+        # New ingredients need their simplified names for /makeable
+        sync_builder.populate_simple_drink()
+    print(sync_report.summary())
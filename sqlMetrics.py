@@ -0,0 +1,111 @@
+import logging
+import sys
+import threading
+import time
+import weakref
+
+from sqlalchemy import event
+
+metrics_warn = logging.getLogger("warn." + __name__)
+
+
+class QueryCounter:
+    """
+    Counts the SQL statements an engine sends to the database while the block is active
+        with QueryCounter(drinksSqlDb.engine) as counter:
+            ...
+        counter.count
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        # Text of every statement run, in order
+        self.statements = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._before_cursor_execute)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        event.remove(self.engine, "before_cursor_execute", self._before_cursor_execute)
+
+
+class SessionTracker:
+    """
+    Keeps track of every session that has a transaction (and so a pooled connection) open, for the session factories
+    it watches. A session counts as open from its first query until it commits, rolls back or closes
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # id(session) -> (weakref to the session, thread id, time.monotonic() it opened, (file, line, function) it
+        # was opened from)
+        self._open = {}
+        self.opened = 0
+
+    def watch(self, session_factory):
+        """:param session_factory: sessionmaker whose sessions should be tracked"""
+        event.listen(session_factory, "after_begin", self._after_begin)
+        event.listen(session_factory, "after_transaction_end", self._after_transaction_end)
+
+    def _after_begin(self, session, transaction, connection):
+        key = id(session)
+        with self._lock:
+            if key in self._open:
+                return
+            self._open[key] = (weakref.ref(session, lambda ref: self._forget(key, ref)),
+                               threading.get_ident(), time.monotonic(), _caller())
+            self.opened += 1
+
+    def _after_transaction_end(self, session, transaction):
+        # Savepoints end inside the outer transaction, only the outermost one frees the connection
+        if transaction.parent is None:
+            self._forget(id(session))
+
+    def _forget(self, key, ref=None):
+        with self._lock:
+            entry = self._open.get(key)
+            if entry and (ref is None or entry[0] is ref):
+                del self._open[key]
+
+    def open_count(self):
+        """Returns the number of sessions holding a connection right now"""
+        with self._lock:
+            return len(self._open)
+
+    def opened_since(self, start, thread_id):
+        """
+        :param start: time.monotonic() value
+        :param thread_id: threading.get_ident() of the thread that opened the sessions
+        :return: list of (seconds open, where it was opened) for sessions opened after start that are still open
+        """
+        now = time.monotonic()
+        with self._lock:
+            still_open = [(now - opened_at, caller) for ref, thread, opened_at, caller in self._open.values()
+                          if thread == thread_id and opened_at >= start]
+        # Only sessions that leaked get their caller turned into text
+        return [(seconds, "{}:{} in {}".format(*caller) if caller else "") for seconds, caller in still_open]
+
+
+def _caller():
+    """
+    Returns (file name, line number, function name) of the innermost frame outside SQLAlchemy and this module, which
+    is the code that used the session, or None. Runs on every session begin, so it only follows f_back and never
+    reads source lines like traceback.extract_stack() does
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if "sqlalchemy" not in filename and filename != _caller.__code__.co_filename:
+            return filename, frame.f_lineno, frame.f_code.co_name
+        frame = frame.f_back
+    return None
+
+
+# Shared by every session factory the bot uses, see unitOfWork.py
+session_tracker = SessionTracker()
@@ -3,19 +3,29 @@
 # Todo: Add "Admin" accounts and functionality. Create /admin command and require password, then mark user as admin
 # Allow admin accounts to do things like add drinks to table. Can make a prompt to add drinks and ingredients from phone?
 
+import inspect
 import logging
-import subprocess
-import os
-import time
+import secrets
+import signal
+import threading
 
 from telegram import ReplyKeyboardRemove
 from telegram.ext import Updater, CommandHandler, MessageHandler, CallbackQueryHandler, ConversationHandler, Filters
 
+import catalog
+import dbUpdater
 import drinksSqlDb
+import makeableCache
+import metrics
+import outbound
 import userSqlDb
 import searchDB
+import sqlMetrics
+import unitOfWork
 
-from readJSON import Secrets, Loggers
+from asyncRuntime import AsyncRuntime
+from readJSON import Secrets, Settings, Loggers
+from webhookServer import WebhookReceiver
 
 
 # set state paths to integer numbers starting at 0
@@ -24,22 +34,25 @@ USER_PERMISSION, ALLOW_TRACKING, USER_SETUP = range(3)  # Used for user /start c
 ADD, REMOVE = range(2)
 INV, ADD_INV, REM_INV = range(3)
 
+# Most drinks listed by the /almost command
+ALMOST_LIMIT = 25
+
 
 def start(bot, update):
     user = update.message.from_user
-    bot.send_message(chat_id=update.message.chat_id,
-                     text="Hello {}, let's get started\n"
-                          "You can type the command '/help' "
-                          "at any time to see a list of my commands.".format(user.first_name))
+    outbox.send(bot, update.message.chat_id,
+                "Hello {}, let's get started\n"
+                "You can type the command '/help' "
+                "at any time to see a list of my commands.".format(user.first_name))
     # help(bot, update)
     # Check to see if user is already in database
-    chk_usr, session = userSqlDb.check_for_user_id(user.id)
+    chk_usr, session = userSqlDb.check_for_user_id(user.id, unitOfWork.current().users)
     if not chk_usr:
-        bot.send_message(chat_id=update.message.chat_id,
-                         text="Now I'm going to ask for permission to track your data (Username, Telegram User ID).\n"
-                              "This data will be used to keep track of your inventory and a list of your favorite drinks,"
-                              "and it will be required to use some of my features.\n"
-                              "Please type 'Yes' to give permission or 'No' to refuse")
+        outbox.send(bot, update.message.chat_id,
+                    "Now I'm going to ask for permission to track your data (Username, Telegram User ID).\n"
+                    "This data will be used to keep track of your inventory and a list of your favorite drinks,"
+                    "and it will be required to use some of my features.\n"
+                    "Please type 'Yes' to give permission or 'No' to refuse")
         return USER_PERMISSION
     # If the user is already in the database, then end the conversation handler and don't send prompts
     else:
@@ -53,38 +66,39 @@ def setup_permission(bot, update):
     text = update.message.text
     user = update.message.from_user
     if "yes" in text.lower():
-        bot.send_message(chat_id=update.message.chat_id,
-                         text="Thanks! I will now begin storing your data. This will allow you to use the following commands:\n"
-                              "/inv to fill in your inventory, /fav to get the recipes for your favorite drinks, and "
-                              "/makeable to see a list of drinks that you can make with your current inventory")
+        outbox.send(bot, update.message.chat_id,
+                    "Thanks! I will now begin storing your data. This will allow you to use the following commands:\n"
+                    "/inv to fill in your inventory, /fav to get the recipes for your favorite drinks, and "
+                    "/makeable to see a list of drinks that you can make with your current inventory")
 
         store_user_data(bot, user, update.message.chat_id)
         return ConversationHandler.END
 
     # User refused tracking at this time
     elif "no" in text.lower():
-        bot.send_message(chat_id=update.message.chat_id,
-                         text="You have refused tracking. This will limit the commands that I am capable of using for you. "
-                              "If you decide to allow tracking, you can send the /start command and go through this process again.")
+        outbox.send(bot, update.message.chat_id,
+                    "You have refused tracking. This will limit the commands that I am capable of using for you. "
+                    "If you decide to allow tracking, you can send the /start command and go through this process again.")
         return ConversationHandler.END
 
     else:
-        bot.send_message(chat_id=update.message.chat_id, text="Please respond either Yes or No")
+        outbox.send(bot, update.message.chat_id, "Please respond either Yes or No")
         return USER_PERMISSION
 
 
 def store_user_data(bot, user, chat_id):
-    session = userSqlDb.add_user(user_id=user.id, first_name=user.first_name, last_name=user.last_name, chat_id=chat_id)
-    if userSqlDb.check_for_user_id(user.id):
+    new_user, session = userSqlDb.add_user(user_id=user.id, first_name=user.first_name, last_name=user.last_name,
+                                           chat_id=chat_id, session=unitOfWork.current().users)
+    if new_user:
         info_log.info("Added user to database."
                       "\nFirst Name: {}\nLast Name: {}\nUser ID: {}".format(user.first_name, user.last_name, user.id))
-        bot.send_message(chat_id=chat_id, text="Your username and ID have been added to the database")
+        outbox.send(bot, chat_id, "Your username and ID have been added to the database")
 
 
 def add_fav_command(bot, update):
-    bot.send_message(chat_id=update.message.chat_id,
-                     text="You have chosen to add a drink to your favorites list. "
-                          "Please respond with the drink you want to add or type 'exit' to quit")
+    outbox.send(bot, update.message.chat_id,
+                "You have chosen to add a drink to your favorites list. "
+                "Please respond with the drink you want to add or type 'exit' to quit")
     return ADD
 
 
@@ -95,25 +109,26 @@ def add_fav_drink(bot, update):
     :param update:
     :return:
     """
-    drnk_session = drinksSqlDb.get_drink_session()
+    drink_catalog = catalog.get_catalog()
     # If drink is exact match, adds drink and prompts to add another
     check_text = update.message.text
-    chat_user = update.message.from_user
 
-    # If LIKE search gives a match, add it to the database
-    drink_exists = drinksSqlDb.query_drink_first(check_text, drnk_session)[0] # Only take first return item
-    drink_contain = drinksSqlDb.query_drink_contains(check_text, drnk_session)[0]
+    # If the name matches exactly, add it to the database
+    drink_exists = drink_catalog.find_drink(check_text)
     if drink_exists:
-        user, usr_session = userSqlDb.check_for_user_id(chat_user.id)
+        user, usr_session = validate_user(bot, update)
+        if not user:
+            return ConversationHandler.END
         userSqlDb.set_user_favorite(user, drink_exists.drink_name, usr_session)
-        bot.send_message(chat_id=update.message.chat_id,
-                         text="Great! I've added {} to your favorites".format(drink_exists.drink_name))
-        # Close the session now that the drink has been added
-        drnk_session.close()
-        usr_session.close()
+        outbox.send(bot, update.message.chat_id,
+                    "Great! I've added {} to your favorites".format(drink_exists.drink_name))
         return ConversationHandler.END
-    # If the text isn't close enough for a LIKE search, try a contains search, and show results
-    elif drink_contain:
+
+    drink_contain = drink_catalog.drinks_containing(check_text)
+    # If the text isn't an exact match, try a contains search, then a fuzzy search for typos
+    if not drink_contain:
+        drink_contain = [drink for drink, score in drink_catalog.similar_drinks(check_text)]
+    if drink_contain:
         suggestions = []
         # Extract drink name from list and output through bot message
         for drink in drink_contain:
@@ -122,19 +137,18 @@ def add_fav_drink(bot, update):
         message = "Did you mean to send one of these drinks?:\n{}" \
                   "\nIf so, please send the drink name again, or type 'exit' to leave".format(
             "\n".join(suggestions).title())
-        bot.send_message(chat_id=update.message.chat_id, text=message)
+        outbox.send(bot, update.message.chat_id, message)
 
         return ADD
     else:
-        bot.send_message(chat_id=update.message.chat_id, text="Sorry, I was unable to find a drink that matched")
-        drnk_session.close()
+        outbox.send(bot, update.message.chat_id, "Sorry, I was unable to find a drink that matched")
         return ConversationHandler.END
 
 def rem_fav_command(bot, update):
-    bot.send_message(chat_id=update.message.chat_id,
-                     text="You have chosen to remove a drink to your favorites list. "
-                          "Please respond to this message with the name of the drink you'd like to remove, "
-                          "or send 'exit' to stop")
+    outbox.send(bot, update.message.chat_id,
+                "You have chosen to remove a drink to your favorites list. "
+                "Please respond to this message with the name of the drink you'd like to remove, "
+                "or send 'exit' to stop")
 
     return REMOVE
 
@@ -146,42 +160,45 @@ def rem_fav_drinks(bot, update):
         return ConversationHandler.END
     try:
         userSqlDb.rem_user_favorites(user, usr_sess, drink_name)
-        bot.send_message(chat_id = chat_id, text = "Removed {} from your favorites".format(drink_name.title()))
+        outbox.send(bot, chat_id, "Removed {} from your favorites".format(drink_name.title()))
     except ValueError as e:
-        bot.send_message(chat_id = chat_id,
-                         text = "{} is not in your favorites list. "
-                                "Please send another drink name or type 'exit' to stop".format(drink_name.title()))
+        outbox.send(bot, chat_id,
+                    "{} is not in your favorites list. "
+                    "Please send another drink name or type 'exit' to stop".format(drink_name.title()))
         return REMOVE
 
     return ConversationHandler.END
 
 
 def validate_user(bot, update):
-    try:
-        user, session = userSqlDb.check_for_user_id(update.message.from_user.id)
-        return user, session
-    except TypeError as e:
-        # Will receive TypeError if the check_for_user_id fails to return a user, NoneType not iterable
+    """
+    Looks up the sender in user.db with the update's user session. The UnitOfWork closes the session, so handlers
+    never have to
+    :return: tuple of (User, session), or ("", "") after telling the sender they need to /start first
+    """
+    user, session = userSqlDb.check_for_user_id(update.message.from_user.id, unitOfWork.current().users)
+    if not user:
         warn_log.warning("User is not in the user database, needs to be added to use this functionality")
         user_not_added(bot, update)
         return "", ""
+    return user, session
 
 
 def user_not_added(bot, update):
-    bot.send_message(chat_id=update.message.chat_id,
-                     text="You have not been added to the user database, so this command is currently unavailable."
-                          "\nIf you want to use this function, please send the '/start' command and allow "
-                          "tracking your user info.")
+    outbox.send(bot, update.message.chat_id,
+                "You have not been added to the user database, so this command is currently unavailable."
+                "\nIf you want to use this function, please send the '/start' command and allow "
+                "tracking your user info.")
 
 
 def manage_inv(bot, update):
     """Entry point to conversation handler to manage inventory. Prompts user to send 'add', 'remove', or 'list' """
-    bot.send_message(chat_id=update.message.chat_id,
-                     text="You've chosen to manage your inventory. Please respond with one of the following options:"
-                          "\n'add' - Add items to your inventory"
-                          "\n'rem' - Remove items from your inventory"
-                          "\n'list' - See a list of items currently in your inventory"
-                          "\n'exit' - Exit this prompt")
+    outbox.send(bot, update.message.chat_id,
+                "You've chosen to manage your inventory. Please respond with one of the following options:"
+                "\n'add' - Add items to your inventory"
+                "\n'rem' - Remove items from your inventory"
+                "\n'list' - See a list of items currently in your inventory"
+                "\n'exit' - Exit this prompt")
     return INV
 
 
@@ -193,27 +210,23 @@ def add_user_inv(bot, update):
         return ConversationHandler.END
 
     msg_txt = update.message.text
-    drnk_session = drinksSqlDb.get_drink_session()
+    drink_catalog = catalog.get_catalog()
     # if the message simply says 'add', then send the inital bot message prompting them for the ingredient
     if msg_txt.lower() == "add" or msg_txt.lower() == "/addinv":
-        bot.send_message(chat_id=update.message.chat_id,
-                         text="You've chosen to add to your inventory. Please respond with the item you want to add."
-                              " When you are finished, respond 'exit' to exit.")
+        outbox.send(bot, update.message.chat_id,
+                    "You've chosen to add to your inventory. Please respond with the item you want to add."
+                    " When you are finished, respond 'exit' to exit.")
         return ADD_INV
     # if message text doesn't just say 'add', then try adding the ingredients that the user sent
     else:
         # sanitize the input, then add it to the inventory if it matches
-        check_ing = drinksSqlDb.verify_ing_for_inv(msg_txt, drnk_session)
+        check_ing = drink_catalog.verify_ing_for_inv(msg_txt)
 
         # if check_ing is empty sting, then the user input doesn't match an ingredient.
         # next test is to see if it's similar to anything and display that to the user
         if not check_ing:
             # similar_ing will hold the ingredient names to send the user as suggestions
-            similar_ing = []
-            for ingredient in drinksSqlDb.ing_contains_all(msg_txt, drnk_session):
-                similar_ing.append(ingredient.ing.title())
-            for simple in drinksSqlDb.simple_contains_all(msg_txt, drnk_session):
-                similar_ing.append(simple.ing.title())
+            similar_ing = searchDB.ingredient_suggestions(msg_txt, unitOfWork.current().drinks, drink_catalog)
             # If similar ingredients were found, send a list of them to user
             if similar_ing:
                 bot_text = "No ingredient uses that name. Did you mean one of the following?\n" \
@@ -221,17 +234,16 @@ def add_user_inv(bot, update):
             # If none, found, prompt user to try again or type exit to leave the interaction
             else:
                 bot_text = "Sorry, couldn't find any ingredients with similar names. Please try again or type exit to leave"
-            bot.send_message(chat_id=update.message.chat_id,
-                             text=bot_text)
+            outbox.send(bot, update.message.chat_id, bot_text)
             return ADD_INV
 
         # if check_ing does exist, it means there was a direct match. Add this to inventory and tell user
         elif check_ing:
             userSqlDb.add_inventory(user, check_ing, usr_sess)
-            bot.send_message(chat_id=update.message.chat_id,
-                             text="Added {} to your inventory\n"
-                                  "Continue sending inventory items to add, "
-                                  "or type 'exit' to stop".format(check_ing.title()))
+            outbox.send(bot, update.message.chat_id,
+                        "Added {} to your inventory\n"
+                        "Continue sending inventory items to add, "
+                        "or type 'exit' to stop".format(check_ing.title()))
             return ADD_INV
 
 
@@ -244,29 +256,28 @@ def rem_user_inv(bot, update):
         return ConversationHandler.END
 
     msg_txt = update.message.text
-    drnk_session = drinksSqlDb.get_drink_session()
     # if the message simply says 'rem', then send the inital bot message prompting them for the ingredient
     if msg_txt.lower() == "rem" or msg_txt.lower() == "/reminv":
         # Send user's current inventory through the bots
-        bot.send_message(chat_id = chat_id, text = list_user_inv(user))
+        outbox.send(bot, chat_id, list_user_inv(user))
 
         # Initial prompt telling user to type the name of the item they want to remove
-        bot.send_message(chat_id= chat_id, text="You've chosen to remove from  your inventory. "
-                              "Please respond with the item you want to remove."
-                              " When you are finished, respond 'exit' to exit.")
+        outbox.send(bot, chat_id,
+                    "You've chosen to remove from  your inventory. "
+                    "Please respond with the item you want to remove."
+                    " When you are finished, respond 'exit' to exit.")
         return REM_INV
 
     else:
         try:
             userSqlDb.rem_inventory(user, usr_sess,msg_txt)
-            bot.send_message(chat_id=chat_id,
-                            text="Removing {} from inventory.".format(msg_txt.title()))
+            outbox.send(bot, chat_id, "Removing {} from inventory.".format(msg_txt.title()))
         except ValueError as e:
             warn_log.warning("{} is not in inventory, and can't be removed".format(msg_txt.title()))
-            bot.send_message(chat_id = chat_id, text = "{} is not in your inventory".format(msg_txt.title()))
+            outbox.send(bot, chat_id, "{} is not in your inventory".format(msg_txt.title()))
         finally:
-            bot.send_message(chat_id = chat_id,
-                             text = "Type another item to remove from your inventory. \n{}".format(list_user_inv(user)))
+            outbox.send(bot, chat_id,
+                        "Type another item to remove from your inventory. \n{}".format(list_user_inv(user)))
 
             return REM_INV
 
@@ -281,7 +292,7 @@ def list_inv_command(bot, update):
 
     # Call method to receive list of strings representing user's inventory
     bot_text = list_user_inv(user)
-    bot.send_message(chat_id=update.message.chat_id, text=bot_text)
+    outbox.send(bot, update.message.chat_id, bot_text)
 
     # Testing this blank return statement to see if it exists the conversation handler
     return ConversationHandler.END
@@ -304,18 +315,17 @@ def favorite_recipes(bot, update):
     if not user:
         return ConversationHandler.END
 
-    user_favs = userSqlDb.get_user_favorites(user)
+    # One query against user.db with drinks.db attached returns every favorite with its ingredients
+    fav_recipes = userSqlDb.get_favorite_recipes(user.user_id, usr_session)
     # If user has not added any favorite drinks, return "No favorites found"
-    if not user_favs:
-        bot.send_message(chat_id=update.message.chat_id,
-                         text="You haven't added any favorites yet. try typing /addfav to get started")
-        usr_session.close()
+    if not fav_recipes:
+        outbox.send(bot, update.message.chat_id,
+                    "You haven't added any favorites yet. try typing /addfav to get started")
         return ConversationHandler.END
-    for fav in user_favs:
-        # for each drink name in favorites, find the drink in the drinks database, then print the output
-        recipe, drink_session = drinksSqlDb.query_drink_first(fav.favorites)
-        bot_text = searchDB.recipe_string(recipe, drink_session)
-        bot.send_message(chat_id=update.message.chat_id, text=bot_text)
+    drink_catalog = catalog.get_catalog()
+    recipe_texts = [searchDB.recipe_message(recipe, drink_catalog) for recipe in fav_recipes]
+    # The outbox packs the recipes into as few messages as fit
+    outbox.send(bot, update.message.chat_id, recipe_texts)
     return ConversationHandler.END
 
 
@@ -326,65 +336,54 @@ def makeable(bot, update):
     # This will throw a TypeError if the user isn't added to the database first
     makeable_drink_set = makeable_from_inv(user, usr_sess)
     bot_text = "With your current inventory you can make {} drinks:\n".format(len(makeable_drink_set))
-    bot_text += "\n".join(makeable_drink_set)
+    bot_text += "\n".join(sorted(makeable_drink_set))
     info_log.debug("Bot message as follows: \n{}".format(bot_text))
-    bot.send_message(chat_id=update.message.chat_id, text=bot_text)
+    # Long lists are split into several messages by the outbox
+    outbox.send(bot, update.message.chat_id, bot_text)
 
 
 def makeable_from_inv(user, usr_sess):
-    # Create an empty set that will hold all drink possibilities
-    # Initialize empty sets.
-    drink_set = set()  # holds all drinks that use an ingredient from inventory
-    simple_inventory = set()  # holds simplified inventory names
-
-    # Create a set of simplified ingredients (Strings in uppercase)
-    drink_sess = drinksSqlDb.get_drink_session()
-    for item in user.stock:
-        # ingredient_found is an Ingredient object associated with the user's inventory
-        ingredient_found = drinksSqlDb.ing_contains_first(item.stock, drink_sess)
-        # simple inventory simplifies this ingredient name for better searching
-        simple_inventory.add(drinksSqlDb.simplify_ingredient(ingredient_found, drink_sess))
-
-    # for each ingredient in inventory list, check what drinks can be
-    for inv in simple_inventory:
-        # call ing_search() to get every drink the ingredient shows up in
-        # call set.update() on this to add distinct values
-        drink_set.update(searchDB.ing_search(inv))
-
-    # Return the set of Drink objects that can be made
-    return compare_vs_inventory(drink_set, simple_inventory)
-
-
-def compare_vs_inventory(drink_set, simple_inventory):
     """
-    :param drink_set: a Set that contains names of drinks (not set of drink objects)
-    :param simple_inventory: a Set that contains simplified inventory names
-    :return: set of drink names (Strings)
+    :param user: User object whose inventory is checked
+    :param usr_sess: the user.db Session() that user was loaded with
+    :return: set of drink names (Strings) that can be made from the user's inventory
     """
-    # Subset approach won't work because inventory list is not exactly.
-    # created a simplify table, associates to Ingredient objects. if given drink objects in set, I can replace ingredients
-    # with their simple counterparts. This still might be slower than the simple nested for compare, since I'm having to
-    # nest loops in order to make these replacements
-
-    # Holds drinks that can be made
-    final_drink_set = set()
-
-    for current_drink in drink_set:
-        # Initialize empty drink set for each drink that goes through this loop
-        drink_ing_set = set()
-        drink, drnk_session = drinksSqlDb.query_drink_first(current_drink)
-
-        # Simplify the ingredients in the drink
-        for ingredient in drink.ingredients:
-            # Populate a set with the names of each ingredient (uppercase)
-            drink_ing_set.add(drinksSqlDb.simplify_ingredient(ingredient, drnk_session))
-
-        if drink_ing_set.issubset(simple_inventory):
-            final_drink_set.add(drink.drink_name)
+    # The store keeps each user's set up to date as their inventory changes, so this is normally just a lookup
+    final_drink_set = makeableCache.store.get(user)
     info_log.debug("Found {} makeable drinks: {}".format(len(final_drink_set), final_drink_set))
     return final_drink_set
 
 
+def almost(bot, update, args):
+    """Lists drinks that are missing only a few ingredients from the user's inventory. Takes an optional number
+    of missing ingredients to allow (default 1)"""
+    user, usr_sess = validate_user(bot, update)
+    if not user:
+        return ConversationHandler.END
+
+    max_missing = 1
+    if args:
+        try:
+            max_missing = max(int(args[0]), 1)
+        except ValueError:
+            outbox.send(bot, update.message.chat_id,
+                        "Send a number after /almost to allow more missing ingredients, eg. /almost 2")
+            return ConversationHandler.END
+
+    drink_catalog = catalog.get_catalog()
+    inventory_mask = drink_catalog.inventory_mask(item.stock for item in user.stock)
+    near_drinks = drink_catalog.near_makeable(inventory_mask, max_missing, ALMOST_LIMIT)
+
+    if not near_drinks:
+        bot_text = "There aren't any drinks missing {} or fewer ingredients from your inventory".format(max_missing)
+    else:
+        bot_text = "These drinks are missing at most {} ingredient(s) from your inventory:\n".format(max_missing)
+        bot_text += "\n".join("{} (missing {})".format(name, ", ".join(missing).title())
+                              for name, missing in near_drinks)
+    info_log.debug("Bot message as follows: \n{}".format(bot_text))
+    outbox.send(bot, update.message.chat_id, bot_text)
+
+
 # use this to call drink_search with the arguments that are passed
 def drinks(bot, update, args):
     # If user sent drink names, return drinks. Else, set drink_search to True
@@ -392,8 +391,9 @@ def drinks(bot, update, args):
         recipe_return(bot, update, args)
         return ConversationHandler.END
     else:
-        bot.send_message(chat_id=update.message.chat_id,
-                         text='Send up to four drink names (one word each), or send "Exit" to cancel')
+        outbox.send(bot, update.message.chat_id,
+                    'Send the drink names you want recipes for. Separate full names with commas or new lines, '
+                    'or send "Exit" to cancel')
         return RECIPE
 
 
@@ -403,84 +403,145 @@ def recipe_return(bot, update, args=""):
         find_recipes(bot, update, args)
     # If drinks are given in a separate message, split that message's contents and do the same action
     else:
-        drinks_list = update.message.text.split(' ')
+        drinks_list = searchDB.split_search_terms(update.message.text)
         find_recipes(bot, update, drinks_list)
     # End conversation handler after returning recipes
     return ConversationHandler.END
 
 
 def find_recipes(bot, update, drinks_list):
-    recipes, session = searchDB.drink_search(drinks_list)
+    drink_catalog = catalog.get_catalog()
+    recipes = searchDB.drink_search(drinks_list, settings.search_result_limit, drink_catalog,
+                                    unitOfWork.current().drinks)
     # If recipes is empty list, then send "No Recipes Found" message
     if not recipes:
-        bot.send_message(chat_id=update.message.chat_id, text='Sorry, no recipes found for that name')
+        outbox.send(bot, update.message.chat_id, 'Sorry, no recipes found for that name')
     else:
-        for recipe in recipes:
-            botString = searchDB.recipe_string(recipe, session)  # offset of zero for drinks call
-            bot.send_message(chat_id=update.message.chat_id, text=botString)
+        outbox.send(bot, update.message.chat_id,
+                    [searchDB.recipe_message(recipe, drink_catalog) for recipe in recipes])
 
 
 def ing(bot, update, args):
     ing_name = ' '.join(args)
-    bot.send_message(chat_id=update.message.chat_id, text="Searching for drinks that use {}".format(ing_name))
-    drink_list = searchDB.ing_search(ing_name)
-    bot.send_message(chat_id=update.message.chat_id, text='\n'.join(drink_list))
+    drink_list = searchDB.ing_search(ing_name, unitOfWork.current().drinks)
+    blocks = ["Searching for drinks that use {}".format(ing_name)]
+    if drink_list:
+        blocks.append('\n'.join(drink_list))
+    outbox.send(bot, update.message.chat_id, blocks)
 
 
 def help(bot, update):
-    bot.send_message(chat_id=update.message.chat_id,
-                     text="Here are the available commands:"
-                          "\n/drinks - send a drink name and get recipe"
-                          "\n/ing - Returns list of drinks that use an ingredient"
-                          "\n*/inv - Manage your drink inventory*"
-                          "\n*/makeable - Show which drinks you can make with your inventory ingredients*"
-                          "\n*/fav - Manage your favorite drinks, and get recipes for those you make most often"
-                          "\n\n* Commands with an asterisk are only accessible if you have allowed your user data "
-                          "to be tracked. If you want to allow this, send the command '/start' and "
-                          "allow tracking.")
+    outbox.send(bot, update.message.chat_id,
+                "Here are the available commands:"
+                "\n/drinks - send a drink name and get recipe"
+                "\n/ing - Returns list of drinks that use an ingredient"
+                "\n*/inv - Manage your drink inventory*"
+                "\n*/makeable - Show which drinks you can make with your inventory ingredients*"
+                "\n*/almost - Show drinks that are only missing one ingredient (or send a number, eg. /almost 2)*"
+                "\n*/fav - Manage your favorite drinks, and get recipes for those you make most often"
+                "\n\n* Commands with an asterisk are only accessible if you have allowed your user data "
+                "to be tracked. If you want to allow this, send the command '/start' and "
+                "allow tracking.")
 
 def update_db(bot, update):
     # Send message about trying to update database
-    bot.send_message(chat_id = update.message.chat_id, text = "Attempting to update database")
-    # Get current time to compare to database's modified time
-    start_time = time.time()
-
-    db_path = os.path.join(os.path.dirname(__file__), "drinks.db")
+    outbox.send(bot, update.message.chat_id, "Attempting to update database")
 
-    # Run the bash script to update the database
-    script_path = os.path.join(os.path.dirname(__file__), "update_db.sh")
-    subprocess.call(script_path, shell=True)
-
-    # Wait two seconds to allow the download
-    time.sleep(2)
-
-    # get the modification time of drinks.db
-    try:
-        db_mod = os.path.getmtime(db_path)
-
-        # Check if the file was modified
-        if db_mod > start_time:
-            bot.send_message(chat_id = update.message.chat_id, text = "Succesffuly updated database")
-        else:
-            bot.send_message(chat_id = update.message.chat_id, text = "Could not update database")
-    except OSError as e:
-        bot.send_message(chat_id = update.message.chat_id, text = "Drinks.db was not found. Check the filepath in the code")
-        warn_log.error("Found OSError in update_db: {}".format(e))
+    # Download to a temp file, check it, then swap it in. Requests already running finish on the old database
+    new_catalog, bot_text = dbUpdater.update_drinks_db()
+    if new_catalog:
+        # Swapping in the new catalog retires every cached recipe message
+        searchDB.recipe_cache.warm(new_catalog)
+    outbox.send(bot, update.message.chat_id, bot_text)
 
 def exit_list(bot, update):
-    update.message.reply_text('Bye!', reply_markup=ReplyKeyboardRemove())
+    outbox.send(bot, update.message.chat_id, 'Bye!', reply_markup=ReplyKeyboardRemove())
     return ConversationHandler.END
 
 
 def kill(bot, update, args):
     info_log.info('Process stopped')
-    updater.stop()
+    # Stopping the dispatcher from one of its own handlers would wait on itself forever, so the main thread does it
+    request_stop()
+
+
+def stats(bot, update):
+    """Admin only: sends per-handler latencies, send latency and queue depths"""
+    user = update.message.from_user
+    if user.id not in settings.admin_ids:
+        warn_log.warning("User {} tried to use /stats without being an admin".format(user.id))
+        return
+    outbox.send(bot, update.message.chat_id, metrics.registry.summary())
+
+
+def register_gauges(updater):
+    """Registers the gauges read each time metrics are collected"""
+    metrics.registry.gauge(metrics.UPDATE_QUEUE_DEPTH, "Updates waiting for the dispatcher",
+                           updater.update_queue.qsize)
+    # outbox is only set up in __main__, so look it up when the gauge is read
+    metrics.registry.gauge(metrics.OUTBOX_DEPTH, "Messages waiting in the outbox", lambda: outbox.depth())
+    metrics.registry.gauge(metrics.OPEN_SESSIONS, "Database sessions holding a connection",
+                           sqlMetrics.session_tracker.open_count)
+
+
+def wrap_handlers(dispatcher, wrap):
+    """
+    Replaces the callback of every registered handler, including ConversationHandler entry points, states and
+    fallbacks, with wrap(callback, in_conversation)
+    :param dispatcher: Dispatcher that create_handlers() filled in
+    :param wrap: function taking (callback, in_conversation) and returning the new callback. in_conversation is True
+    when the callback's return value is a conversation state
+    """
+    for group in dispatcher.handlers.values():
+        for handler in group:
+            if isinstance(handler, ConversationHandler):
+                inner_handlers = list(handler.entry_points) + list(handler.fallbacks)
+                for state_handlers in handler.states.values():
+                    inner_handlers.extend(state_handlers)
+                for inner in inner_handlers:
+                    inner.callback = wrap(inner.callback, True)
+            else:
+                handler.callback = wrap(handler.callback, False)
+
+
+def _always(state):
+    return lambda update, args=None: state
 
 
-def create_handlers(updater, dispatcher):
+# Conversation callbacks whose next state doesn't depend on what they find in the databases. In asyncio mode the
+# dispatcher thread gets these states straight away instead of waiting for the handler to finish
+KNOWN_STATES = {
+    drinks: lambda update, args=None: ConversationHandler.END if args else RECIPE,
+    recipe_return: _always(ConversationHandler.END),
+    exit_list: _always(ConversationHandler.END),
+    add_fav_command: _always(ADD),
+    rem_fav_command: _always(REMOVE),
+    manage_inv: _always(INV),
+    list_inv_command: _always(ConversationHandler.END),
+    favorite_recipes: _always(ConversationHandler.END),
+}
+
+
+def run_on(runtime):
+    """Returns a wrap_handlers() function that turns every handler into a coroutine on an AsyncRuntime"""
+    def wrap(callback, in_conversation):
+        # /kill only wakes the main thread up, so it doesn't need to queue behind other handlers
+        handler = inspect.unwrap(callback)
+        if handler is kill:
+            return callback
+        coroutine = runtime.offload(callback, slow=handler is update_db)
+        return runtime.callback(coroutine, wait=in_conversation,
+                                next_state=KNOWN_STATES.get(handler) if in_conversation else None)
+    return wrap
+
+
+def create_handlers(updater, dispatcher, runtime=None):
+    """
+    Registers every command and conversation
+    :param runtime: AsyncRuntime to run handlers on, if not given they run on the dispatcher thread
+    """
     help_handler = CommandHandler('help', help)
     dispatcher.add_handler(help_handler)
-    updater.start_polling()
 
     update_handler = CommandHandler('update', update_db)
     dispatcher.add_handler(update_handler)
@@ -494,6 +555,12 @@ def create_handlers(updater, dispatcher):
     makeable_handler = CommandHandler('makeable', makeable)
     dispatcher.add_handler(makeable_handler)
 
+    almost_handler = CommandHandler('almost', almost, pass_args=True)
+    dispatcher.add_handler(almost_handler)
+
+    stats_handler = CommandHandler('stats', stats)
+    dispatcher.add_handler(stats_handler)
+
     # Begin conversation with start command to introduce new user to bot functionality
     start_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start)],
@@ -554,6 +621,89 @@ def create_handlers(updater, dispatcher):
         fallbacks=[MessageHandler(filters=Filters.regex("[eE]xit"), callback=exit_list)])
     dispatcher.add_handler(inv_handler)
 
+    # Every update gets its own database sessions, closed when the handler returns
+    wrap_handlers(dispatcher, lambda callback, in_conversation: unitOfWork.per_update(callback))
+    # Timed outside the unit of work, so closing its sessions counts towards the handler
+    wrap_handlers(dispatcher, metrics.timed_handler)
+    # Every reply ends up in bot.send_message, whether the outbox or the asyncio runtime's send pool sends it
+    updater.bot.send_message = metrics.timed_send(updater.bot.send_message)
+    register_gauges(updater)
+    if runtime:
+        wrap_handlers(dispatcher, run_on(runtime))
+
+
+def start_updates(updater, dispatcher, secret_token=""):
+    """
+    Starts receiving updates the way settings.update_mode asks for
+    :param secret_token: webhook secret, a random one is made if not given
+    :return: the WebhookReceiver in webhook mode, otherwise None
+    """
+    if settings.update_mode != "webhook":
+        # start_polling() removes any webhook that is still registered
+        updater.start_polling()
+        return None
+
+    if not settings.webhook_url:
+        # setWebhook with an empty URL would remove the webhook instead
+        raise ValueError("webhook_url must be set in settings.json to use webhook mode")
+    receiver = WebhookReceiver(updater.bot, updater.update_queue, secret_token or secrets.token_urlsafe(32),
+                               settings.webhook_listen, settings.webhook_port, settings.webhook_path)
+    receiver.start()
+    # Updater.start_webhook() can't check Telegram's secret token header, so the dispatcher is run directly with its
+    # public start() and stopped by stop_updates()
+    threading.Thread(target=dispatcher.start, name="dispatcher").start()
+    updater.bot.set_webhook(url=settings.webhook_url, secret_token=receiver.secret_token)
+    info_log.info("Webhook registered for {}".format(settings.webhook_url))
+    return receiver
+
+
+def stop_updates(updater, dispatcher, receiver=None):
+    """
+    Stops whatever start_updates() started
+    :param receiver: the WebhookReceiver start_updates() returned, if any
+    """
+    if receiver:
+        receiver.stop()
+        dispatcher.stop()
+    else:
+        updater.stop()
+
+
+# Set by /kill or a stop signal. The main thread waits for it in wait_for_stop() and then calls shutdown()
+stop_requested = threading.Event()
+
+
+def request_stop(signum=None, frame=None):
+    """Asks the main thread to shut the bot down. Also the handler for stop signals"""
+    if signum is not None:
+        info_log.info("Received signal {}, stopping".format(signum))
+    stop_requested.set()
+
+
+def wait_for_stop(stop_signals=(signal.SIGINT, signal.SIGTERM, signal.SIGABRT)):
+    """
+    Blocks until a stop signal arrives or /kill is used. Used instead of Updater.idle(), which exits the process on
+    the spot in webhook mode because the Updater itself never started there. Must be called from the main thread
+    """
+    for signum in stop_signals:
+        signal.signal(signum, request_stop)
+    # Waking up every second lets the signal handlers run even if the wait can't be interrupted
+    while not stop_requested.wait(1):
+        pass
+
+
+def shutdown(updater, dispatcher, receiver=None, runtime=None, metrics_server=None):
+    """
+    Stops taking updates, lets running handlers finish and sends every queued reply, then stops the metrics server
+    :param receiver: the WebhookReceiver start_updates() returned, if any
+    """
+    stop_updates(updater, dispatcher, receiver)
+    if runtime:
+        runtime.stop()
+    outbox.stop()
+    if metrics_server:
+        metrics_server.stop()
+
 
 if __name__ == '__main__':
     # Setup specific loggers from config.json
@@ -574,17 +724,47 @@ if __name__ == '__main__':
     # info_log.setLevel(logging.DEBUG)
 
     auth = Secrets()
+    settings = Settings()
+    # Replies with several recipes or long lists go through here to stay under Telegram's limits
+    outbox = outbound.Outbox(settings.send_global_rate, settings.send_chat_rate, settings.send_chat_burst,
+                             settings.send_threads)
     # Bottender Token
     token = auth.bottender_token
 
     # Debugbot Token
     # token = auth.debug_token
 
+    # Older copies of drinks.db don't have the key columns or full text search tables yet
+    dbUpdater.upgrade_drinks_db(drinksSqlDb.DB_PATH)
+    # Load the recipe catalog once up front so the first request doesn't pay for it
+    searchDB.recipe_cache.warm(catalog.reload_catalog())
+
     updater = Updater(token=token)  # pass bot api token
     dispatcher = updater.dispatcher
 
+    # In asyncio mode handlers run as coroutines, with database work and sends on bounded thread pools
+    runtime = None
+    if settings.runtime_mode == "asyncio":
+        runtime = AsyncRuntime(db_workers=settings.db_workers, send_workers=settings.send_workers)
+        runtime.start()
+
     # This method creates and adds all handlers for the bot
-    create_handlers(updater, dispatcher)
+    create_handlers(updater, dispatcher, runtime)
+
+    # Prometheus can scrape handler latencies and queue depths from here, /stats shows the same in a chat.
+    # Started before updates arrive, and a port that's already taken only costs the endpoint, not the bot
+    metrics_server = None
+    if settings.metrics_port is not None:
+        try:
+            metrics_server = metrics.MetricsServer(settings.metrics_listen, settings.metrics_port)
+            metrics_server.start()
+        except OSError as e:
+            warn_log.error("Could not serve metrics on {}:{}: {}".format(settings.metrics_listen,
+                                                                         settings.metrics_port, e))
+            metrics_server = None
+
+    receiver = start_updates(updater, dispatcher, auth.webhook_secret)
 
-    updater.idle()
+    wait_for_stop()
     print('Idle Signal Received')
+    shutdown(updater, dispatcher, receiver, runtime, metrics_server)
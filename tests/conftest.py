@@ -0,0 +1,15 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+# The bot's modules live at the top of the repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# drinksSqlDb and userSqlDb create their databases on import, so point them at scratch files
+# instead of the drinks.db and user.db next to the code
+_scratch = tempfile.mkdtemp(prefix="cocktail-tests-")
+atexit.register(shutil.rmtree, _scratch, ignore_errors=True)
+os.environ.setdefault("COCKTAIL_DRINKS_DB", os.path.join(_scratch, "drinks.db"))
+os.environ.setdefault("COCKTAIL_USER_DB", os.path.join(_scratch, "user.db"))
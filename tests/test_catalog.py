@@ -0,0 +1,69 @@
+from collections import OrderedDict
+
+from catalog import Catalog, Recipe, RecipeIngredient
+
+
+def _catalog(*names):
+    recipes = OrderedDict((name, Recipe(name, "1", [RecipeIngredient(1, "RYE", 2.0, "oz.", 1, "rye", 2.0)], []))
+                          for name in names)
+    return Catalog(recipes, [], [], 1)
+
+
+def test_find_drink_ignores_case_and_extra_whitespace():
+    catalog = _catalog("OLD FASHIONED", "GIMLET")
+    assert catalog.find_drink("  old   fashioned ").drink_name == "OLD FASHIONED"
+    assert catalog.find_drink("Gimlet").drink_name == "GIMLET"
+    assert catalog.find_drink("old fashioneds") is None
+
+
+def test_substring_searches_ignore_extra_whitespace():
+    catalog = _catalog("OLD FASHIONED", "OLD PAL", "GIMLET")
+    assert [recipe.drink_name for recipe in catalog.drinks_containing("old  f")] == ["OLD FASHIONED"]
+    assert [recipe.drink_name for recipe in catalog.search_drinks(["Old   Pal", " "])] == ["OLD PAL"]
+
+
+def test_ingredient_search_ignores_extra_whitespace():
+    ingredients = [RecipeIngredient(1, "LEMON  JUICE", 1.0, "oz.", 1, None, 1.0),
+                   RecipeIngredient(2, "LIME JUICE", 1.0, "oz.", 1, None, 1.0)]
+    catalog = Catalog(OrderedDict(), ingredients, [], 1)
+    assert [ingredient.ing_id for ingredient in catalog.ingredients_containing(" lemon juice")] == [1]
+    assert [ingredient.ing_id for ingredient in catalog.ingredients_containing("Juice")] == [1, 2]
+
+
+def test_near_makeable_ranks_by_missing_count_then_popularity():
+    gin, lemon, syrup, campari, vermouth, bitters = ingredients = [
+        RecipeIngredient(ing_id, name, 1.0, "oz.", popularity, None, 1.0)
+        for ing_id, name, popularity in ((1, "GIN", 10), (2, "LEMON", 1), (3, "SYRUP", 2), (4, "CAMPARI", 5),
+                                         (5, "VERMOUTH", 5), (6, "BITTERS", 3))]
+    recipes = OrderedDict((name, Recipe(name, "1", parts, [])) for name, parts in (
+        ("GIN SOUR", (gin, lemon, syrup)),
+        ("NEGRONI", (gin, campari, vermouth)),
+        ("AMERICANO", (campari, vermouth)),
+        ("PINK GIN", (gin, bitters)),
+        ("BOULEVARDIER", (campari, vermouth, bitters)),
+        ("GIN NEAT", (gin,)),
+    ))
+    catalog = Catalog(recipes, ingredients, [], 1)
+    inventory = catalog.inventory_mask(["gin"])
+
+    # GIN NEAT is makeable, so it isn't near makeable. NEGRONI and AMERICANO tie on count and popularity (10),
+    # which leaves them in name order, ahead of GIN SOUR's less popular missing ingredients (3)
+    assert catalog.near_makeable(inventory, max_missing=2) == [
+        ("PINK GIN", ["BITTERS"]),
+        ("AMERICANO", ["CAMPARI", "VERMOUTH"]),
+        ("NEGRONI", ["CAMPARI", "VERMOUTH"]),
+        ("GIN SOUR", ["LEMON", "SYRUP"]),
+    ]
+    assert [name for name, missing in catalog.near_makeable(inventory, max_missing=3, limit=5)] == [
+        "PINK GIN", "AMERICANO", "NEGRONI", "GIN SOUR", "BOULEVARDIER"]
+    assert catalog.near_makeable(inventory, max_missing=1) == [("PINK GIN", ["BITTERS"])]
+
+
+def test_popularity_counts_once_per_ingredient():
+    # GIN's popularity already covers every drink using it, so three drinks needing it don't triple it
+    gin = RecipeIngredient(1, "GIN", 1.0, "oz.", 3, None, 1.0)
+    rum = RecipeIngredient(2, "RUM", 1.0, "oz.", 4, None, 1.0)
+    recipes = OrderedDict([("GIN {}".format(number), Recipe("GIN {}".format(number), "1", (gin,), []))
+                           for number in range(3)] + [("DAIQUIRI", Recipe("DAIQUIRI", "1", (rum,), []))])
+    catalog = Catalog(recipes, [gin, rum], [], 1)
+    assert catalog.near_makeable(0)[0] == ("DAIQUIRI", ["RUM"])
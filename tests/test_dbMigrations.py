@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+
+from sqlalchemy import create_engine, text
+
+import dbMigrations
+
+
+def _index_names(engine, table):
+    with engine.connect() as connection:
+        return {row[0] for row in connection.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"), {"table": table})}
+
+
+def test_user_association_tables_get_user_indexes(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "user.db"))
+    with engine.begin() as connection:
+        # Schema of a user.db made before the indexes existed
+        connection.execute(text("CREATE TABLE favorites (favorites VARCHAR PRIMARY KEY, popularity INTEGER)"))
+        connection.execute(text("CREATE TABLE inv (stock VARCHAR PRIMARY KEY)"))
+        connection.execute(text("CREATE TABLE fav_asso (User_user_id INTEGER, Favorite_drink VARCHAR)"))
+        connection.execute(text("CREATE TABLE inv_assc (User_user_id INTEGER, Inventory_stock VARCHAR)"))
+
+    dbMigrations.migrate_user_db(engine)
+    dbMigrations.migrate_user_db(engine)
+
+    assert "ix_fav_asso_User_user_id" in _index_names(engine, "fav_asso")
+    assert "ix_inv_assc_User_user_id" in _index_names(engine, "inv_assc")
+    with engine.connect() as connection:
+        plan = " ".join(row[-1] for row in connection.execute(
+            text("EXPLAIN QUERY PLAN SELECT Inventory_stock FROM inv_assc WHERE User_user_id = 1")))
+    assert "ix_inv_assc_User_user_id" in plan
+
+
+def test_ingredient_ranges_get_a_quantity_max(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "drinks.db"))
+    with engine.begin() as connection:
+        # ingredients as it was before ranges were stored
+        connection.execute(text("CREATE TABLE ingredients (ing_id INTEGER PRIMARY KEY, ing VARCHAR, quantity FLOAT, "
+                                "measurement VARCHAR, popularity INTEGER, simple_ing VARCHAR)"))
+        connection.execute(text("CREATE TABLE simple (ing VARCHAR PRIMARY KEY, population INTEGER)"))
+        connection.execute(text("INSERT INTO ingredients (ing, quantity, measurement) VALUES ('RYE', 2.0, 'oz.')"))
+
+    dbMigrations.migrate_drinks_db(engine)
+    dbMigrations.migrate_drinks_db(engine)
+
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT quantity, quantity_max FROM ingredients")).fetchall() == [(2.0, 2.0)]
+
+
+def test_importing_drinks_db_leaves_an_old_database_alone(tmp_path):
+    path = tmp_path / "drinks.db"
+    engine = create_engine("sqlite:///{}".format(path))
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE ingredients (ing_id INTEGER PRIMARY KEY, ing VARCHAR, quantity FLOAT, "
+                                "measurement VARCHAR, popularity INTEGER, simple_ing VARCHAR)"))
+    engine.dispose()
+
+    # A fresh interpreter, so the import really runs
+    environment = dict(os.environ, COCKTAIL_DRINKS_DB=str(path), COCKTAIL_USER_DB=str(tmp_path / "user.db"))
+    subprocess.run([sys.executable, "-c", "import drinksSqlDb"], check=True, env=environment,
+                   cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    with engine.connect() as connection:
+        columns = [row[1] for row in connection.execute(text("PRAGMA table_info(ingredients)"))]
+    assert "ing_key" not in columns
+    assert "quantity_max" not in columns
@@ -0,0 +1,51 @@
+import pytest
+
+import drinksSqlDb
+from ingParser import ParsedIngredient, parse_column, parse_ingredient
+
+
+@pytest.mark.parametrize("cell, expected", [
+    ("2 RYE WHISKEY", ParsedIngredient(2.0, 2.0, "oz.", "RYE WHISKEY")),
+    ("1 1/2 OZ. RYE", ParsedIngredient(1.5, 1.5, "oz.", "RYE")),
+    ("1 1/2 RYE", ParsedIngredient(1.5, 1.5, "oz.", "RYE")),
+    ("3/4 LEMON JUICE", ParsedIngredient(0.75, 0.75, "oz.", "LEMON JUICE")),
+    ("1-2 DASHES PEYCHAUD'S BITTERS", ParsedIngredient(1.0, 2.0, "DASHES", "PEYCHAUD'S BITTERS")),
+    ("1 BARSPOON MARASCHINO", ParsedIngredient(1.0, 1.0, "BARSPOON", "MARASCHINO")),
+    ("ABSINTHE RINSE", ParsedIngredient(0, 0, "oz.", "ABSINTHE RINSE")),
+])
+def test_measured_cells(cell, expected):
+    assert parse_ingredient(cell) == expected
+
+
+@pytest.mark.parametrize("cell, quantity, name", [
+    ("1 EGG WHITE", 1.0, "EGG WHITE"),
+    ("EGG", 0, "EGG"),
+    ("2 EGGS", 2.0, "EGGS"),
+    ("MINT", 0, "MINT"),
+    ("6 MINT", 6.0, "MINT"),
+    ("10 MINT LEAVES", 10.0, "MINT LEAVES"),
+    ("2 FUJI APPLE SLICES", 2.0, "FUJI APPLE SLICES"),
+    ("1 WHOLE EGG", 1.0, "WHOLE EGG"),
+])
+def test_counted_cells_have_no_unit(cell, quantity, name):
+    assert parse_ingredient(cell) == ParsedIngredient(quantity, quantity, "", name)
+
+
+@pytest.mark.parametrize("cell", ["2 MINTED SYRUP", "1 EGGNOG"])
+def test_counted_words_only_match_whole_words(cell):
+    assert parse_ingredient(cell).unit == "oz."
+
+
+@pytest.mark.parametrize("cell", ["2 OZ", "3 ML", "1 DASH", "  ", "1 1/2", "1-2", "2"])
+def test_cells_without_a_name_are_rejected(cell):
+    with pytest.raises(ValueError):
+        parse_ingredient(cell)
+
+
+def test_parse_column_keeps_blanks():
+    assert parse_column(["2 GIN", "", None]) == [ParsedIngredient(2.0, 2.0, "oz.", "GIN"), None, None]
+
+
+def test_ing_regex_keeps_the_top_of_a_range():
+    assert drinksSqlDb.ing_regex("1-2 DASHES ANGOSTURA BITTERS") == (1.0, 2.0, "DASHES", "ANGOSTURA BITTERS")
+    assert drinksSqlDb.ing_regex("2 RYE") == (2.0, 2.0, "oz.", "RYE")
@@ -0,0 +1,91 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import catalog
+import drinksSqlDb
+from drinksSqlDb import Drink, Ingredient, Simple_Drink
+from makeableCache import MakeableStore
+
+# Both gins simplify to GIN, so they share one makeable bit. RYE is in no recipe
+STOCK = ["London Dry Gin", "Plymouth Gin", "Gin", "Lemon Juice", "Simple Syrup", "Campari", "Sweet Vermouth",
+         "Angostura Bitters", "Rye"]
+
+DRINKS = {
+    "GIN SOUR": ["LONDON DRY GIN", "LEMON JUICE", "SIMPLE SYRUP"],
+    "MARTINEZ": ["PLYMOUTH GIN", "SWEET VERMOUTH", "ANGOSTURA BITTERS"],
+    "NEGRONI": ["LONDON DRY GIN", "CAMPARI", "SWEET VERMOUTH"],
+    "GIN AND BITTERS": ["PLYMOUTH GIN", "ANGOSTURA BITTERS"],
+}
+
+# Swapped in and out of drinks.db between catalog reloads
+EXTRA_DRINK = ("AMERICANO", ["CAMPARI", "SWEET VERMOUTH"])
+
+
+@pytest.fixture
+def drinks_db(tmp_path):
+    path = str(tmp_path / "drinks.db")
+    engine = create_engine("sqlite:///{}".format(path))
+    drinksSqlDb.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(Simple_Drink(ing="GIN"))
+    ingredients = {name: Ingredient(ing=name, quantity=1.0, measurement="oz.", popularity=1,
+                                    simple_ing="GIN" if name.endswith(" GIN") else None)
+                   for name in set(sum(DRINKS.values(), []))}
+    for name, parts in DRINKS.items():
+        drink = Drink(drink_name=name, page="1")
+        drink.ingredients = [ingredients[part] for part in parts]
+        session.add(drink)
+    session.commit()
+
+    original = drinksSqlDb.DB_PATH
+    drinksSqlDb.use_database(path).dispose()
+    yield session, ingredients
+    session.close()
+    engine.dispose()
+    drinksSqlDb.use_database(original).dispose()
+    catalog.reload_catalog()
+
+
+def _toggle_extra_drink(session, ingredients):
+    name, parts = EXTRA_DRINK
+    drink = session.query(Drink).filter(Drink.drink_name == name).first()
+    if drink:
+        session.delete(drink)
+    else:
+        drink = Drink(drink_name=name, page="2")
+        drink.ingredients = [ingredients[part] for part in parts]
+        session.add(drink)
+    session.commit()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_incremental_updates_match_a_full_recompute(drinks_db, seed):
+    session, ingredients = drinks_db
+    rand = random.Random(seed)
+    store = MakeableStore()
+    drink_catalog = catalog.reload_catalog()
+    inventory = set()
+    user = SimpleNamespace(user_id=1, stock=[])
+
+    for step in range(300):
+        if step and step % 50 == 0:
+            # A new catalog version: the next change finds the entry stale, or a refresh rebuilds it first
+            _toggle_extra_drink(session, ingredients)
+            drink_catalog = catalog.reload_catalog()
+            if step % 100 == 0:
+                store.refresh_all(drink_catalog).join()
+        stock = rand.choice(STOCK)
+        added = stock not in inventory
+        if added:
+            inventory.add(stock)
+        else:
+            inventory.discard(stock)
+        store.inventory_changed(user.user_id, stock, added)
+        user.stock = [SimpleNamespace(stock=item) for item in inventory]
+
+        expected = frozenset(drink_catalog.makeable(drink_catalog.inventory_mask(inventory)))
+        assert store.get(user) == expected, "step {}: {} {}".format(step, "added" if added else "removed", stock)
@@ -0,0 +1,75 @@
+import urllib.request
+
+import pytest
+
+from metrics import Histogram, MetricsServer, Registry
+
+
+def test_observations_land_in_the_first_bucket_they_fit():
+    histogram = Histogram((1.0, 2.0, 4.0))
+    for value in (0.5, 1.0, 1.5, 4.0, 9.0):
+        histogram.observe(value)
+    # A value equal to a bound counts in that bucket, like Prometheus' "le"
+    assert histogram.counts == [2, 1, 1, 1]
+    assert histogram.count == 5
+    assert histogram.sum == 16.0
+
+
+def test_quantile_interpolates_within_the_bucket():
+    histogram = Histogram((1.0, 2.0, 4.0))
+    assert histogram.quantile(0.5) == 0.0
+    for value in (0.5, 1.5, 1.5, 3.0):
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == pytest.approx(1.5)
+    assert histogram.quantile(0.25) == pytest.approx(1.0)
+    assert histogram.quantile(1.0) == pytest.approx(4.0)
+
+
+def test_quantile_above_every_bound_is_the_largest_bound():
+    histogram = Histogram((1.0, 2.0))
+    histogram.observe(5.0)
+    assert histogram.quantile(0.99) == 2.0
+
+
+def test_render_uses_the_prometheus_text_format():
+    registry = Registry(buckets=(0.1, 1.0))
+    registry.describe("handler_seconds", "histogram", "Handler time")
+    registry.describe("errors_total", "counter", "Errors")
+    registry.observe("handler_seconds", 0.05, handler="drinks")
+    registry.observe("handler_seconds", 0.5, handler="drinks")
+    registry.increment("errors_total", handler='say "hi"', error="ValueError")
+    registry.gauge("queue_depth", "Queued updates", lambda: 3)
+    registry.gauge("broken", "Raises", lambda: 1 / 0)
+
+    assert registry.render().splitlines() == [
+        "# HELP handler_seconds Handler time",
+        "# TYPE handler_seconds histogram",
+        'handler_seconds_bucket{handler="drinks",le="0.1"} 1',
+        'handler_seconds_bucket{handler="drinks",le="1.0"} 2',
+        'handler_seconds_bucket{handler="drinks",le="+Inf"} 2',
+        'handler_seconds_sum{handler="drinks"} 0.55',
+        'handler_seconds_count{handler="drinks"} 2',
+        "# HELP errors_total Errors",
+        "# TYPE errors_total counter",
+        'errors_total{error="ValueError",handler="say \\"hi\\""} 1',
+        "# HELP queue_depth Queued updates",
+        "# TYPE queue_depth gauge",
+        "queue_depth 3",
+        "# HELP broken Raises",
+        "# TYPE broken gauge",
+    ]
+
+
+def test_server_serves_metrics():
+    registry = Registry()
+    registry.gauge("queue_depth", "Queued updates", lambda: 7)
+    server = MetricsServer(port=0, metrics_registry=registry)
+    server.start()
+    try:
+        with urllib.request.urlopen(server.local_url, timeout=5) as response:
+            assert "queue_depth 7" in response.read().decode("utf8")
+        # A second server on a port that's taken fails to bind, which telegramBot logs instead of crashing
+        with pytest.raises(OSError):
+            MetricsServer(port=server.server_address[1])
+    finally:
+        server.stop()
@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+
+from asyncRuntime import AsyncRuntime, BotProxy
+from outbound import Outbox, TokenBucket
+
+
+def test_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2, capacity=2)
+    bucket.updated = 100.0
+    bucket.tokens = 0.0
+    assert bucket.delay(100.0) == 0.5
+    assert bucket.delay(100.5) == 0.0
+
+
+def test_no_tokens_build_up_during_a_pause():
+    bucket = TokenBucket(rate=10, capacity=10)
+    bucket.updated = 100.0
+    bucket.pause(100.0, 5)
+    assert bucket.delay(102.0) == 3.0
+    # Right after the pause only what refilled since it ended is available, not a full burst
+    assert bucket.delay(105.0) == 0.1
+    bucket.delay(105.1)
+    bucket.take()
+    assert bucket.delay(105.1) > 0
+
+
+class _FloodedBot:
+    """Raises a flood control error on the first send, like Telegram does when the limits are exceeded"""
+
+    def __init__(self, error):
+        self.error = error
+        self.attempts = 0
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.attempts += 1
+        if self.attempts == 1:
+            raise self.error
+        self.sent.append((chat_id, text))
+
+
+def test_retry_after_from_an_asyncio_handler_is_retried():
+    error = pytest.importorskip("telegram.error", exc_type=ImportError)
+    bot = _FloodedBot(error.RetryAfter(0.05))
+    outbox = Outbox()
+    runtime = AsyncRuntime()
+    runtime.start()
+
+    def reply(bot, update):
+        assert isinstance(bot, BotProxy)
+        outbox.send(bot, 42, "Gimlet")
+
+    runtime.callback(runtime.offload(reply))(bot, None)
+    runtime.stop()
+    outbox.stop()
+    assert bot.attempts == 2
+    assert bot.sent == [(42, "Gimlet")]
+
+
+class _SlowBot:
+    def __init__(self):
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text, **kwargs):
+        # Earlier messages take longer, so a chat sent to from two threads at once would come out of order
+        time.sleep(0.01 if text.endswith("0") else 0.001)
+        with self._lock:
+            self.sent.append((chat_id, text))
+
+
+def test_messages_to_one_chat_stay_in_order_across_senders():
+    bot = _SlowBot()
+    outbox = Outbox(global_rate=1000, chat_rate=1000, chat_burst=1000, senders=4)
+    for number in range(20):
+        for chat_id in (1, 2, 3):
+            outbox.send(bot, chat_id, "message {}".format(number))
+    outbox.stop()
+    for chat_id in (1, 2, 3):
+        assert [text for sent_to, text in bot.sent if sent_to == chat_id] == ["message {}".format(number)
+                                                                             for number in range(20)]
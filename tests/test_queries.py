@@ -0,0 +1,52 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import drinksSqlDb
+from drinksSqlDb import Drink, Garnish, Ingredient
+from sqlMetrics import QueryCounter
+
+
+def _drinks_session(drinks):
+    """In-memory drinks database with the given number of drinks, two ingredients and a garnish each"""
+    engine = create_engine("sqlite://")
+    drinksSqlDb.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    for number in range(drinks):
+        drink = Drink(drink_name="DRINK {}".format(number), page=str(number))
+        drink.ingredients = [Ingredient(ing="GIN {}".format(number), quantity=2.0, measurement="oz.", popularity=1),
+                             Ingredient(ing="LEMON JUICE {}".format(number), quantity=0.75, measurement="oz.",
+                                        popularity=1)]
+        drink.garnishes = [Garnish(gar="LEMON TWIST {}".format(number))]
+        session.add(drink)
+    session.commit()
+    session.close()
+    return engine, sessionmaker(bind=engine)()
+
+
+def _load_everything(engine, session, eager):
+    with QueryCounter(engine) as counter:
+        for drink in drinksSqlDb.drink_query(session, eager=eager).all():
+            [ingredient.ing for ingredient in drink.ingredients]
+            [garnish.gar for garnish in drink.garnishes]
+    return counter.count
+
+
+@pytest.mark.parametrize("drinks", [1, 10, 50])
+def test_eager_drink_query_runs_three_statements(drinks):
+    engine, session = _drinks_session(drinks)
+    try:
+        # Drinks, then one SELECT for every drink's ingredients and one for every drink's garnishes
+        assert _load_everything(engine, session, eager=True) == 3
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def test_lazy_drink_query_runs_a_statement_per_drink():
+    engine, session = _drinks_session(10)
+    try:
+        assert _load_everything(engine, session, eager=False) == 1 + 2 * 10
+    finally:
+        session.close()
+        engine.dispose()
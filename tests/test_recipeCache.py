@@ -0,0 +1,25 @@
+from catalog import Recipe, RecipeGarnish, RecipeIngredient
+from searchDB import RecipeCache
+
+
+def _recipe(name):
+    return Recipe(name, "1", [RecipeIngredient(1, "GIN", 2.0, "oz.", 1, "gin", 2.0)], [RecipeGarnish("LEMON TWIST")])
+
+
+def test_newer_version_replaces_cached_messages():
+    cache = RecipeCache()
+    cache.get(_recipe("GIMLET"), 1)
+    cache.get(_recipe("GIMLET"), 2)
+    assert cache.stats()["version"] == 2
+    assert cache.misses == 2
+
+
+def test_older_version_does_not_wipe_newer_messages():
+    cache = RecipeCache()
+    cache.get(_recipe("GIMLET"), 2)
+    # A request still holding the previous catalog renders without caching
+    old_text = cache.get(_recipe("MARTINI"), 1)
+    assert old_text
+    assert cache.stats() == {"version": 2, "size": 1, "hits": 0, "misses": 2}
+    cache.get(_recipe("GIMLET"), 2)
+    assert cache.hits == 1
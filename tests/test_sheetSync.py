@@ -0,0 +1,55 @@
+import csv
+
+import dbEngine
+import drinksSqlDb
+import sheetSync
+
+HEADER = ["Drink", "Page"] + ["Ingredient {}".format(number) for number in range(1, 11)] + ["Garnish"]
+
+
+def _write_csv(path, rows):
+    with open(str(path), "w", newline="", encoding="utf8") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        for row in rows:
+            writer.writerow(row + [""] * (len(HEADER) - len(row)))
+
+
+def _sync(engine, csv_path):
+    session = drinksSqlDb.BuildSession(bind=engine)
+    return sheetSync.sync_from_worksheet(sheetSync.CsvWorksheet(str(csv_path)), session)
+
+
+def test_sync_only_applies_changed_rows(tmp_path):
+    engine = dbEngine.builder_engine(str(tmp_path / "drinks.db"))
+    drinksSqlDb.Base.metadata.create_all(engine)
+    csv_path = tmp_path / "AllDrinks.csv"
+    rows = [["GIMLET", "12", "2 GIN", "3/4 LIME JUICE", "3/4 SIMPLE SYRUP"],
+            ["DAIQUIRI", "14", "2 RUM", "1 LIME JUICE", "3/4 SIMPLE SYRUP"],
+            ["MANHATTAN", "20", "2 RYE WHISKEY", "1 SWEET VERMOUTH", "2 DASHES ANGOSTURA BITTERS"]]
+    try:
+        _write_csv(csv_path, rows)
+        report = _sync(engine, csv_path)
+        assert (len(report.added), len(report.updated), len(report.removed), report.unchanged) == (3, 0, 0, 0)
+
+        rows[1] = ["DAIQUIRI", "14", "2 AGED RUM", "1 LIME JUICE", "3/4 SIMPLE SYRUP"]
+        _write_csv(csv_path, rows)
+        report = _sync(engine, csv_path)
+        assert report.added == []
+        assert report.updated == ["DAIQUIRI"]
+        assert report.removed == []
+        assert report.unchanged == 2
+
+        session = drinksSqlDb.BuildSession(bind=engine)
+        try:
+            daiquiri = session.query(drinksSqlDb.Drink).filter_by(drink_name="DAIQUIRI").one()
+            assert sorted(ingredient.ing for ingredient in daiquiri.ingredients) == [
+                "AGED RUM", "LIME JUICE", "SIMPLE SYRUP"]
+        finally:
+            session.close()
+
+        report = _sync(engine, csv_path)
+        assert not report
+        assert report.unchanged == 3
+    finally:
+        engine.dispose()
@@ -0,0 +1,63 @@
+import logging
+import os
+import signal
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+try:
+    import telegramBot
+except ImportError:
+    pytest.skip("telegramBot needs python-telegram-bot", allow_module_level=True)
+import outbound
+from fakeBotApi import FakeBotApi
+from telegram.ext import Updater
+
+
+@pytest.fixture
+def api():
+    server = FakeBotApi(send_latency=0.02)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def webhook_bot(monkeypatch, api):
+    monkeypatch.setattr(telegramBot, "settings", SimpleNamespace(
+        update_mode="webhook", webhook_url="https://example.invalid/telegram", webhook_listen="127.0.0.1",
+        webhook_port=0, webhook_path="telegram"), raising=False)
+    monkeypatch.setattr(telegramBot, "info_log", logging.getLogger("info.telegramBot"), raising=False)
+    monkeypatch.setattr(telegramBot, "outbox", outbound.Outbox(global_rate=1000, chat_rate=1000, chat_burst=1000),
+                        raising=False)
+    telegramBot.stop_requested.clear()
+    previous = {signum: signal.getsignal(signum) for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT)}
+    yield Updater(token=api.token, base_url=api.base_url)
+    for signum, handler in previous.items():
+        signal.signal(signum, handler)
+    telegramBot.stop_requested.clear()
+
+
+def test_stop_signal_in_webhook_mode_sends_queued_replies(api, webhook_bot):
+    updater = webhook_bot
+    receiver = telegramBot.start_updates(updater, updater.dispatcher, "secret")
+    assert api.webhook_url == "https://example.invalid/telegram"
+
+    # 20 sends at 20ms each are still queued when the signal arrives
+    for number in range(20):
+        telegramBot.outbox.send(updater.bot, 42, "reply {}".format(number))
+    threading.Timer(0.05, os.kill, (os.getpid(), signal.SIGTERM)).start()
+    telegramBot.wait_for_stop()
+    assert telegramBot.outbox.depth() > 0
+    telegramBot.shutdown(updater, updater.dispatcher, receiver)
+
+    assert telegramBot.outbox.depth() == 0
+    assert [text for chat_id, text, received_at in api.sent] == ["reply {}".format(number)
+                                                                 for number in range(20)]
+    assert not updater.dispatcher.running
+
+
+def test_kill_asks_the_main_thread_to_stop(webhook_bot):
+    telegramBot.kill(None, None, [])
+    assert telegramBot.stop_requested.is_set()
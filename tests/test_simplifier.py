@@ -0,0 +1,44 @@
+import json
+import os
+
+import pytest
+
+from drinksSqlDb import Simplifier
+
+SIMPLIFY_JSON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "json", "simplify.json")
+
+
+@pytest.fixture
+def simplifier():
+    return Simplifier({"chartreuse": "chartreuse", "green chartreuse": "green chartreuse",
+                       "yellow chartreuse": "yellow chartreuse", "gin": "gin", "rum": "rum", "vermouth": "vermouth",
+                       "sweet vermouth": "sweet vermouth"})
+
+
+@pytest.mark.parametrize("name, simplified", [
+    # Overlapping keys: the longer one starting first wins
+    ("GREEN CHARTREUSE", "green chartreuse"),
+    ("YELLOW CHARTREUSE V.E.P.", "yellow chartreuse"),
+    ("CHARTREUSE ELIXIR", "chartreuse"),
+    ("CARPANO SWEET VERMOUTH", "sweet vermouth"),
+    # A whole word beats a key inside a longer word, wherever it starts
+    ("SMITH & CROSS RUM GINGER", "rum"),
+    ("GINGER SYRUP", "gin"),
+    ("GRAPEFRUIT JUICE", None),
+])
+def test_classify_picks_the_best_match(simplifier, name, simplified):
+    assert simplifier.classify(name)[0] == simplified
+
+
+def test_classify_reports_every_match(simplifier):
+    assert simplifier.classify("GREEN CHARTREUSE") == ("green chartreuse", ["chartreuse", "green chartreuse"])
+
+
+@pytest.mark.parametrize("name, simplified", [
+    ("LEMON HART ORIGINAL RUM", "rum"),
+    ("LAIRD'S BONDED APPLE BRANDY", "apple brandy"),
+    ("DOLIN DRY VERMOUTH", "dry vermouth"),
+])
+def test_classify_with_simplify_json(name, simplified):
+    with open(SIMPLIFY_JSON) as f:
+        assert Simplifier(json.load(f)).classify(name)[0] == simplified
@@ -0,0 +1,30 @@
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from sqlMetrics import SessionTracker
+
+
+def _query(session):
+    session.execute(text("SELECT 1"))
+
+
+def test_only_sessions_left_open_are_reported_with_their_caller():
+    Session = sessionmaker(bind=create_engine("sqlite://"))
+    tracker = SessionTracker()
+    tracker.watch(Session)
+    started = time.monotonic()
+
+    closed = Session()
+    _query(closed)
+    closed.close()
+    leaked = Session()
+    _query(leaked)
+
+    (seconds, caller), = tracker.opened_since(started, threading.get_ident())
+    assert caller.startswith(__file__ + ":")
+    assert caller.endswith(" in _query")
+    leaked.close()
+    assert tracker.opened_since(started, threading.get_ident()) == []
@@ -0,0 +1,63 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+import catalog
+import drinksSqlDb
+import userSqlDb
+from drinksSqlDb import Drink, Garnish, Ingredient
+
+
+@pytest.fixture
+def databases(tmp_path):
+    """A drinks.db with three drinks and an empty user.db that attaches it, swapped in for the test"""
+    drinks_path = str(tmp_path / "drinks.db")
+    engine = create_engine("sqlite:///{}".format(drinks_path))
+    drinksSqlDb.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    gin = Ingredient(ing="GIN", quantity=2.0, measurement="oz.", popularity=3)
+    for name, garnishes in (("GIMLET", ["LIME WHEEL"]), ("MARTINI", ["LEMON TWIST", "OLIVE"]), ("NEGRONI", [])):
+        drink = Drink(drink_name=name, page="1")
+        drink.ingredients = [gin, Ingredient(ing="{} MODIFIER".format(name), quantity=0.75, measurement="oz.",
+                                             popularity=1)]
+        drink.garnishes = [Garnish(gar=garnish) for garnish in garnishes]
+        session.add(drink)
+    session.commit()
+    session.close()
+    engine.dispose()
+
+    original_drinks, original_users = drinksSqlDb.DB_PATH, userSqlDb.USER_DB_PATH
+    drinksSqlDb.use_database(drinks_path).dispose()
+    userSqlDb.use_database(str(tmp_path / "user.db")).dispose()
+    yield catalog.reload_catalog()
+    userSqlDb.use_database(original_users).dispose()
+    drinksSqlDb.use_database(original_drinks).dispose()
+    catalog.reload_catalog()
+
+
+def test_favorite_recipes_match_the_orm_path(databases):
+    session = userSqlDb.Session()
+    try:
+        user, session = userSqlDb.add_user(7, 7, "Test", session=session)
+        for name in ("MARTINI", "NO LONGER LISTED", "GIMLET"):
+            userSqlDb.set_user_favorite(user, name, session)
+
+        # What /fav did before the attached query: favorite names looked up one by one in the catalog
+        expected = [databases.find_drink(favorite.favorites) for favorite in userSqlDb.get_user_favorites(user)]
+        expected = [recipe for recipe in expected if recipe]
+        assert [recipe.drink_name for recipe in expected] == ["MARTINI", "GIMLET"]
+        assert userSqlDb.get_favorite_recipes(user.user_id, session) == expected
+    finally:
+        session.close()
+
+
+def test_attached_drinks_db_is_read_only(databases):
+    session = userSqlDb.Session()
+    try:
+        with pytest.raises(OperationalError, match="readonly"):
+            session.execute(text("DELETE FROM {}.drinks".format(userSqlDb.DRINKS_SCHEMA)))
+    finally:
+        session.rollback()
+        session.close()
+    assert len(catalog.reload_catalog()) == 3
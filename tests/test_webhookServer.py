@@ -0,0 +1,69 @@
+import http.client
+import json
+import queue
+
+import pytest
+
+try:
+    import webhookServer
+except ImportError:
+    pytest.skip("webhookServer needs python-telegram-bot", allow_module_level=True)
+from webhookServer import SECRET_HEADER, WebhookReceiver, post_update
+
+SECRET = "test-secret"
+
+UPDATE = {"update_id": 7, "message": {"message_id": 1, "date": 0, "text": "/help",
+                                      "chat": {"id": 42, "type": "private"},
+                                      "from": {"id": 42, "is_bot": False, "first_name": "Test"}}}
+
+
+@pytest.fixture
+def receiver():
+    server = WebhookReceiver(None, queue.Queue(), SECRET, port=0, url_path="telegram")
+    server.start()
+    yield server
+    server.stop()
+
+
+def _post(receiver, headers, body=b""):
+    """Posts raw bytes with exactly the headers given, so malformed requests can be sent"""
+    connection = http.client.HTTPConnection(*receiver.server_address, timeout=5)
+    try:
+        connection.putrequest("POST", "/telegram")
+        for name, value in headers.items():
+            connection.putheader(name, value)
+        connection.endheaders(body)
+        return connection.getresponse().status
+    finally:
+        connection.close()
+
+
+def test_update_with_the_secret_is_queued(receiver):
+    assert post_update(receiver.local_url, json.dumps(UPDATE), SECRET) == 200
+    update = receiver.update_queue.get(timeout=5)
+    assert update.update_id == 7
+    assert update.message.text == "/help"
+
+
+def test_bad_secret_is_rejected(receiver):
+    assert post_update(receiver.local_url, json.dumps(UPDATE), "wrong") == 403
+    assert receiver.update_queue.empty()
+
+
+def test_unknown_path_is_not_found(receiver):
+    assert post_update(receiver.local_url + "/other", json.dumps(UPDATE), SECRET) == 404
+
+
+@pytest.mark.parametrize("length", ["abc", "-1"])
+def test_bad_content_length_is_a_bad_request(receiver, length):
+    assert _post(receiver, {SECRET_HEADER: SECRET, "Content-Length": length}) == 400
+    assert receiver.update_queue.empty()
+
+
+def test_body_that_isnt_an_update_is_a_bad_request(receiver):
+    body = b"not json"
+    assert _post(receiver, {SECRET_HEADER: SECRET, "Content-Length": str(len(body))}, body) == 400
+
+
+def test_oversized_body_is_refused(receiver):
+    assert _post(receiver, {SECRET_HEADER: SECRET, "Content-Length": str(webhookServer.MAX_BODY + 1)}) == 413
@@ -0,0 +1,79 @@
+import functools
+import logging
+import threading
+import time
+
+import drinksSqlDb
+import userSqlDb
+from sqlMetrics import session_tracker
+
+uow_warn = logging.getLogger("warn." + __name__)
+
+session_tracker.watch(drinksSqlDb.Session)
+session_tracker.watch(drinksSqlDb.BuildSession)
+session_tracker.watch(userSqlDb.Session)
+
+_local = threading.local()
+
+
+class UnitOfWork:
+    """
+    The database sessions for handling one update: at most one drinks.db session and one user.db session, opened
+    the first time they're used and always closed when the update is done
+    """
+
+    def __init__(self):
+        self._drinks = None
+        self._users = None
+        self._started = None
+
+    @property
+    def drinks(self):
+        if self._drinks is None:
+            self._drinks = drinksSqlDb.Session()
+        return self._drinks
+
+    @property
+    def users(self):
+        if self._users is None:
+            self._users = userSqlDb.Session()
+        return self._users
+
+    def __enter__(self):
+        self._started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Closes both sessions, rolling back anything that wasn't committed"""
+        for session in (self._drinks, self._users):
+            if session is not None:
+                session.close()
+        self._drinks = self._users = None
+        # Anything this thread opened during the update and didn't close is a leak
+        for seconds, caller in session_tracker.opened_since(self._started, threading.get_ident()):
+            uow_warn.warning("Session opened at {} is still open {:.1f}s after its update started".format(
+                caller, seconds))
+
+
+def current():
+    """Returns the UnitOfWork of the update being handled on this thread"""
+    uow = getattr(_local, "uow", None)
+    if uow is None:
+        raise RuntimeError("No update is being handled on this thread, wrap the handler with per_update()")
+    return uow
+
+
+def per_update(handler):
+    """Wraps a (bot, update, ...) handler so it runs inside its own UnitOfWork"""
+    @functools.wraps(handler)
+    def wrapper(bot, update, *args, **kwargs):
+        with UnitOfWork() as uow:
+            _local.uow = uow
+            try:
+                return handler(bot, update, *args, **kwargs)
+            finally:
+                _local.uow = None
+    return wrapper
@@ -1,3 +0,0 @@
-#!/bin/bash
-
-python3 ftpHandler.py down /home/pi/cocktail-telegram-bot/drinks.db drinks.db
\ No newline at end of file
@@ -1,6 +1,13 @@
 import logging, os.path
-
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Table
+from collections import OrderedDict
+from urllib.request import pathname2url
+
+import catalog
+import dbEngine
+import dbMigrations
+import drinksSqlDb
+from dbMigrations import key_default, normalize_key
+from sqlalchemy import Column, Integer, String, ForeignKey, Table, event, text
 from sqlalchemy.exc import IntegrityError, InvalidRequestError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
@@ -8,20 +15,34 @@ from sqlalchemy.orm import sessionmaker, relationship
 user_log = logging.getLogger("info." + __name__)
 user_warn = logging.getLogger("warn." + __name__)
 
-# dbpath = os.path.join(os.path.abspath(os.path.dirname(__file__)), "user.db")
-# engine = create_engine('sqlite:////{}'.format(dbpath))
-engine = create_engine('sqlite:///user.db')
+# COCKTAIL_USER_DB points it somewhere else, eg. a scratch file for the tests
+USER_DB_PATH = os.path.abspath(os.environ.get("COCKTAIL_USER_DB") or
+                               os.path.join(os.path.abspath(os.path.dirname(__file__)), "user.db"))
+engine = dbEngine.user_engine(USER_DB_PATH)
+
+# Name drinks.db is attached under on every user.db connection
+DRINKS_SCHEMA = "drinks_db"
+
+
+def attach_drinks_db(dbapi_connection, connection_record):
+    """Favorites are stored by drink name, so attaching drinks.db lets one query join them to their recipes.
+    It's attached read only, like the drinks.db engine's query_only, so nothing done through user.db can change it.
+    dbUpdater disposes this engine after installing a new drinks.db, so new connections attach the new file"""
+    dbapi_connection.execute("ATTACH DATABASE ? AS {}".format(DRINKS_SCHEMA),
+                             ("file:{}?mode=ro".format(pathname2url(drinksSqlDb.DB_PATH)),))
+
+event.listen(engine, "connect", attach_drinks_db)
 
 Base = declarative_base()
 # Bind the new Session to our engine
 Session = sessionmaker(bind=engine)
 
 fav_assc_table = Table('fav_asso', Base.metadata,
-                       Column('User_user_id', Integer, ForeignKey('users.user_id')),
+                       Column('User_user_id', Integer, ForeignKey('users.user_id'), index=True),
                        Column('Favorite_drink', String, ForeignKey('favorites.favorites')))
 
 inv_assc_table = Table('inv_assc', Base.metadata,
-                       Column('User_user_id', Integer, ForeignKey('users.user_id')),
+                       Column('User_user_id', Integer, ForeignKey('users.user_id'), index=True),
                        Column('Inventory_stock', String, ForeignKey('inv.stock')))
 
 class User(Base):
@@ -45,6 +66,8 @@ class Favorite(Base):
     __tablename__ = 'favorites'
     favorites = Column(String, primary_key= True)
     popularity = Column(Integer)
+    # Case folded copy of the name, so lookups are an index seek instead of a LIKE scan
+    favorite_key = Column(String, default=key_default("favorites"), index=True, unique=True)
 
     def __repr__(self):
         return "<Favorite(favorite={}, popularity = {})>".format(self.favorites, self.popularity)
@@ -56,18 +79,46 @@ class Inventory(Base):
     __tablename__ = 'inv'
 
     stock = Column(String, primary_key= True)
+    stock_key = Column(String, default=key_default("stock"), index=True, unique=True)
     usr_inv = relationship("User", secondary = inv_assc_table)
 
     def __repr__(self):
         return "<Inventory(stock = {})>".format(self.stock)
 Base.metadata.create_all(engine)
+# Tables made before the key columns existed don't get them from create_all()
+dbMigrations.migrate_user_db(engine)
+
+def use_database(path):
+    """
+    Points new sessions at the user database file at path, eg. one made by generateDb for benchmarking
+    :param path: path to a user.db file, created if it doesn't exist
+    :return: the engine that was replaced
+    """
+    global engine
+    old_engine = engine
+    engine = dbEngine.user_engine(path)
+    event.listen(engine, "connect", attach_drinks_db)
+    Base.metadata.create_all(engine)
+    dbMigrations.migrate_user_db(engine)
+    Session.configure(bind=engine)
+    user_log.info("User sessions now use {}".format(path))
+    return old_engine
 
+# Functions called with (user_id, stock name, added) after a user's inventory change is committed
+inventory_listeners = []
 
-def add_user(user_id, chat_id, first_name, last_name = ""):
+def inventory_changed(user, ing_name, added):
+    """Tells every inventory listener that ing_name was added to (or removed from) user's inventory"""
+    for listener in inventory_listeners:
+        listener(user.user_id, ing_name, added)
+
+
+def add_user(user_id, chat_id, first_name, last_name = "", session = ""):
 
     new_user = User(user_id = user_id, first_name = first_name, chat_id = chat_id, last_name = last_name)
-    # create an instance of Session class
-    session = Session()
+    # create an instance of Session class if one wasn't given
+    if not session:
+        session = Session()
     # Add our User object to our Session
     session.add(new_user)
 
@@ -90,7 +141,7 @@ def set_user_favorite(user, fav_drink, session):
     :return:
     """
     """Adds drink to favorites table if not already in, then adds it to User's favorites list"""
-    in_table = check_drink_in_table(fav_drink)
+    in_table = check_drink_in_table(fav_drink, session)
     # If the drink isn't in the table, add it (it will be an empty list if not in table)
     if not in_table:
         user_log.debug("Adding {} to favorites table".format(fav_drink))
@@ -114,7 +165,7 @@ def set_user_favorite(user, fav_drink, session):
         user_warn.warning("Encountered IntegrityError in set_user_favorite(). Rolling session back")
 
 def rem_user_favorites(user, session, drink_name):
-    rem_drink = session.query(Favorite).filter(Favorite.favorites.like(drink_name)).first()
+    rem_drink = session.query(Favorite).filter(Favorite.favorite_key == normalize_key(drink_name)).first()
 
     try:
         user.favorites.remove(rem_drink)
@@ -135,11 +186,57 @@ def get_user_favorites(user):
     """
     return user.favorites
 
-def check_drink_in_table(drink_name):
-    """Checks to see if a drink is already in the favorites table, and returns it if so"""
-    session = Session()
-    favs = session.query(Favorite).filter(Favorite.favorites.like(drink_name)).first()
-    session.close()
+# Every favorite of one user with its ingredients and garnishes. Ingredients and garnishes come back as separate
+# rows of one UNION so a drink with several of each doesn't multiply out
+_favorite_recipes_sql = text("""
+    SELECT fav.rowid AS position, drink.drink_name, drink.page, 'ing' AS kind, link.rowid AS link_order,
+           ing.ing_id, ing.ing, ing.quantity, ing.measurement, ing.popularity, ing.simple_ing, ing.quantity_max
+    FROM fav_asso AS fav
+    JOIN {schema}.drinks AS drink ON drink.drink_name = fav.Favorite_drink
+    LEFT JOIN {schema}.ing_assc AS link ON link.Drink_name = drink.drink_name
+    LEFT JOIN {schema}.ingredients AS ing ON ing.ing_id = link.Ingredients_string
+    WHERE fav.User_user_id = :user_id
+    UNION ALL
+    SELECT fav.rowid, drink.drink_name, drink.page, 'gar', link.rowid,
+           NULL, link.Garnish_string, NULL, NULL, NULL, NULL, NULL
+    FROM fav_asso AS fav
+    JOIN {schema}.drinks AS drink ON drink.drink_name = fav.Favorite_drink
+    JOIN {schema}.gar_assc AS link ON link.Drink_name = drink.drink_name
+    WHERE fav.User_user_id = :user_id
+    ORDER BY position, kind DESC, link_order
+""".format(schema=DRINKS_SCHEMA))
+
+
+def get_favorite_recipes(user_id, session):
+    """
+    Loads a user's favorite drinks with all their ingredients and garnishes in a single query
+    :param user_id: Telegram user ID
+    :param session: user.db Session object
+    :return: list of catalog.Recipe in the order they were favorited. Favorites no longer in drinks.db are left out
+    """
+    recipes = OrderedDict()
+    for row in session.execute(_favorite_recipes_sql, {"user_id": user_id}):
+        name = row.drink_name
+        if name not in recipes:
+            recipes[name] = (row.page, [], [])
+        if row.kind == "ing" and row.ing_id is not None:
+            recipes[name][1].append(catalog.RecipeIngredient(row.ing_id, row.ing, row.quantity, row.measurement,
+                                                             row.popularity, row.simple_ing, row.quantity_max))
+        elif row.kind == "gar":
+            recipes[name][2].append(catalog.RecipeGarnish(row.ing))
+    return [catalog.Recipe(name, page, tuple(ingredients), tuple(garnishes))
+            for name, (page, ingredients, garnishes) in recipes.items()]
+
+
+def check_drink_in_table(drink_name, session = ""):
+    """Checks to see if a drink is already in the favorites table, and returns it if so.
+    If no session is given, one is opened and closed here"""
+    own_session = not session
+    if own_session:
+        session = Session()
+    favs = session.query(Favorite).filter(Favorite.favorite_key == normalize_key(drink_name)).first()
+    if own_session:
+        session.close()
     return favs
 
 def check_for_user_id(id, session = ""):
@@ -151,10 +248,14 @@ def check_for_user_id(id, session = ""):
     # session.close()
     return user, session
 
-def check_ing_in_inv(ing_name):
-    """Checks for ingredient name in inventory table"""
-    session = Session()
-    ing_exists = session.query(Inventory).filter(Inventory.stock.like(ing_name)).first()
+def check_ing_in_inv(ing_name, session = ""):
+    """Checks for ingredient name in inventory table. If no session is given, one is opened and closed here"""
+    own_session = not session
+    if own_session:
+        session = Session()
+    ing_exists = session.query(Inventory).filter(Inventory.stock_key == normalize_key(ing_name)).first()
+    if own_session:
+        session.close()
     return ing_exists
 
 
@@ -167,7 +268,7 @@ def add_inventory(user, ing_name, session):
     :return:
     """
     usr_sess = session
-    in_table = check_ing_in_inv(ing_name)
+    in_table = check_ing_in_inv(ing_name, usr_sess)
     if not in_table:
         user_log.debug("Adding {} to inventory table".format(ing_name))
         inv = Inventory(stock = ing_name) # Add the ingredient to the inventory table
@@ -192,6 +293,7 @@ def add_inventory(user, ing_name, session):
         user.stock.append(local_inv)
         usr_sess.commit()
         user_log.info("Added {} to inventory of user {}".format(ing_name, user.first_name))
+        inventory_changed(user, local_inv.stock, True)
     except InvalidRequestError as e:
         user_warn.error("InvalidRequestError {}".format(e))
         user_warn.error("The user already has {} in their inventory".format(ing_name))
@@ -208,11 +310,12 @@ def rem_inventory(user, session, ing):
     :param ing: The ingredient that should be removed from the user's inventory
     :return:
     """
-    inv_item = session.query(Inventory).filter(Inventory.stock.like(ing)).first()
+    inv_item = session.query(Inventory).filter(Inventory.stock_key == normalize_key(ing)).first()
     try:
         user.stock.remove(inv_item)
         session.commit()
         user_log.info("Removed {} from inventory of user {}".format(ing, user.first_name))
+        inventory_changed(user, inv_item.stock, False)
     except ValueError as e:
         user_warn.warning("Trying to remove a value that doesn't exist")
         raise
@@ -0,0 +1,139 @@
+#! python3
+"""
+Receives Telegram updates over a webhook and hands them to the dispatcher.
+Usage: python3 webhookServer.py update.json [url] [secret_token]
+posts a recorded update to a running receiver (default http://127.0.0.1:8443/telegram), for testing.
+"""
+import hmac
+import json
+import logging
+import sys
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from telegram import Update
+
+webhook_info = logging.getLogger("info." + __name__)
+webhook_warn = logging.getLogger("warn." + __name__)
+
+# Telegram sends the secret_token given to setWebhook in this header on every request
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Updates are a few KB at most, anything much bigger isn't from Telegram
+MAX_BODY = 1024 * 1024
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        receiver = self.server
+        if self.path.split("?")[0].strip("/") != receiver.url_path:
+            self._reply(404)
+            return
+        token = self.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode("utf8"), receiver.secret_token.encode("utf8")):
+            webhook_warn.warning("Rejected webhook request from {} with a bad secret token".format(
+                self.client_address[0]))
+            self._reply(403)
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            webhook_warn.error("Webhook request with a bad Content-Length: {}".format(
+                self.headers.get("Content-Length")))
+            self._reply(400)
+            return
+        if length > MAX_BODY:
+            self._reply(413)
+            return
+        try:
+            data = json.loads(self.rfile.read(length).decode("utf8"))
+            update = Update.de_json(data, receiver.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            webhook_warn.error("Could not read webhook update: {}".format(e))
+            self._reply(400)
+            return
+        receiver.update_queue.put(update)
+        self._reply(200)
+
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        webhook_info.debug(format % args)
+
+
+class WebhookReceiver(ThreadingMixIn, HTTPServer):
+    """
+    Small HTTP server that checks each POST for the webhook secret token and puts the update straight on the
+    dispatcher's update queue. It's meant to listen on localhost behind a reverse proxy that handles TLS
+    """
+    daemon_threads = True
+
+    def __init__(self, bot, update_queue, secret_token, listen="127.0.0.1", port=8443, url_path="telegram"):
+        """
+        :param bot: telegram.Bot, needed to build Update objects
+        :param update_queue: queue the dispatcher reads from (updater.update_queue)
+        :param secret_token: String Telegram must send in SECRET_HEADER. Required, so nobody else can post updates
+        :param listen: address to bind to
+        :param port: port to bind to, 0 picks a free one
+        :param url_path: path Telegram posts to
+        """
+        if not secret_token:
+            raise ValueError("A webhook secret token is required")
+        self.bot = bot
+        self.update_queue = update_queue
+        self.secret_token = secret_token
+        self.url_path = url_path.strip("/")
+        self._thread = None
+        HTTPServer.__init__(self, (listen, port), _WebhookHandler)
+
+    @property
+    def local_url(self):
+        return "http://{}:{}/{}".format(self.server_address[0], self.server_address[1], self.url_path)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="webhook", daemon=True)
+        self._thread.start()
+        webhook_info.info("Listening for webhook updates on {}".format(self.local_url))
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+
+def post_update(url, update_json, secret_token):
+    """
+    Posts one update to a webhook receiver the way Telegram would
+    :param url: receiver URL, eg. WebhookReceiver.local_url
+    :param update_json: update as a JSON String or bytes
+    :param secret_token: secret token to send
+    :return: HTTP status code of the reply
+    """
+    if isinstance(update_json, str):
+        update_json = update_json.encode("utf8")
+    request = urllib.request.Request(url, data=update_json, method="POST",
+                                     headers={"Content-Type": "application/json", SECRET_HEADER: secret_token})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1], 'rb') as f:
+        recorded = f.read()
+    target = sys.argv[2] if len(sys.argv) > 2 else "http://127.0.0.1:8443/telegram"
+    print(post_update(target, recorded, sys.argv[3] if len(sys.argv) > 3 else ""))